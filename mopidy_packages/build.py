@@ -0,0 +1,312 @@
+import concurrent.futures
+import gzip
+import hashlib
+import io
+import json
+import os
+import pathlib
+import shutil
+
+import flask
+
+import werkzeug.exceptions
+
+from mopidy_packages import models, upstream
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+
+MANIFEST_FILE = 'manifest.json'
+
+DETAIL_ENDPOINTS = {
+    'get_person': models.Person,
+    'list_person_projects': models.Person,
+    'get_project': models.Project,
+}
+
+LIST_ENDPOINTS = {
+    'list_people': models.Person,
+    'list_projects': models.Project,
+}
+
+# Endpoints of pages listing a person's projects, which thus depend on all
+# project data files
+PERSON_PROJECTS_ENDPOINTS = {'get_person', 'list_person_projects'}
+
+# Endpoints that only depend on the code generating the site
+STATIC_ENDPOINTS = {'index', 'list_api_endpoints'}
+
+# Suffixes of the precompressed variants of the pages
+COMPRESSED_SUFFIXES = ['.gz', '.br']
+
+
+def detail_pages():
+    """Get the endpoints and values of all person and project pages."""
+    pages = [
+        ('get_person', {'id': person.data['id']})
+        for person in models.Person.all()]
+    pages += [
+        ('get_project', {'id': project.data['id']})
+        for project in models.Project.all()]
+    return pages
+
+
+def person_projects_pages():
+    """Get the endpoints and values of the pages of each person's projects.
+
+    These pages are not enriched, so they are left to the freezer.
+    """
+    return [
+        ('list_person_projects', {'id': person.data['id']})
+        for person in models.Person.all()]
+
+
+def page_model(page):
+    endpoint, values = page
+    return DETAIL_ENDPOINTS[endpoint](id=values['id'])
+
+
+def page_urls(app, pages):
+    with app.test_request_context():
+        return [
+            flask.url_for(endpoint, **values) for endpoint, values in pages]
+
+
+def url_to_path(build_path, url):
+    if url.endswith('/'):
+        url += 'index.html'
+    return build_path / url.lstrip('/')
+
+
+def render_page(app, build_path, url):
+    """Render a page to a file.
+
+    Returns the validators of the upstream resources used to render it.
+    """
+    with upstream.recording() as fetched:
+        response = app.test_client().get(url)
+    if response.status_code != 200:
+        raise ValueError(
+            'Unexpected status %r on URL %s' % (response.status, url))
+
+    path = url_to_path(build_path, url)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(response.data)
+    return fetched
+
+
+def render_pages(app, build_path, urls, jobs):
+    """Render the given URLs of the app to files using ``jobs`` workers.
+
+    Each page is rendered exactly like Frozen-Flask would have rendered it,
+    so a freezer configured with ``FREEZER_SKIP_EXISTING`` can complete the
+    site afterwards without rendering these pages again.
+
+    Returns a dict mapping each URL to the validators of the upstream
+    resources used to render it.
+    """
+    with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+        futures = {
+            url: executor.submit(render_page, app, build_path, url)
+            for url in urls}
+        return {url: future.result() for url, future in futures.items()}
+
+
+def digest(paths):
+    sha = hashlib.sha256()
+    for path in paths:
+        sha.update(path.read_bytes())
+    return sha.hexdigest()
+
+
+def generator_digest():
+    """Get a digest of the code generating the site."""
+    package_dir = pathlib.Path(__file__).parent
+    return digest(sorted(package_dir.glob('*.py')))
+
+
+def page_inputs(app, url):
+    """Get digests of the local files a page is rendered from.
+
+    Returns :class:`None` if the inputs of the page are unknown.
+    """
+    try:
+        endpoint, values = app.url_map.bind('localhost').match(url)
+    except werkzeug.exceptions.HTTPException:
+        return None
+
+    if endpoint in DETAIL_ENDPOINTS:
+        model_class = DETAIL_ENDPOINTS[endpoint]
+        path = model_class.DATA_DIR / (model_class.DATA_FORMAT % values['id'])
+        if not path.exists():
+            return None
+        paths = [path]
+        schemas = [model_class.SCHEMA_FILE]
+    elif endpoint in LIST_ENDPOINTS:
+        model_class = LIST_ENDPOINTS[endpoint]
+        paths = sorted(model_class.DATA_DIR.glob(model_class.DATA_GLOB))
+        schemas = [model_class.SCHEMA_FILE]
+    elif endpoint in STATIC_ENDPOINTS:
+        return {}
+    else:
+        return None
+
+    if endpoint in PERSON_PROJECTS_ENDPOINTS:
+        project_class = models.Project
+        paths += sorted(project_class.DATA_DIR.glob(project_class.DATA_GLOB))
+        schemas.append(project_class.SCHEMA_FILE)
+
+    return {
+        'data': digest(paths),
+        'schema': digest(schemas),
+    }
+
+
+def read_manifest(site_path):
+    manifest_path = site_path / MANIFEST_FILE
+    if not manifest_path.exists():
+        return None
+    with manifest_path.open() as fh:
+        manifest = json.load(fh)
+    if manifest.get('generator') != generator_digest():
+        return None
+    return manifest
+
+
+def page_etag(build_path, url):
+    """Get the strong ETag of a rendered page, or :class:`None`."""
+    path = url_to_path(build_path, url)
+    if not path.is_file():
+        return None
+    return digest([path])
+
+
+def write_manifest(app, build_path, pages):
+    manifest = {
+        'generator': generator_digest(),
+        'pages': {
+            url: {
+                'inputs': page_inputs(app, url),
+                'upstream': pages[url],
+                'etag': page_etag(build_path, url),
+            }
+            for url in sorted(pages)
+        },
+    }
+    with (build_path / MANIFEST_FILE).open('w') as fh:
+        json.dump(manifest, fh, indent=2, sort_keys=True)
+
+
+def has_same_inputs(app, url, page):
+    return page['inputs'] is not None and page['inputs'] == page_inputs(
+        app, url)
+
+
+def source_key(url, validators):
+    return url, json.dumps(validators, sort_keys=True)
+
+
+def changed_sources(pages, jobs=1):
+    """Check the upstream resources of the pages for changes.
+
+    Resources shared by several pages are only checked once, with ``jobs``
+    checks in parallel. Returns the set of :func:`source_key` of each
+    changed resource.
+    """
+    sources = [
+        (url, validators)
+        for page in pages for url, validators in page['upstream'].items()]
+    changed = upstream.find_changed(sources, jobs)
+    return {
+        source_key(url, validators)
+        for (url, validators), is_changed in zip(sources, changed)
+        if is_changed}
+
+
+def reuse_pages(app, manifest, site_path, build_path, jobs=1):
+    """Copy unchanged pages from a previous site into the build directory.
+
+    The upstream resources of the pages are checked with ``jobs`` checks in
+    parallel. Files are hardlinked if possible. Returns a dict mapping the
+    URLs of the reused pages to their upstream validators from the manifest.
+    """
+    # Load the enrichers, which register checkers for their resources
+    models.load_enrichers()
+    candidates = [
+        (url, page) for url, page in manifest['pages'].items()
+        if url_to_path(site_path, url).exists() and
+        has_same_inputs(app, url, page)]
+    changed = changed_sources([page for _, page in candidates], jobs)
+
+    reused = {}
+    for url, page in candidates:
+        if any(
+                source_key(source_url, validators) in changed
+                for source_url, validators in page['upstream'].items()):
+            continue
+
+        old_path = url_to_path(site_path, url)
+
+        new_path = url_to_path(build_path, url)
+        new_path.parent.mkdir(parents=True, exist_ok=True)
+        link_file(old_path, new_path)
+        for suffix in COMPRESSED_SUFFIXES:
+            old_variant = with_suffix(old_path, suffix)
+            if old_variant.exists():
+                link_file(old_variant, with_suffix(new_path, suffix))
+        reused[url] = page['upstream']
+
+    return reused
+
+
+def link_file(old_path, new_path):
+    try:
+        os.link(str(old_path), str(new_path))
+    except OSError:
+        shutil.copy2(str(old_path), str(new_path))
+
+
+def with_suffix(path, suffix):
+    return path.with_name(path.name + suffix)
+
+
+def compress(content, suffix):
+    if suffix == '.gz':
+        # A fixed mtime makes the output only depend on the content
+        buf = io.BytesIO()
+        with gzip.GzipFile(
+                fileobj=buf, mode='wb', compresslevel=9, mtime=0) as fh:
+            fh.write(content)
+        return buf.getvalue()
+    if suffix == '.br' and brotli is not None:
+        return brotli.compress(content, quality=11)
+    return None
+
+
+def compress_pages(build_path, urls, jobs=1):
+    """Write precompressed variants next to the rendered pages.
+
+    A ``.gz`` file, and a ``.br`` file if brotli is installed, is written at
+    maximum compression for each page, unless it wouldn't be smaller than
+    the page or already exists, e.g. because the page was reused.
+    """
+    def compress_page(url):
+        path = url_to_path(build_path, url)
+        if not path.is_file():
+            return
+        content = None
+        for suffix in COMPRESSED_SUFFIXES:
+            variant_path = with_suffix(path, suffix)
+            if variant_path.exists():
+                continue
+            if content is None:
+                content = path.read_bytes()
+            compressed = compress(content, suffix)
+            if compressed is not None and len(compressed) < len(content):
+                variant_path.write_bytes(compressed)
+
+    with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+        list(executor.map(compress_page, urls))
@@ -0,0 +1,225 @@
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import tempfile
+import threading
+import time
+import urllib.parse
+
+import requests
+import requests.structures
+
+
+logger = logging.getLogger(__name__)
+
+
+# Maximum total size of the cached response bodies and metadata, in bytes
+DEFAULT_MAX_SIZE = 100 * 1024 * 1024
+
+# Seconds a response is used without asking the upstream if it has changed
+DEFAULT_TTL = 60 * 60
+DEFAULT_TTLS = {
+    'api.github.com': 60 * 60,
+    'aur.archlinux.org': 6 * 60 * 60,
+    'discuss.mopidy.com': 60 * 60,
+    'pypi.python.org': 60 * 60,
+    'sources.debian.net': 24 * 60 * 60,
+}
+
+# Headers that describe the transfer and not the cached body
+SKIPPED_HEADERS = {
+    'connection',
+    'content-encoding',
+    'content-length',
+    'keep-alive',
+    'set-cookie',
+    'transfer-encoding',
+}
+
+
+class CacheEntry:
+
+    def __init__(self, url, headers, stored_at, body_path):
+        self.url = url
+        self.headers = requests.structures.CaseInsensitiveDict(headers)
+        self.stored_at = stored_at
+        self.body_path = body_path
+
+    def age(self):
+        return time.time() - self.stored_at
+
+    @property
+    def validators(self):
+        return {
+            'etag': self.headers.get('ETag'),
+            'last_modified': self.headers.get('Last-Modified'),
+        }
+
+    def conditional_headers(self):
+        headers = {}
+        if 'ETag' in self.headers:
+            headers['If-None-Match'] = self.headers['ETag']
+        if 'Last-Modified' in self.headers:
+            headers['If-Modified-Since'] = self.headers['Last-Modified']
+        return headers
+
+    def to_response(self):
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = 'OK'
+        response.url = self.url
+        response.headers = requests.structures.CaseInsensitiveDict(
+            self.headers)
+        response._content = self.body_path.read_bytes()
+        response.from_cache = True
+        return response
+
+
+class ResponseCache:
+    """Disk-backed cache of upstream responses and their validators.
+
+    Entries younger than the TTL of their host are served without contacting
+    the upstream. Older entries are revalidated with a conditional request.
+    When the total size grows beyond ``max_size``, the least recently used
+    entries are evicted.
+    """
+
+    def __init__(self, path, max_size=DEFAULT_MAX_SIZE, ttls=None):
+        self.path = pathlib.Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.ttls = dict(DEFAULT_TTLS)
+        self.ttls.update(ttls or {})
+        self._lock = threading.Lock()
+        self._size = None
+
+    def ttl(self, url):
+        host = urllib.parse.urlsplit(url).hostname
+        return self.ttls.get(host, DEFAULT_TTL)
+
+    def is_fresh(self, entry):
+        return entry.age() < self.ttl(entry.url)
+
+    def get(self, url):
+        meta_path, body_path = self._paths(url)
+        try:
+            with meta_path.open() as fh:
+                meta = json.load(fh)
+            os.utime(str(meta_path))
+        except (OSError, ValueError):
+            return None
+        if not body_path.exists():
+            return None
+        return CacheEntry(url, meta['headers'], meta['stored_at'], body_path)
+
+    def set(self, url, response):
+        headers = {
+            key: value for key, value in response.headers.items()
+            if key.lower() not in SKIPPED_HEADERS}
+        meta_path, body_path = self._paths(url)
+        self._write(body_path, response.content)
+        self._write_meta(meta_path, url, headers)
+        self._evict()
+        return self.get(url)
+
+    def revalidated(self, entry, response):
+        """Mark an entry as fresh after the upstream answered with a 304."""
+        headers = dict(entry.headers)
+        for key in ('ETag', 'Last-Modified', 'Cache-Control', 'Expires'):
+            if key in response.headers:
+                headers[key] = response.headers[key]
+        meta_path, _ = self._paths(entry.url)
+        self._write_meta(meta_path, entry.url, headers)
+        return self.get(entry.url)
+
+    def touch(self, url):
+        """Mark an entry as fresh, when the upstream is known unchanged."""
+        entry = self.get(url)
+        if entry is None:
+            return None
+        meta_path, _ = self._paths(url)
+        self._write_meta(meta_path, url, dict(entry.headers))
+        return self.get(url)
+
+    def delete(self, url):
+        """Remove an entry, when the upstream is known to have changed."""
+        for path in self._paths(url):
+            try:
+                size = path.stat().st_size
+                path.unlink()
+            except OSError:
+                continue
+            with self._lock:
+                if self._size is not None:
+                    self._size -= size
+
+    def get_state(self, name):
+        """Get a value stored with :meth:`set_state`, or :class:`None`."""
+        try:
+            with self._state_path(name).open() as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return None
+
+    def set_state(self, name, value):
+        """Store a JSON value with the cache, e.g. to track refreshes."""
+        self._write(
+            self._state_path(name), json.dumps(value).encode('utf-8'),
+            count=False)
+
+    def _state_path(self, name):
+        # Kept outside the subdirectories, so it is never evicted
+        return self.path / ('%s.state' % name)
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        base = self.path / key[:2] / key
+        return base.with_suffix('.json'), base.with_suffix('.body')
+
+    def _write_meta(self, meta_path, url, headers):
+        meta = {'url': url, 'headers': headers, 'stored_at': time.time()}
+        self._write(meta_path, json.dumps(meta).encode('utf-8'))
+
+    def _write(self, path, content, count=True):
+        path.parent.mkdir(exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=str(path.parent))
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(content)
+        old_size = path.stat().st_size if path.exists() else 0
+        os.replace(tmp_name, str(path))
+        with self._lock:
+            if count and self._size is not None:
+                self._size += len(content) - old_size
+
+    def _entries(self):
+        for meta_path in self.path.glob('*/*.json'):
+            body_path = meta_path.with_suffix('.body')
+            try:
+                size = meta_path.stat().st_size
+                if body_path.exists():
+                    size += body_path.stat().st_size
+                yield meta_path.stat().st_mtime, size, meta_path, body_path
+            except OSError:
+                continue
+
+    def _evict(self):
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _, _ in self._entries())
+            if self._size <= self.max_size:
+                return
+
+            # Evict down to 90% of the limit, to not do this on every write
+            target = self.max_size * 0.9
+            for _, size, meta_path, body_path in sorted(self._entries()):
+                if self._size <= target:
+                    break
+                for path in (meta_path, body_path):
+                    try:
+                        path.unlink()
+                    except OSError:
+                        pass
+                self._size -= size
+                logger.debug('Evicted %s from response cache', meta_path)
@@ -0,0 +1,90 @@
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+# Number of consecutive failed requests after which a host is skipped
+FAILURE_THRESHOLD = 5
+
+# Seconds a failing host is skipped before it is tried again
+COOL_DOWN = 30
+
+# Response statuses counting as failures of the host
+FAILURE_STATUSES = {500, 502, 503, 504}
+
+
+class CircuitBreaker:
+    """Skips requests to a host that keeps failing.
+
+    After ``failure_threshold`` consecutive failures, the circuit opens, and
+    requests to the host are not sent for ``cool_down`` seconds. Then a
+    single trial request is let through. If it succeeds, the circuit closes
+    again, and otherwise it stays open for another cool-down.
+    """
+
+    def __init__(
+            self, host, failure_threshold=FAILURE_THRESHOLD,
+            cool_down=COOL_DOWN, clock=time.monotonic):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.cool_down = cool_down
+        self.failures = 0
+        self.opened_at = None
+        self._trial = None
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        """Check if a request to the host may be sent now."""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self._trial is not None or (
+                    self._clock() - self.opened_at < self.cool_down):
+                return False
+            self._trial = threading.get_ident()
+            return True
+
+    def release(self):
+        """Give up the trial request of this thread, if it is still open.
+
+        The trial request ends without a result if it was not sent, e.g.
+        because the deadline passed first, and another may then be tried.
+        """
+        with self._lock:
+            if self._trial == threading.get_ident():
+                self._trial = None
+
+    def succeeded(self):
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info('Requests to %s succeed again', self.host)
+            self.failures = 0
+            self.opened_at = None
+            self._trial = None
+
+    def failed(self):
+        with self._lock:
+            self.failures += 1
+            if (self._trial is not None or
+                    self.failures >= self.failure_threshold):
+                if self.opened_at is None:
+                    logger.warning(
+                        'Skipping requests to %s for %ds after %d failures',
+                        self.host, self.cool_down, self.failures)
+                self.opened_at = self._clock()
+                self._trial = None
+
+    def update(self, response):
+        """Count a response as a success or failure of the host."""
+        if response.status_code in FAILURE_STATUSES:
+            self.failed()
+        else:
+            self.succeeded()
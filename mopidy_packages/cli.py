@@ -1,13 +1,15 @@
+import os
 import pathlib
 import shutil
 import sys
 import tempfile
+import time
 
 import click
 
-import flask_frozen
 
-from mopidy_packages import web, web_static
+# The modules used by the commands are imported by the commands themselves,
+# so each command only imports what it uses, and --help imports nothing.
 
 
 @click.group()
@@ -16,12 +18,76 @@ def cli():
     pass
 
 
+def default_cache_dir():
+    from mopidy_packages import upstream
+    return os.environ.get(upstream.CACHE_DIR_ENV)
+
+
+def default_concurrency():
+    from mopidy_packages import enrichment
+    return enrichment.CONCURRENCY
+
+
+def cache_dir_option(func):
+    return click.option(
+        '--cache-dir', default=default_cache_dir,
+        type=click.Path(file_okay=False, dir_okay=True, resolve_path=True),
+        help='Directory to cache upstream API responses in')(func)
+
+
+def concurrency_option(func):
+    return click.option(
+        '--concurrency', default=default_concurrency,
+        type=click.IntRange(min=1),
+        help='Maximum number of upstream lookups in flight')(func)
+
+
+def max_wait_option(func):
+    return click.option(
+        '--max-wait', default=60 * 60, type=click.IntRange(min=0),
+        help='Maximum seconds to wait for an upstream rate limit to reset')(
+            func)
+
+
+def pypi_changelog_option(func):
+    return click.option(
+        '--pypi-changelog/--no-pypi-changelog', default=True,
+        help='Use the PyPI changelog to only refresh changed packages')(func)
+
+
+def configure_cache(cache_dir):
+    from mopidy_packages import cache, upstream
+    if cache_dir is not None:
+        upstream.set_cache(cache.ResponseCache(cache_dir))
+
+
+def refresh_pypi_cache():
+    from mopidy_packages import models, pypi, upstream
+    response_cache = upstream.get_cache()
+    if response_cache is None:
+        return
+
+    names = [
+        project.data['distribution']['pypi']
+        for project in models.Project.all()
+        if project.data['distribution'].get('pypi')]
+    changed = pypi.refresh_cache(names, response_cache)
+    if changed is None:
+        click.echo('PyPI changelog not available, refreshing all packages')
+    else:
+        click.echo('%d of %d PyPI packages changed' % (
+            len(changed), len(names)))
+
+
 @cli.command('serve-ondemand')
 @click.option('--host', default='127.0.0.1', help='Host to bind to')
 @click.option('--port', default=5000, help='Port to bind to')
 @click.option('--debug', default=False, help='Debug mode', is_flag=True)
-def serve_ondemand(host, port, debug):
+@cache_dir_option
+def serve_ondemand(host, port, debug, cache_dir):
     """Run web server with on-demand data fetching."""
+    from mopidy_packages import web
+    configure_cache(cache_dir)
     web.app.run(host=host, port=port, debug=debug)
 
 
@@ -29,32 +95,85 @@ def serve_ondemand(host, port, debug):
 @click.option('--host', default='127.0.0.1', help='Host to bind to')
 @click.option('--port', default=5000, help='Port to bind to')
 @click.option('--debug', default=False, help='Debug mode', is_flag=True)
+@click.option(
+    '--max-age', default=5 * 60, type=click.IntRange(min=0),
+    help='Seconds clients may cache pages without revalidating them')
 @click.argument(
     'dest', default='_site',
     type=click.Path(file_okay=False, dir_okay=True, resolve_path=True))
-def serve_static(host, port, debug, dest):
+def serve_static(host, port, debug, max_age, dest):
     """Run web server with static API site."""
+    from mopidy_packages import web_static
 
     if not pathlib.Path(dest).exists():
         click.echo('No site found at %s. You must build it first.' % dest)
         sys.exit(1)
 
     web_static.app.config['SITE_DIR'] = dest
+    web_static.app.config['SEND_FILE_MAX_AGE_DEFAULT'] = max_age
     web_static.app.run(host=host, port=port, debug=debug)
 
 
 @cli.command('build-static')
+@click.option(
+    '--jobs', '-j', default=1, type=click.IntRange(min=1),
+    help='Number of pages to render in parallel')
+@click.option(
+    '--full', default=False, is_flag=True,
+    help='Render all pages, even if unchanged since the previous build')
+@concurrency_option
+@max_wait_option
+@cache_dir_option
+@pypi_changelog_option
 @click.argument(
     'dest', default='_site',
     type=click.Path(file_okay=False, dir_okay=True, resolve_path=True))
-def build_static(dest):
+def build_static(
+        jobs, full, concurrency, max_wait, cache_dir, pypi_changelog, dest):
     """Build static API site.
 
     Fetches updated API data and saves to the DEST directory.
 
     DEST will be deleted and replaced with updated data when the data fetch is
     complete.
+
+    The data of all people and projects is fetched from upstream services
+    together, with at most --concurrency lookups in flight. Then the person
+    and project pages are rendered, using --jobs parallel workers, before the
+    rest of the site is built.
+
+    Each page gets gzip and, if brotli is installed, brotli compressed
+    variants, which serve-static sends to clients accepting them.
+
+    A manifest of the inputs of each page is saved with the site. Pages with
+    unchanged data files and upstream resources are reused from the previous
+    build in DEST, unless --full is given. The upstream resources are
+    checked with at most --concurrency checks in flight.
+
+    Requests are paced to stay within the rate limits of the upstream
+    services. If a limit runs out, the build waits up to --max-wait seconds
+    for it to reset, and otherwise stops without touching DEST.
+
+    With a cache dir, cached PyPI data is only refreshed for packages that
+    changed according to the PyPI changelog, unless --no-pypi-changelog is
+    given.
     """
+    import flask_frozen
+
+    from mopidy_packages import (
+        build, enrichment, models, ratelimit, upstream, web)
+
+    configure_cache(cache_dir)
+    upstream.set_max_wait(max_wait)
+
+    # The data files don't change during the build, so only load them once
+    models.Person.get_registry().freeze()
+    models.Project.get_registry().freeze()
+    enrichment.cache.clear()
+
+    if pypi_changelog:
+        refresh_pypi_cache()
+
     dest_path = pathlib.Path(dest)
     click.echo('Destination dir: %s' % dest_path)
 
@@ -64,8 +183,42 @@ def build_static(dest):
     try:
         web.app.config['FREEZER_DESTINATION'] = str(build_path)
         web.app.config['FREEZER_IGNORE_MIMETYPE_WARNINGS'] = True
+        web.app.config['FREEZER_SKIP_EXISTING'] = True
+        # The build dir starts out empty, and must keep the reused variants
+        web.app.config['FREEZER_REMOVE_EXTRA_FILES'] = False
+
+        pages = {}
+        manifest = None if full else build.read_manifest(dest_path)
+        detail_pages = build.detail_pages()
+
+        try:
+            if manifest is not None:
+                pages.update(build.reuse_pages(
+                    web.app, manifest, dest_path, build_path, concurrency))
+                click.echo('Reusing %d unchanged pages' % len(pages))
+
+            stale_pages = [
+                (url, page)
+                for url, page in zip(
+                    build.page_urls(web.app, detail_pages), detail_pages)
+                if url not in pages]
+            enrichment.enrich_all(
+                [build.page_model(page) for _, page in stale_pages],
+                enrichment.Engine(concurrency))
+        except ratelimit.RateLimitExhausted as exc:
+            click.echo('Stopping build: %s' % exc)
+            sys.exit(1)
+        pages.update(build.render_pages(
+            web.app, build_path, [url for url, _ in stale_pages], jobs))
+
         freezer = flask_frozen.Freezer(web.app)
-        freezer.freeze()
+        freezer.register_generator(lambda: detail_pages)
+        freezer.register_generator(build.person_projects_pages)
+        for url in freezer.freeze():
+            pages.setdefault(url, {})
+
+        build.compress_pages(build_path, pages, jobs)
+        build.write_manifest(web.app, build_path, pages)
 
         if dest_path.exists():
             shutil.rmtree(str(dest_path))
@@ -73,3 +226,38 @@ def build_static(dest):
     finally:
         if build_path.exists():
             shutil.rmtree(str(build_path))
+
+
+@cli.command('warm')
+@concurrency_option
+@max_wait_option
+@cache_dir_option
+@pypi_changelog_option
+def warm(concurrency, max_wait, cache_dir, pypi_changelog):
+    """Fetch upstream API data for all people and projects into the cache.
+
+    Running this regularly keeps the response cache used by serve-ondemand
+    and build-static fresh. Cached PyPI data is only refreshed for packages
+    that changed according to the PyPI changelog, unless
+    --no-pypi-changelog is given.
+    """
+    from mopidy_packages import enrichment, models, ratelimit, upstream
+
+    configure_cache(cache_dir)
+    if upstream.get_cache() is None:
+        click.echo('No cache dir configured. Use --cache-dir to set one.')
+        sys.exit(1)
+    upstream.set_max_wait(max_wait)
+
+    if pypi_changelog:
+        refresh_pypi_cache()
+
+    objs = list(models.Person.all()) + list(models.Project.all())
+    start = time.time()
+    try:
+        enrichment.Engine(concurrency).run(objs)
+    except ratelimit.RateLimitExhausted as exc:
+        click.echo('Stopping: %s' % exc)
+        sys.exit(1)
+    click.echo('Fetched data for %d people and projects in %.1fs' % (
+        len(objs), time.time() - start))
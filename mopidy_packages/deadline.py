@@ -0,0 +1,48 @@
+import contextlib
+import contextvars
+import time
+
+
+_deadline = contextvars.ContextVar('deadline', default=None)
+
+
+@contextlib.contextmanager
+def limit(seconds):
+    """Limit the time the work in this context may take to ``seconds``.
+
+    A limit can only shorten the deadline of an enclosing one. The deadline
+    follows the context into threads started with
+    :func:`contextvars.copy_context` and into asyncio tasks.
+    """
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    if current is not None:
+        deadline = min(deadline, current)
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+@contextlib.contextmanager
+def share(parts):
+    """Limit the work in this context to an equal share of the time left.
+
+    The time left until the deadline is split in ``parts`` shares. Without a
+    deadline, the work is not limited.
+    """
+    left = remaining()
+    if left is None:
+        yield
+        return
+    with limit(left / max(parts, 1)):
+        yield
+
+
+def remaining():
+    """Get the seconds left until the deadline, or :class:`None` if none."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return max(deadline - time.monotonic(), 0)
@@ -0,0 +1,405 @@
+import asyncio
+import collections
+import concurrent.futures
+import contextvars
+import copy
+import inspect
+import json
+import logging
+import threading
+import time
+
+from mopidy_packages import upstream
+
+
+logger = logging.getLogger(__name__)
+
+
+# Maximum number of enricher calls in flight across all objects
+CONCURRENCY = 20
+
+# Seconds enrichment results are served without refreshing them
+DEFAULT_FRESHNESS = 60 * 60
+FRESHNESS = {
+    'apt': 24 * 60 * 60,
+    'aur': 6 * 60 * 60,
+    'discuss': 60 * 60,
+    'github': 60 * 60,
+    'pypi': 60 * 60,
+}
+
+# Maximum size of the cached enrichment results, in bytes
+MAX_SIZE = 64 * 1024 * 1024
+
+# Number of threads refreshing stale results in the background
+REFRESH_WORKERS = 4
+
+
+class Engine:
+    """Enriches many model objects together.
+
+    The enricher calls of all objects are scheduled at once, with at most
+    ``concurrency`` of them in flight at any time. Enrichers that are
+    coroutine functions are awaited, while plain functions run in a thread
+    pool. Batch enrichers run once per model before the other enrichers,
+    which are then skipped for the objects the batch enrichers covered.
+    Requests to each upstream host are further capped by ``host_limits``,
+    which updates the limits in :mod:`mopidy_packages.upstream`. The
+    connection pools of the shared session keep a connection for each
+    enricher call in flight.
+    """
+
+    def __init__(self, concurrency=CONCURRENCY, host_limits=None):
+        self.concurrency = concurrency
+        upstream.reserve_connections(concurrency)
+        for host, limit in (host_limits or {}).items():
+            upstream.set_host_limit(host, limit)
+
+    def run(self, objs, sources=None):
+        """Enrich the objects and return a dict of upstream validators.
+
+        If ``sources`` is given, only enrichers for those sources are run.
+        It may also be a dict mapping each object to its sources. The
+        returned dict maps each object to the validators of the upstream
+        resources used to enrich it.
+        """
+        return asyncio.run(self.enrich(objs, sources))
+
+    async def enrich(self, objs, sources=None):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        with concurrent.futures.ThreadPoolExecutor(
+                self.concurrency) as executor:
+            batched, batch_fetched = await self._enrich_batches(
+                objs, sources, semaphore, executor)
+            fetched = await asyncio.gather(*[
+                self._enrich_one(
+                    obj, sources, batched.get(obj, {}),
+                    batch_fetched.get(obj, {}), semaphore, executor)
+                for obj in objs])
+        return dict(zip(objs, fetched))
+
+    async def _enrich_batches(self, objs, sources, semaphore, executor):
+        """Run the batch enrichers of the objects' models.
+
+        Returns a dict mapping each covered object to its ``{key: result}``
+        dict, and a dict mapping it to the validators of the upstream
+        resources listed in the ``sources`` of its results.
+        """
+        by_class = collections.OrderedDict()
+        for obj in objs:
+            by_class.setdefault(type(obj), []).append(obj)
+
+        calls = []
+        for model_class, class_objs in by_class.items():
+            class_sources = merge_sources(
+                [sources_of(obj, sources) for obj in class_objs])
+            for key, enricher in model_class.get_batch_enrichers(
+                    class_sources):
+                source = key.split('.')[-1]
+                targets = [
+                    (obj, obj_key) for obj in class_objs
+                    for obj_key, _ in obj.get_enrichers(
+                        sources_of(obj, sources))
+                    if obj_key.split('.')[-1] == source]
+                if targets:
+                    calls.append((targets, self._call_batch(
+                        enricher, [obj.data for obj, _ in targets],
+                        semaphore, executor)))
+        outcomes = await asyncio.gather(*[call for _, call in calls])
+
+        batched, batch_fetched = {}, {}
+        for (targets, _), (results, fetched) in zip(calls, outcomes):
+            for obj, obj_key in targets:
+                if obj.data['id'] not in results:
+                    continue
+                result = results[obj.data['id']]
+                batched.setdefault(obj, {})[obj_key] = result
+
+                # Each object is credited with the resources of its own
+                # result only, like a repository stored from a GraphQL query
+                obj_fetched = batch_fetched.setdefault(obj, {})
+                for url in (result or {}).get('sources', []):
+                    obj_fetched[url] = fetched.get(url)
+        return batched, batch_fetched
+
+    async def _enrich_one(
+            self, obj, sources, batched, batch_fetched, semaphore, executor):
+        sources = sources_of(obj, sources)
+        items = [
+            (key, enricher) for key, enricher in obj.get_enrichers(sources)
+            if key not in batched]
+        with upstream.recording() as fetched:
+            results = await asyncio.gather(*[
+                self._call(enricher, obj.data, semaphore, executor)
+                for _, enricher in items])
+        fetched.update(batch_fetched)
+
+        results = dict(zip([key for key, _ in items], results))
+        results.update(batched)
+        obj.apply_enrichments(
+            (key, results[key]) for key, _ in obj.get_enrichers(sources))
+        return fetched
+
+    async def _call_batch(self, enricher, datas, semaphore, executor):
+        with upstream.recording() as fetched:
+            results = await self._call(enricher, datas, semaphore, executor)
+        return results, fetched
+
+    async def _call(self, enricher, data, semaphore, executor):
+        async with semaphore:
+            if inspect.iscoroutinefunction(enricher):
+                return await enricher(data)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                executor, contextvars.copy_context().run, enricher, data)
+
+
+def sources_of(obj, sources):
+    """Get the sources to enrich an object from, see :meth:`Engine.run`."""
+    if isinstance(sources, dict):
+        return sources[obj]
+    return sources
+
+
+def merge_sources(sources_list):
+    """Get the sources covering all the given ones, :class:`None` for all."""
+    if any(sources is None for sources in sources_list):
+        return None
+    return set().union(*sources_list)
+
+
+class Entry:
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.values = {}
+        self.fetched = {}
+        self.size = 0
+
+    def update(self, results, fetched, fetched_at):
+        for key, value in results:
+            self.values[key] = (value, fetched_at)
+        self.fetched.update(fetched)
+        self.size = len(json.dumps(
+            [self.values, self.fetched], default=str).encode('utf-8'))
+
+
+class EnrichedCache:
+    """Memory-bounded cache of enrichment results.
+
+    Results are kept per enricher. A result is fresh for the number of
+    seconds given for its source in ``freshness``. Fresh results are served
+    directly. Stale results are also served directly, while a refresh from
+    the upstream runs in the background. Entries are dropped when the data
+    file of the object changes, and the least recently used entries are
+    evicted when the cache grows beyond ``max_size`` bytes.
+    """
+
+    def __init__(self, max_size=MAX_SIZE, freshness=None):
+        self.max_size = max_size
+        self.freshness = dict(FRESHNESS)
+        self.freshness.update(freshness or {})
+        self.size = 0
+        self._entries = collections.OrderedDict()
+        self._refreshing = set()
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _key(self, obj):
+        return (type(obj).__name__, obj.path)
+
+    def _raw(self, obj):
+        return type(obj).get_registry().get(obj.path)
+
+    def get(self, obj):
+        """Get the entry of an object, or :class:`None`."""
+        key = self._key(obj)
+        raw = self._raw(obj)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.raw is not raw:
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, obj, results, fetched, fetched_at=None):
+        """Store enrichment results of an object and return its entry.
+
+        Results lacking the data of an unavailable upstream are returned in
+        a copy of the entry, but not stored, so they are fetched again next
+        time.
+        """
+        if fetched_at is None:
+            fetched_at = time.time()
+        key = self._key(obj)
+        raw = self._raw(obj)
+        if getattr(fetched, 'degraded', False):
+            entry = Entry(raw)
+            cached = self.get(obj)
+            if cached is not None:
+                entry.values.update(cached.values)
+                entry.fetched.update(cached.fetched)
+            entry.update(results, fetched, fetched_at)
+            return entry
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.raw is not raw:
+                self._remove(key)
+                entry = self._entries[key] = Entry(raw)
+            self.size -= entry.size
+            entry.update(results, fetched, fetched_at)
+            self.size += entry.size
+            self._entries.move_to_end(key)
+            while self.size > self.max_size and len(self._entries) > 1:
+                self._remove(next(iter(self._entries)))
+        return entry
+
+    def put_enriched(self, obj, fetched, sources=None):
+        """Store the results of enriching an object from the sources.
+
+        Returns the entry, like :meth:`put`.
+        """
+        results = []
+        for key, _ in obj.get_enrichers(sources):
+            try:
+                results.append((key, get_value(obj.data, key)))
+            except KeyError:
+                continue
+        return self.put(obj, results, fetched)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry.size
+
+    def is_fresh(self, key, fetched_at):
+        source = key.split('.')[-1]
+        max_age = self.freshness.get(source, DEFAULT_FRESHNESS)
+        return time.time() - fetched_at < max_age
+
+    def enrich(self, obj, sources=None):
+        """Enrich the object from the cache, fetching what is missing.
+
+        Stale results are refreshed in the background.
+        """
+        entry = self.get(obj)
+        if entry is None:
+            with upstream.recording() as fetched:
+                if sources is None:
+                    obj.enrich()
+                else:
+                    obj.enrich(sources=sources)
+            self.put_enriched(obj, fetched, sources)
+            return
+
+        keys = [key for key, _ in obj.get_enrichers(sources)]
+        missing = {
+            key.split('.')[-1] for key in keys if key not in entry.values}
+        if missing:
+            with upstream.recording() as fetched:
+                results = obj.enrichments(sources=missing)
+            entry = self.put(obj, results, fetched)
+
+        self.apply(obj, entry, sources)
+
+    def apply(self, obj, entry, sources=None):
+        """Enrich the object with the results in its entry.
+
+        Stale results are refreshed in the background.
+        """
+        keys = [
+            key for key, _ in obj.get_enrichers(sources)
+            if key in entry.values]
+        stale = {
+            key.split('.')[-1] for key in keys
+            if not self.is_fresh(key, entry.values[key][1])}
+        if stale:
+            self._refresh_in_background(obj, stale)
+
+        values = [(key, entry.values[key]) for key in keys]
+        times = [fetched_at for _, (_, fetched_at) in values]
+        obj.apply_enrichments(
+            [(key, copy.deepcopy(value)) for key, (value, _) in values],
+            updated_at=min(times or [None]), fetched_at=max(times or [None]))
+        upstream.record(entry.fetched)
+
+    def _refresh_in_background(self, obj, sources):
+        refreshing = {(self._key(obj), source) for source in sources}
+        with self._lock:
+            if refreshing <= self._refreshing:
+                return
+            self._refreshing |= refreshing
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    REFRESH_WORKERS)
+
+        raw_obj = type(obj)(path=obj.path, data=self._raw(obj))
+        raw_obj._enrichers = obj._enrichers
+        self._executor.submit(self._refresh, raw_obj, sources, refreshing)
+
+    def _refresh(self, obj, sources, refreshing):
+        try:
+            with upstream.recording() as fetched:
+                results = obj.enrichments(sources=sources)
+            self.put(obj, results, fetched)
+        except Exception:
+            logger.exception('Refreshing %s failed', obj.path)
+        finally:
+            with self._lock:
+                self._refreshing -= refreshing
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+def get_value(data, key):
+    for part in key.split('.'):
+        data = data[part]
+    return data
+
+
+cache = EnrichedCache()
+
+
+def enrich(obj, sources=None):
+    """Enrich the object, using cached results where possible.
+
+    With ``sources``, only the enrichers of those sources run, and the other
+    fields keep their raw values.
+    """
+    cache.enrich(obj, sources)
+
+
+def enrich_many(objs, sources=None):
+    """Enrich the objects in one batch, using cached results if possible.
+
+    The results missing from the cache are fetched for all objects in a
+    single run of the engine, so batch enrichers cover them.
+    """
+    entries, missing = {}, {}
+    for obj in objs:
+        entry = entries[obj] = cache.get(obj)
+        obj_missing = {
+            key.split('.')[-1] for key, _ in obj.get_enrichers(sources)
+            if entry is None or key not in entry.values}
+        if entry is None or obj_missing:
+            missing[obj] = obj_missing
+
+    if missing:
+        for obj, fetched in Engine().run(list(missing), missing).items():
+            entries[obj] = cache.put_enriched(obj, fetched, missing[obj])
+    for obj in objs:
+        if entries[obj] is not None:
+            cache.apply(obj, entries[obj], sources)
+
+
+def enrich_all(objs, engine=None):
+    """Enrich the objects with the engine and put them in the cache."""
+    engine = engine or Engine()
+    for obj, fetched in engine.run(objs).items():
+        cache.put_enriched(obj, fetched)
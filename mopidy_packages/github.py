@@ -0,0 +1,146 @@
+import json
+import logging
+import os
+
+from mopidy_packages import upstream
+
+
+logger = logging.getLogger(__name__)
+
+
+GRAPHQL_URL = 'https://api.github.com/graphql'
+
+# Prefix of the URLs each repository of a GraphQL query is stored under
+REPO_URL_PREFIX = GRAPHQL_URL + '#'
+
+# The GraphQL API only accepts authenticated requests
+TOKEN_ENV = 'GITHUB_TOKEN'
+
+# Number of repositories fetched per GraphQL query
+CHUNK_SIZE = 50
+
+# Number of tags fetched per repository, like the first page of the REST API
+TAGS_COUNT = 30
+
+REPO_FIELDS = '''
+    createdAt
+    pushedAt
+    updatedAt
+    description
+    homepageUrl
+    primaryLanguage { name }
+    watchers { totalCount }
+    stargazerCount
+    forkCount
+    issues(states: OPEN) { totalCount }
+    pullRequests(states: OPEN) { totalCount }
+    refs(
+        refPrefix: "refs/tags/", first: %d,
+        orderBy: {field: TAG_COMMIT_DATE, direction: DESC}) {
+      nodes { name }
+    }
+''' % TAGS_COUNT
+
+
+def get_token():
+    return os.environ.get(TOKEN_ENV) or None
+
+
+def repo_url(id):
+    """Get the URL the GraphQL data of a repository is stored under."""
+    return REPO_URL_PREFIX + id
+
+
+def build_query(ids):
+    """Build a query for the repositories, aliased ``r0``, ``r1``, etc."""
+    parts = []
+    for i, id in enumerate(ids):
+        owner, name = id.split('/', 1)
+        parts.append('  r%d: repository(owner: %s, name: %s) {%s  }' % (
+            i, json.dumps(owner), json.dumps(name), REPO_FIELDS))
+    return 'query {\n%s\n}' % '\n'.join(parts)
+
+
+def to_rest(repo):
+    """Convert a GraphQL repository to the fields of the REST API."""
+    return {
+        'created_at': repo['createdAt'],
+        'pushed_at': repo['pushedAt'],
+        'updated_at': repo['updatedAt'],
+        'description': repo['description'],
+        'homepage': repo['homepageUrl'],
+        'language': (repo['primaryLanguage'] or {}).get('name'),
+        'subscribers_count': repo['watchers']['totalCount'],
+        'stargazers_count': repo['stargazerCount'],
+        'forks_count': repo['forkCount'],
+        'open_issues_count': (
+            repo['issues']['totalCount'] +
+            repo['pullRequests']['totalCount']),
+        'tags': [node['name'] for node in repo['refs']['nodes']],
+    }
+
+
+def fetch_repos(ids, token=None, chunk_size=CHUNK_SIZE):
+    """Fetch many repositories with as few GraphQL queries as possible.
+
+    Returns a dict mapping each repository ID to its fields in the shape of
+    the REST API, plus a ``tags`` list of tag names, or to :class:`None` if
+    the repository was not found. IDs of chunks that could not be fetched
+    are left out, so the caller can fall back to the REST API for them.
+
+    Each repository is stored under its :func:`repo_url`, so it is recorded
+    with validators of its own, and can be read with :func:`cached_repo`.
+    """
+    token = token or get_token()
+    if token is None:
+        return {}
+
+    repos = {}
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        response = upstream.post(
+            GRAPHQL_URL, json={'query': build_query(chunk)},
+            headers={'Authorization': 'bearer %s' % token})
+        if response.status_code != 200:
+            logger.warning(
+                'GitHub GraphQL query failed with status %d',
+                response.status_code)
+            continue
+
+        data = response.json().get('data')
+        if data is None:
+            logger.warning(
+                'GitHub GraphQL query failed: %s',
+                response.json().get('errors'))
+            continue
+
+        for i, id in enumerate(chunk):
+            repo = data.get('r%d' % i)
+            repos[id] = to_rest(repo) if repo is not None else None
+            upstream.store(repo_url(id), json.dumps(
+                repos[id], sort_keys=True).encode('utf-8'))
+
+    return repos
+
+
+def cached_repo(id):
+    """Get a repository stored by a recent :func:`fetch_repos` call.
+
+    Returns the repository like :func:`fetch_repos`. Raises
+    :exc:`KeyError` if it is not in the response cache, or not fresh.
+    """
+    response = upstream.cached(repo_url(id))
+    if response is None:
+        raise KeyError(id)
+    return response.json()
+
+
+def check_repos(urls):
+    """Get the current validators of the stored repositories."""
+    ids = [url[len(REPO_URL_PREFIX):] for url in urls]
+    with upstream.recording() as fetched:
+        fetch_repos(ids)
+    return {url: fetched[url] for url in urls if url in fetched}
+
+
+upstream.register_checker(REPO_URL_PREFIX, check_repos)
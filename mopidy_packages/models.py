@@ -1,22 +1,201 @@
+import concurrent.futures
+import contextvars
+import copy
+import datetime
+import hashlib
+import importlib
+import itertools
 import json
 import logging
 import pathlib
+import threading
+import time
+
+try:
+    import importlib.metadata as importlib_metadata
+except ImportError:  # pragma: no cover
+    importlib_metadata = None
 
 import jsonschema
 
+from mopidy_packages import deadline
+
 
 logger = logging.getLogger(__name__)
 
 
 ROOT_DIR = pathlib.Path(__file__).parent.parent
 
+# Upper bound on the number of enrichers of a single object that run at once
+ENRICH_MAX_WORKERS = 8
+
+# Entry point group of the modules registering enrichers with the models
+ENRICHERS_ENTRY_POINT_GROUP = 'mopidy_packages.enrichers'
+
+# Modules registering the built-in enrichers, which are loaded even if the
+# package's entry points are not installed
+BUILTIN_ENRICHER_MODULES = [
+    'mopidy_packages.person',
+    'mopidy_packages.project',
+]
+
+_enrichers_loaded = False
+_enrichers_lock = threading.RLock()
+
 
 class ModelException(Exception):
     pass
 
 
+class Registry:
+    """Process-wide cache of the data files of a model.
+
+    Each file is parsed and validated once, and is only loaded again when its
+    modification time or size changes. A frozen registry loads all files once
+    and never looks at the data directory again, which is suitable when the
+    data can't change, like during a static site build.
+
+    :attr:`changed_at` is the Unix time a change to the data files, like a
+    loaded, changed or removed file, was last seen.
+    """
+
+    def __init__(self, model_class):
+        self.model_class = model_class
+        self.frozen = False
+        self.changed_at = time.time()
+        self._entries = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, listener):
+        """Call ``listener(path, data)`` whenever a data file is loaded.
+
+        ``data`` is :class:`None` when the file was removed, and both are
+        :class:`None` when the registry was cleared.
+        """
+        self._listeners.append(listener)
+
+    def _notify(self, path, data):
+        for listener in self._listeners:
+            listener(path, data)
+
+    def get(self, path):
+        """Get the data of the file at ``path``, or :class:`None`."""
+        if self.frozen:
+            entry = self._entries.get(path)
+            return entry[1] if entry is not None else None
+
+        try:
+            stat = path.stat()
+        except OSError:
+            with self._lock:
+                removed = self._entries.pop(path, None)
+            if removed is not None:
+                self.changed_at = time.time()
+                self._notify(path, None)
+            return None
+
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        entry = self._entries.get(path)
+        if entry is not None and entry[0] == stamp:
+            return entry[1]
+
+        data = self.model_class.load_data(path)
+        with self._lock:
+            self._entries[path] = (stamp, data)
+            self.changed_at = time.time()
+        self._notify(path, data)
+        return data
+
+    def all(self):
+        """Get ``(path, data)`` pairs for all data files, ordered by path."""
+        if self.frozen:
+            paths = sorted(self._entries)
+        else:
+            paths = sorted(
+                self.model_class.DATA_DIR.glob(self.model_class.DATA_GLOB))
+            with self._lock:
+                removed = set(self._entries) - set(paths)
+                for path in removed:
+                    del self._entries[path]
+                if removed:
+                    self.changed_at = time.time()
+            for path in removed:
+                self._notify(path, None)
+
+        for path in paths:
+            data = self.get(path)
+            if data is not None:
+                yield path, data
+
+    def freeze(self):
+        """Load all data files and stop checking them for changes."""
+        self.frozen = False
+        list(self.all())
+        self.frozen = True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.frozen = False
+            self.changed_at = time.time()
+        self._notify(None, None)
+
+
+def enricher_entry_points():
+    if importlib_metadata is None:  # pragma: no cover
+        return []
+    entry_points = importlib_metadata.entry_points()
+    if hasattr(entry_points, 'select'):
+        return list(entry_points.select(group=ENRICHERS_ENTRY_POINT_GROUP))
+    return list(entry_points.get(ENRICHERS_ENTRY_POINT_GROUP, []))
+
+
+def load_enrichers():
+    """Import the modules registering enrichers, unless already done.
+
+    The modules are the built-in ones, and those of the
+    ``mopidy_packages.enrichers`` entry points. They pull in the libraries
+    used to talk to upstream services, so they are only imported when the
+    enrichers are first needed.
+    """
+    global _enrichers_loaded
+    with _enrichers_lock:
+        if _enrichers_loaded:
+            return
+        for name in BUILTIN_ENRICHER_MODULES:
+            importlib.import_module(name)
+        for entry_point in enricher_entry_points():
+            try:
+                entry_point.load()
+            except Exception:
+                logger.exception(
+                    'Loading enrichers from %s failed', entry_point.value)
+        _enrichers_loaded = True
+
+
+def is_selected(key, sources):
+    return sources is None or key in sources or key.split('.')[-1] in sources
+
+
+def __getattr__(name):
+    # The built-in enrichers used to be imported into this module, and are
+    # still available from it, but are only imported on first access
+    if not name.startswith('_'):
+        load_enrichers()
+        for module_name in BUILTIN_ENRICHER_MODULES:
+            module = importlib.import_module(module_name)
+            if name in getattr(module, '__all__', dir(module)):
+                return getattr(module, name)
+    raise AttributeError(
+        'module %r has no attribute %r' % (__name__, name))
+
+
 class Model:
     _schema_cache = None
+    _validator_cache = None
+    _validated_digests = None
+    _registry = None
 
     @classmethod
     def enricher(cls, key):
@@ -26,15 +205,45 @@ class Model:
         return inner
 
     @classmethod
-    def all(cls):
-        for path in cls.DATA_DIR.glob(cls.DATA_GLOB):
-            obj = cls(path=path)
-            if obj.data is not None:
-                yield obj
+    def batch_enricher(cls, key):
+        """Register a function enriching many objects at once.
+
+        The function gets a list of data dicts and returns a dict mapping
+        the ID of each object to its result. Objects left out of the result
+        are enriched with the per-object enricher of the same source instead.
+        """
+        def inner(func):
+            cls._batch_enrichers[key] = func
+            return func
+        return inner
+
+    @classmethod
+    def get_registry(cls):
+        if cls._registry is None:
+            cls._registry = Registry(cls)
+        return cls._registry
 
-    def __init__(self, id=None, path=None):
+    @classmethod
+    def all(cls, after=None, limit=None):
+        """Get all objects, ordered by ID.
+
+        With ``after``, only objects with a greater ID are included, and
+        with ``limit``, at most that many. Only the data of the included
+        objects is copied.
+        """
+        entries = sorted(
+            cls.get_registry().all(), key=lambda entry: entry[1]['id'])
+        if after is not None:
+            entries = [entry for entry in entries if entry[1]['id'] > after]
+        for path, data in itertools.islice(entries, limit):
+            yield cls(path=path, data=data)
+
+    def __init__(self, id=None, path=None, data=None):
         assert id or path
 
+        # Unix time the newest enrichment result was fetched at, if enriched
+        self.fetched_at = None
+
         if id is not None:
             self.id = id
             self.path = self.DATA_DIR / (self.DATA_FORMAT % id)
@@ -42,24 +251,32 @@ class Model:
             self.id = None
             self.path = path
 
-        self.data = self._get_data(self.path)
+        if data is None:
+            data = self.get_registry().get(self.path)
 
-    def _get_data(self, path):
-        if not path.exists():
-            return None
+        # Copy the data, as enrichment changes it in place
+        self.data = copy.deepcopy(data)
 
-        with path.open() as fh:
-            data = json.load(fh)
+    @classmethod
+    def load_data(cls, path):
+        content = path.read_bytes()
+        data = json.loads(content.decode('utf-8'))
 
-        try:
-            jsonschema.validate(
-                data, self.get_schema(),
-                format_checker=jsonschema.FormatChecker())
-        except jsonschema.ValidationError as exc:
-            raise ModelException('Invalid JSON structure: %s' % exc) from exc
-        else:
+        # Files that already passed validation are not validated again
+        if cls._validated_digests is None:
+            cls._validated_digests = set()
+        digest = hashlib.sha256(content).hexdigest()
+        if digest in cls._validated_digests:
             return data
 
+        error = jsonschema.exceptions.best_match(
+            cls.get_validator().iter_errors(data))
+        if error is not None:
+            raise ModelException('Invalid JSON structure: %s' % error)
+
+        cls._validated_digests.add(digest)
+        return data
+
     @classmethod
     def get_schema(cls):
         if cls._schema_cache is None:
@@ -67,17 +284,99 @@ class Model:
                 cls._schema_cache = json.load(fh)
         return cls._schema_cache
 
-    def enrich(self):
-        for key, enricher in self._enrichers.items():
+    @classmethod
+    def get_validator(cls):
+        if cls._validator_cache is None:
+            schema = cls.get_schema()
+            validator_class = jsonschema.validators.validator_for(schema)
+            cls._validator_cache = validator_class(
+                schema, format_checker=jsonschema.FormatChecker())
+        return cls._validator_cache
+
+    @classmethod
+    def get_sources(cls):
+        """Get the names of the sources the model can be enriched from.
+
+        The source name of an enricher is the last part of its key, e.g.
+        ``github`` for ``distribution.github``.
+        """
+        load_enrichers()
+        return [key.split('.')[-1] for key in cls._enrichers]
+
+    def get_enrichers(self, sources=None):
+        """Get ``(key, enricher)`` pairs, optionally only for some sources.
+
+        ``sources`` may contain both source names and full enricher keys.
+        """
+        load_enrichers()
+        return [
+            (key, enricher) for key, enricher in self._enrichers.items()
+            if is_selected(key, sources)]
+
+    @classmethod
+    def get_batch_enrichers(cls, sources=None):
+        """Get ``(key, batch_enricher)`` pairs, optionally for some sources."""
+        load_enrichers()
+        return [
+            (key, enricher) for key, enricher in cls._batch_enrichers.items()
+            if is_selected(key, sources)]
+
+    def enrichments(self, max_workers=ENRICH_MAX_WORKERS, sources=None):
+        """Run the enrichers and return ``(key, result)`` pairs.
+
+        The enrichers run concurrently in a pool of at most ``max_workers``
+        threads, so the total time is bounded by the slowest enricher. Each
+        enricher runs in a copy of the caller's context, and thus within the
+        caller's deadline, if any. With a single worker, the enrichers get
+        equal shares of the time left instead. The results are returned in
+        the order the enrichers were registered.
+        """
+        items = self.get_enrichers(sources)
+        workers = min(max_workers, len(items))
+
+        if workers <= 1:
+            results = []
+            for i, (_, enricher) in enumerate(items):
+                with deadline.share(len(items) - i):
+                    results.append(enricher(self.data))
+        else:
+            with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+                futures = [
+                    executor.submit(
+                        contextvars.copy_context().run, enricher, self.data)
+                    for _, enricher in items]
+                results = [future.result() for future in futures]
+
+        return [(key, result) for (key, _), result in zip(items, results)]
+
+    def enrich(self, max_workers=ENRICH_MAX_WORKERS, sources=None):
+        """Enrich the data, optionally only from some sources.
+
+        Fields of the sources not enriched from keep their raw values.
+        """
+        self.apply_enrichments(self.enrichments(max_workers, sources))
+
+    def apply_enrichments(self, results, updated_at=None, fetched_at=None):
+        """Store ``(key, result)`` pairs from the enrichers in the data.
+
+        ``updated_at`` is the Unix time the oldest of the results was fetched
+        at, and ``fetched_at`` the time the newest was, if not now. The
+        latter is kept in :attr:`fetched_at`.
+        """
+        for key, result in results:
             obj = self.data
             parts = key.split('.')
             parts, last = parts[:-1], parts[-1]
             for part in parts:
                 obj = obj[part]
-            obj[last] = enricher(self.data)
+            obj[last] = result
 
-        self.data['updated_at'] = datetime.datetime.utcnow().strftime(
-            '%Y-%m-%dT%H:%M:%SZ')
+        self.fetched_at = time.time() if fetched_at is None else fetched_at
+        if updated_at is None:
+            updated_at = datetime.datetime.utcnow()
+        else:
+            updated_at = datetime.datetime.utcfromtimestamp(updated_at)
+        self.data['updated_at'] = updated_at.strftime('%Y-%m-%dT%H:%M:%SZ')
 
 
 class Person(Model):
@@ -87,6 +386,7 @@ class Person(Model):
     SCHEMA_FILE = ROOT_DIR / 'schemas' / 'person.schema.json'
 
     _enrichers = {}
+    _batch_enrichers = {}
 
 
 class Project(Model):
@@ -96,7 +396,4 @@ class Project(Model):
     SCHEMA_FILE = ROOT_DIR / 'schemas' / 'project.schema.json'
 
     _enrichers = {}
-
-
-from mopidy_packages.person import *  # noqa: Register Person enrichers
-from mopidy_packages.project import *  # noqa: Register Project enrichers
+    _batch_enrichers = {}
@@ -1,5 +1,4 @@
-import requests
-
+from mopidy_packages import upstream
 from mopidy_packages.models import Person
 
 
@@ -41,7 +40,7 @@ def add_discuss_profile(data):
     }
 
     api_url = url + '.json'
-    response = requests.get(api_url)
+    response = upstream.get(api_url)
     if response.status_code != 200:
         return result
 
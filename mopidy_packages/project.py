@@ -1,21 +1,80 @@
 import datetime
 import distutils.version
+import json
+import urllib.parse
 
 from natsort import natsorted
 
-import requests
-
+from mopidy_packages import github, pypi, upstream
 from mopidy_packages.models import Project
 
 
+# The AUR RPC interface that takes many packages per request
+AUR_MULTIINFO_URL = 'https://aur.archlinux.org/rpc/?v=5&type=info&'
+
+# Prefix of the URLs each package of a multi-info request is stored under
+AUR_PACKAGE_URL_PREFIX = 'https://aur.archlinux.org/rpc/?v=5&type=info#'
+
+# Number of packages per AUR request, keeping the URL short enough
+AUR_CHUNK_SIZE = 100
+
+
 @Project.enricher('github')
 def add_github_repo(data):
     id = data['distribution'].get('github')
     if id is None:
         return
 
+    result = github_result(id)
+
+    # Use the repository if a recent batch, e.g. by the warm command, got it
+    try:
+        repo = github.cached_repo(id)
+    except KeyError:
+        pass
+    else:
+        if repo is not None:
+            result['sources'].append(github.repo_url(id))
+            update_github_result(result, repo)
+        return result
+
+    api_url = 'https://api.github.com/repos/%s' % id
+    response = upstream.get(api_url)
+    if response.status_code != 200:
+        return result
+
+    result['sources'].append(api_url)
+
+    repo = response.json()
+    repo['tags'] = [tag_obj['name'] for tag_obj in get_github_tags(id)]
+    result['sources'].append(api_url + '/tags')
+
+    return update_github_result(result, repo)
+
+
+@Project.batch_enricher('github')
+def add_github_repos(datas):
+    ids = [
+        data['distribution']['github'] for data in datas
+        if data['distribution'].get('github') is not None]
+    repos = github.fetch_repos(ids)
+
+    results = {}
+    for data in datas:
+        id = data['distribution'].get('github')
+        if id is None:
+            results[data['id']] = None
+        elif id in repos:
+            results[data['id']] = result = github_result(id)
+            if repos[id] is not None:
+                result['sources'].append(github.repo_url(id))
+                update_github_result(result, repos[id])
+    return results
+
+
+def github_result(id):
     owner, repo = id.split('/', 1)
-    result = {
+    return {
         'id': id,
         'owner': owner,
         'repo': repo,
@@ -23,14 +82,8 @@ def add_github_repo(data):
         'sources': [],
     }
 
-    api_url = 'https://api.github.com/repos/%s' % id
-    response = requests.get(api_url)
-    if response.status_code != 200:
-        return result
-
-    result['sources'].append(api_url)
 
-    github = response.json()
+def update_github_result(result, github):
     result['created_at'] = github['created_at']
     result['pushed_at'] = github['pushed_at']
     result['updated_at'] = github['updated_at']
@@ -42,20 +95,21 @@ def add_github_repo(data):
     result['forks_count'] = github['forks_count']
     result['open_issues_count'] = github['open_issues_count']
 
-    result['tags'] = list(get_github_tags(id))
+    result['tags'] = list(filter_version_tags(github['tags']))
     result['latest_tag'] = result['tags'] and result['tags'][0] or None
-    result['sources'].append(api_url + '/tags')
 
     return result
 
 
 def get_github_tags(id):
-    response = requests.get('https://api.github.com/repos/%s/tags' % id)
+    response = upstream.get('https://api.github.com/repos/%s/tags' % id)
     if response.status_code != 200:
-        return
+        return []
+    return response.json()
 
-    for tag_obj in response.json():
-        tag = tag_obj['name']
+
+def filter_version_tags(tags):
+    for tag in tags:
         try:
             distutils.version.StrictVersion(tag.lstrip('v'))
         except ValueError:
@@ -70,33 +124,33 @@ def add_pypi_info(data):
     if id is None:
         return
 
-    url = 'https://pypi.python.org/pypi/%s' % id
+    url = '%s/%s' % (pypi.BASE_URL, id)
     result = {
         'id': id,
         'url': url,
         'sources': [],
     }
 
-    api_url = url + '/json'
-    response = requests.get(api_url)
+    api_url = pypi.package_url(id)
+    response = upstream.get(api_url)
     if response.status_code != 200:
         return result
 
     result['sources'].append(api_url)
 
-    pypi = response.json()
-    result['author'] = pypi['info']['author']
-    result['author_email'] = pypi['info']['author_email']
-    result['version'] = pypi['info']['version']
-    result['downloads'] = pypi['info']['downloads']
-    result['requires_dist'] = pypi['info']['requires_dist']
+    package = pypi.parse(response.content)
+    result['author'] = package['info']['author']
+    result['author_email'] = package['info']['author_email']
+    result['version'] = package['info']['version']
+    result['downloads'] = package['info']['downloads']
+    result['requires_dist'] = package['info']['requires_dist']
     result['has_wheel'] = any(
-        url['packagetype'] == 'bdist_wheel' for url in pypi['urls'])
+        url['packagetype'] == 'bdist_wheel' for url in package['urls'])
 
-    result['releases'] = list(reversed(natsorted(pypi['releases'].keys())))
+    result['releases'] = list(reversed(natsorted(package['releases'])))
 
-    if pypi['urls']:
-        result['released_at'] = '%sZ' % pypi['urls'][0]['upload_time']
+    if package['urls']:
+        result['released_at'] = '%sZ' % package['urls'][0]['upload_time']
     else:
         result['released_at'] = None
 
@@ -109,29 +163,91 @@ def add_aur_info(data):
     if id is None:
         return
 
-    result = {
-        'id': id,
-        'url': 'https://aur.archlinux.org/packages/%s/' % id,
-        'sources': [],
-    }
+    result = aur_result(id)
 
     api_url = 'https://aur.archlinux.org/rpc.php?type=info&arg=%s' % id
-    response = requests.get(api_url)
+    response = upstream.get(api_url)
     if response.status_code != 200:
         return result
 
     result['sources'].append(api_url)
 
-    aur = response.json()
-    result['description'] = aur['results']['Description']
-    result['homepage'] = aur['results']['URL']
-    result['version'] = aur['results']['Version']
-    result['outdated'] = bool(aur['results']['OutOfDate'])
-    result['vote_count'] = aur['results']['NumVotes']
-    result['maintainer'] = aur['results']['Maintainer']
-    result['created_at'] = unix_to_iso(aur['results']['FirstSubmitted'])
-    result['updated_at'] = unix_to_iso(aur['results']['LastModified'])
+    return update_aur_result(result, response.json()['results'])
+
+
+@Project.batch_enricher('aur')
+def add_aur_infos(datas):
+    ids = sorted({
+        data['distribution']['aur'] for data in datas
+        if data['distribution'].get('aur') is not None})
+    packages = fetch_aur_packages(ids)
+
+    results = {}
+    for data in datas:
+        id = data['distribution'].get('aur')
+        if id is None:
+            results[data['id']] = None
+        elif id in packages:
+            results[data['id']] = result = aur_result(id)
+            result['sources'].append(aur_package_url(id))
+            update_aur_result(result, packages[id])
+    return results
+
+
+def aur_package_url(id):
+    """Get the URL the multi-info data of a package is stored under."""
+    return AUR_PACKAGE_URL_PREFIX + id
+
+
+def fetch_aur_packages(ids):
+    """Fetch many AUR packages with as few requests as possible.
+
+    Returns a dict mapping the name of each found package to its info. Each
+    package is stored under its :func:`aur_package_url`, so it is recorded
+    with validators of its own, and pages only change with their packages.
+    """
+    packages = {}
+    for start in range(0, len(ids), AUR_CHUNK_SIZE):
+        api_url = AUR_MULTIINFO_URL + urllib.parse.urlencode([
+            ('arg[]', id) for id in ids[start:start + AUR_CHUNK_SIZE]])
+        response = upstream.get(api_url)
+        if response.status_code != 200:
+            continue
+        for info in response.json()['results']:
+            packages[info['Name']] = info
+            upstream.store(aur_package_url(info['Name']), json.dumps(
+                info, sort_keys=True).encode('utf-8'))
+    return packages
+
+
+def check_aur_packages(urls):
+    """Get the current validators of the stored packages."""
+    ids = sorted(url[len(AUR_PACKAGE_URL_PREFIX):] for url in urls)
+    with upstream.recording() as fetched:
+        fetch_aur_packages(ids)
+    return {url: fetched[url] for url in urls if url in fetched}
+
+
+upstream.register_checker(AUR_PACKAGE_URL_PREFIX, check_aur_packages)
+
+
+def aur_result(id):
+    return {
+        'id': id,
+        'url': 'https://aur.archlinux.org/packages/%s/' % id,
+        'sources': [],
+    }
+
 
+def update_aur_result(result, aur):
+    result['description'] = aur['Description']
+    result['homepage'] = aur['URL']
+    result['version'] = aur['Version']
+    result['outdated'] = bool(aur['OutOfDate'])
+    result['vote_count'] = aur['NumVotes']
+    result['maintainer'] = aur['Maintainer']
+    result['created_at'] = unix_to_iso(aur['FirstSubmitted'])
+    result['updated_at'] = unix_to_iso(aur['LastModified'])
     return result
 
 
@@ -154,7 +270,7 @@ def add_apt_info(data):
     }
 
     api_url = 'http://sources.debian.net/api/src/%s/' % id
-    response = requests.get(api_url)
+    response = upstream.get(api_url)
     if response.status_code != 200:
         return result
 
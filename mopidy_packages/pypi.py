@@ -0,0 +1,213 @@
+import io
+import json
+import logging
+import re
+import time
+import xmlrpc.client
+
+try:
+    import ijson
+except ImportError:  # pragma: no cover
+    ijson = None
+
+from mopidy_packages import upstream
+
+
+logger = logging.getLogger(__name__)
+
+
+BASE_URL = 'https://pypi.python.org/pypi'
+
+XMLRPC_URL = 'https://pypi.org/pypi'
+
+# Name of the cache state with the serial of the last refresh
+STATE_NAME = 'pypi-changelog'
+
+# Most pages of the changelog to read, before refreshing everything instead
+MAX_CHANGELOG_PAGES = 20
+
+# Fields of a package's "info" object used for enrichment
+INFO_FIELDS = [
+    'author',
+    'author_email',
+    'version',
+    'downloads',
+    'requires_dist',
+]
+
+URL_FIELDS = ['packagetype', 'upload_time']
+
+
+def package_url(name):
+    return '%s/%s/json' % (BASE_URL, name)
+
+
+def parse(content, streaming=None):
+    """Extract the fields used for enrichment from a PyPI JSON document.
+
+    Returns a dict with the used ``info`` fields, the ``releases`` version
+    strings, and the used fields of the ``urls`` of the latest release.
+
+    With ``streaming``, which is the default if ijson is installed, the
+    document is parsed as a stream of events, and only the used fields are
+    built as Python objects. The files of all releases, which make up most
+    of the document of long-lived packages, are skipped without building
+    them.
+    """
+    if streaming is None:
+        streaming = ijson is not None
+    if streaming:
+        return _parse_stream(io.BytesIO(content))
+    return _parse_document(json.loads(content.decode('utf-8')))
+
+
+def _parse_document(document):
+    return {
+        'info': {
+            field: document['info'].get(field) for field in INFO_FIELDS},
+        'releases': list(document.get('releases') or {}),
+        'urls': [
+            {field: url.get(field) for field in URL_FIELDS}
+            for url in document['urls']],
+    }
+
+
+def _parse_stream(fileobj):
+    info = {}
+    releases = []
+    urls = []
+    info_prefixes = {'info.%s' % field: field for field in INFO_FIELDS}
+    url_prefixes = {'urls.item.%s' % field: field for field in URL_FIELDS}
+
+    builder = builder_prefix = None
+    for prefix, event, value in ijson.parse(fileobj, use_float=True):
+        if builder is not None:
+            builder.event(event, value)
+            if prefix == builder_prefix and event in ('end_map', 'end_array'):
+                info[info_prefixes[prefix]] = builder.value
+                builder = None
+        elif prefix in info_prefixes:
+            if event in ('start_map', 'start_array'):
+                builder = ijson.ObjectBuilder()
+                builder.event(event, value)
+                builder_prefix = prefix
+            else:
+                info[info_prefixes[prefix]] = value
+        elif prefix == 'releases' and event == 'map_key':
+            releases.append(value)
+        elif prefix == 'urls.item' and event == 'start_map':
+            urls.append({field: None for field in URL_FIELDS})
+        elif prefix in url_prefixes:
+            urls[-1][url_prefixes[prefix]] = value
+
+    return {
+        'info': {field: info.get(field) for field in INFO_FIELDS},
+        'releases': releases,
+        'urls': urls,
+    }
+
+
+def normalize(name):
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+def call(method, *params):
+    """Call a method of the PyPI XML-RPC API.
+
+    Returns :class:`None` if the call failed.
+    """
+    response = upstream.post(
+        XMLRPC_URL,
+        data=xmlrpc.client.dumps(params, method),
+        headers={'Content-Type': 'text/xml'})
+    if response.status_code != 200:
+        return None
+    try:
+        (result,), _ = xmlrpc.client.loads(response.content)
+    except (xmlrpc.client.Fault, xmlrpc.client.ResponseError) as exc:
+        logger.warning('Calling %s on PyPI failed: %s', method, exc)
+        return None
+    return result
+
+
+def changelog_last_serial():
+    """Get the serial of the latest change on PyPI, or :class:`None`."""
+    return call('changelog_last_serial')
+
+
+def changelog_since_serial(serial):
+    """Get the ``(name, version, time, action, serial)`` changes on PyPI.
+
+    PyPI returns at most a page of changes per call. Returns :class:`None` if
+    the changelog could not be fetched.
+    """
+    return call('changelog_since_serial', serial)
+
+
+def changed_since_serial(serial, last_serial):
+    """Get the normalized names of the packages changed since ``serial``.
+
+    The changelog is read a page at a time, up to ``last_serial``. Returns
+    :class:`None` if the changelog could not be read, or would take more than
+    :data:`MAX_CHANGELOG_PAGES` pages.
+    """
+    changed = set()
+    for _ in range(MAX_CHANGELOG_PAGES):
+        if serial >= last_serial:
+            return changed
+        changes = changelog_since_serial(serial)
+        if changes is None:
+            return None
+        if not changes:
+            return changed
+        for name, _, _, _, change_serial in changes:
+            changed.add(normalize(name))
+            serial = max(serial, change_serial)
+    logger.warning(
+        'PyPI changelog is longer than %d pages', MAX_CHANGELOG_PAGES)
+    return None
+
+
+def refresh_cache(names, response_cache):
+    """Refresh the cached documents of PyPI packages from the changelog.
+
+    The global PyPI serial of each refresh is stored in the cache. The next
+    refresh reads the changes since then from the changelog. Documents of
+    changed packages are dropped, so they are fetched again on next use.
+    Documents cached after the previous refresh, and not changed since, are
+    marked as fresh. Older documents are left to the usual TTL and
+    revalidation, as it is unknown which changes they include. This costs one
+    request per page of the changelog, instead of one per package.
+
+    Returns the names of the changed packages, or :class:`None` if the
+    changelog was not available, or this is the first refresh.
+    """
+    last_serial = changelog_last_serial()
+    if last_serial is None:
+        return None
+    refreshed_at = time.time()
+
+    state = response_cache.get_state(STATE_NAME)
+    changed = None
+    if state is not None:
+        changed = changed_since_serial(state['serial'], last_serial)
+
+    # Documents cached from now on include all changes up to last_serial.
+    # If the changelog could not be read, older documents are not marked
+    # fresh again until they have been revalidated.
+    response_cache.set_state(STATE_NAME, {
+        'serial': last_serial, 'refreshed_at': refreshed_at})
+    if changed is None:
+        return None
+
+    result = set()
+    for name in names:
+        entry = response_cache.get(package_url(name))
+        if entry is None:
+            continue
+        if normalize(name) in changed:
+            response_cache.delete(package_url(name))
+            result.add(name)
+        elif entry.stored_at >= state['refreshed_at']:
+            response_cache.touch(package_url(name))
+    return result
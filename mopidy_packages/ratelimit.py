@@ -0,0 +1,156 @@
+import email.utils
+import logging
+import random
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+# Longest time to wait for a rate limit to reset before giving up, in seconds
+DEFAULT_MAX_WAIT = 10
+
+# Remaining requests below which requests are spread evenly until the reset
+PACE_BELOW = 100
+
+# Number of times a rate limited or failed request is retried
+MAX_RETRIES = 3
+
+# Base and maximum delay of the exponential backoff, in seconds
+BACKOFF_BASE = 1
+BACKOFF_MAX = 30
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class RateLimitExhausted(Exception):
+
+    def __init__(self, host, retry_after):
+        super().__init__(
+            'Rate limit of %s exhausted, retry in %d seconds' % (
+                host, retry_after))
+        self.host = host
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value, now):
+    """Get the seconds to wait from a ``Retry-After`` header value."""
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(date.timestamp() - now, 0)
+
+
+def is_rate_limited(response):
+    if response.status_code == 429:
+        return True
+    if response.status_code != 403:
+        return False
+    return (
+        response.headers.get('X-RateLimit-Remaining') == '0' or
+        'Retry-After' in response.headers)
+
+
+def should_retry(response):
+    return response.status_code in RETRY_STATUSES or is_rate_limited(response)
+
+
+class HostScheduler:
+    """Schedules requests to a host within the rate limit it announces.
+
+    The scheduler tracks the ``X-RateLimit-Remaining`` and
+    ``X-RateLimit-Reset`` headers used by e.g. GitHub, and ``Retry-After``.
+    Requests are sent right away while plenty of the budget remains. When
+    fewer than :data:`PACE_BELOW` requests remain, they are spread evenly
+    over the time left until the reset. When the budget is gone, requests
+    wait for the reset, unless that takes more than ``max_wait`` seconds, in
+    which case :exc:`RateLimitExhausted` is raised.
+    """
+
+    def __init__(
+            self, host, max_wait=DEFAULT_MAX_WAIT,
+            clock=time.time, sleep=time.sleep):
+        self.host = host
+        self.max_wait = max_wait
+        self.remaining = None
+        self.reset_at = None
+        self.blocked_until = 0
+        self._next_at = 0
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        """Wait until the next request may be sent.
+
+        Returns :class:`False` without waiting if that would take more than
+        ``timeout`` seconds, and :class:`True` otherwise.
+        """
+        with self._lock:
+            now = self._clock()
+            start = max(now, self.blocked_until, self._next_at)
+            if start - now > self.max_wait:
+                raise RateLimitExhausted(self.host, start - now)
+            if timeout is not None and start - now > timeout:
+                return False
+
+            if (self.remaining is not None and self.remaining < PACE_BELOW and
+                    self.reset_at is not None and self.reset_at > start):
+                interval = (self.reset_at - start) / max(self.remaining, 1)
+                self._next_at = start + interval
+                self.remaining = max(self.remaining - 1, 0)
+                if self.remaining == 0:
+                    self.blocked_until = self.reset_at
+
+        if start > now:
+            logger.debug('Waiting %.1fs for %s', start - now, self.host)
+            self._sleep(start - now)
+        return True
+
+    def update(self, response):
+        """Update the known budget from the headers of a response."""
+        now = self._clock()
+        headers = response.headers
+        with self._lock:
+            try:
+                remaining = int(headers.get('X-RateLimit-Remaining'))
+                reset_at = float(headers.get('X-RateLimit-Reset'))
+            except (TypeError, ValueError):
+                pass
+            else:
+                self.remaining, self.reset_at = remaining, reset_at
+                if remaining == 0:
+                    self.blocked_until = max(self.blocked_until, reset_at)
+
+            try:
+                retry_after = parse_retry_after(
+                    headers.get('Retry-After'), now)
+            except (AttributeError, TypeError):
+                retry_after = None
+            if retry_after is not None:
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+
+    def backoff(self, attempt):
+        """Wait before retrying a request that failed ``attempt`` times.
+
+        If the upstream said when to retry, :meth:`acquire` waits for that
+        instead. Otherwise, the delay grows exponentially, with full jitter
+        to keep concurrent retries apart.
+        """
+        if self.blocked_until > self._clock():
+            return
+        delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)
+        self._sleep(random.uniform(0, delay))
+
+    def exhausted(self):
+        """Get the error to raise when retries didn't get past the limit."""
+        return RateLimitExhausted(
+            self.host, max(self.blocked_until - self._clock(), 0))
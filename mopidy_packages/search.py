@@ -0,0 +1,171 @@
+import collections
+import re
+import threading
+import time
+
+from mopidy_packages import models
+
+
+# Seconds between checks of the data directory for changed files
+REFRESH_INTERVAL = 5
+
+TOKEN_RE = re.compile(r'[^\W_]+')
+
+
+def tokenize(text):
+    return set(TOKEN_RE.findall(text.lower()))
+
+
+def project_terms(data):
+    yield 'status', data.get('status')
+    yield 'license', data.get('license')
+    yield 'is_extension', str(data.get('is_extension', False)).lower()
+    for maintainer in data.get('maintainers', []):
+        yield 'maintainer', maintainer
+    for key in data.get('distribution', {}):
+        yield 'has', key
+    for field in ('id', 'name', 'description'):
+        for token in tokenize(data.get(field) or ''):
+            yield 'q', token
+
+
+def person_terms(data):
+    for key in data.get('profiles', {}):
+        yield 'has', key
+    for field in ('id', 'name'):
+        for token in tokenize(data.get(field) or ''):
+            yield 'q', token
+
+
+# Functions getting the (filter, value) terms to index an object by
+TERMS = {
+    models.Person: person_terms,
+    models.Project: project_terms,
+}
+
+FILTERS = {
+    models.Person: {'q', 'has'},
+    models.Project: {
+        'q', 'status', 'license', 'is_extension', 'maintainer', 'has'},
+}
+
+
+def lookup(table, model_class):
+    """Get the entry of a model class, or of the model it is derived from."""
+    for cls in model_class.__mro__:
+        if cls in table:
+            return table[cls]
+    raise KeyError(model_class)
+
+
+class Index:
+    """Inverted index from filter values to the IDs of matching objects.
+
+    The index is built from all data files when created, and is kept up to
+    date by the model's registry, which tells it about every loaded or
+    removed file. Unless the registry is frozen, the data directory is
+    checked for changes at most every ``refresh_interval`` seconds.
+    """
+
+    def __init__(self, model_class, refresh_interval=REFRESH_INTERVAL):
+        self.model_class = model_class
+        self.terms = lookup(TERMS, model_class)
+        self.filters = lookup(FILTERS, model_class)
+        self.refresh_interval = refresh_interval
+        self._postings = collections.defaultdict(set)
+        self._documents = {}
+        self._refreshed_at = 0
+        self._lock = threading.Lock()
+
+        registry = model_class.get_registry()
+        registry.subscribe(self.update)
+        self.refresh()
+
+    def refresh(self):
+        registry = self.model_class.get_registry()
+        for path, data in registry.all():
+            self.update(path, data)
+        self._refreshed_at = time.time()
+
+    def update(self, path, data):
+        """Index the data of the file at ``path``, or remove it if ``None``.
+
+        If ``path`` is :class:`None`, the registry was cleared, and the index
+        is rebuilt on next use.
+        """
+        with self._lock:
+            if path is None:
+                self._postings.clear()
+                self._documents.clear()
+                self._refreshed_at = 0
+                return
+            old = self._documents.get(path)
+            if old is not None and data is old[2]:
+                return
+            self._documents.pop(path, None)
+            if old is not None:
+                id, terms, _ = old
+                for term in terms:
+                    self._postings[term].discard(id)
+                    if not self._postings[term]:
+                        del self._postings[term]
+            if data is None:
+                return
+            terms = {
+                (name, value) for name, value in self.terms(data)
+                if value is not None}
+            for term in terms:
+                self._postings[term].add(data['id'])
+            self._documents[path] = (data['id'], terms, data)
+
+    def search(self, filters):
+        """Get the sorted IDs of the objects matching all the filters.
+
+        ``filters`` is a list of ``(name, value)`` pairs. The ``q`` filter
+        matches the words of the text fields, and all others match values
+        exactly.
+        """
+        registry = self.model_class.get_registry()
+        if (not registry.frozen and
+                time.time() - self._refreshed_at > self.refresh_interval):
+            self.refresh()
+
+        terms = set()
+        for name, value in filters:
+            if name == 'q':
+                terms.update(('q', token) for token in tokenize(value))
+            else:
+                terms.add((name, value))
+
+        with self._lock:
+            postings = sorted(
+                (self._postings.get(term, set()) for term in terms), key=len)
+            if not postings:
+                return []
+            ids = set(postings[0])
+            for posting in postings[1:]:
+                ids &= posting
+                if not ids:
+                    break
+        return sorted(ids)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(model_class):
+    """Get the index of a model, building it on first use."""
+    with _indexes_lock:
+        if model_class not in _indexes:
+            _indexes[model_class] = Index(model_class)
+        return _indexes[model_class]
+
+
+def maintained_projects(person_id):
+    """Get the sorted IDs of the projects a person maintains.
+
+    This is a lookup in the project index, which doubles as a reverse index
+    of the projects' ``maintainers``.
+    """
+    return get_index(models.Project).search([('maintainer', person_id)])
@@ -0,0 +1,538 @@
+import collections
+import concurrent.futures
+import contextlib
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import threading
+import urllib.parse
+
+import requests
+import requests.adapters
+
+import mopidy_packages
+from mopidy_packages import cache, circuit, deadline, ratelimit
+
+
+logger = logging.getLogger(__name__)
+
+
+# Number of hosts to keep connection pools for
+POOL_CONNECTIONS = 10
+
+# Number of keep-alive connections to keep per host
+POOL_MAXSIZE = 10
+
+DEFAULT_HEADERS = {
+    'Accept': 'application/json',
+    'User-Agent': 'Mopidy-Packages/%s' % mopidy_packages.__version__,
+}
+
+# Maximum number of requests in flight to a single host
+HOST_LIMITS = {
+    'api.github.com': 10,
+}
+
+# Seconds to wait for a host to respond, by host
+DEFAULT_TIMEOUT = 10
+HOST_TIMEOUTS = {
+    'api.github.com': 30,
+    'discuss.mopidy.com': 5,
+    'sources.debian.net': 5,
+}
+
+# Directory for the on-disk response cache, if not configured explicitly
+CACHE_DIR_ENV = 'MOPIDY_PACKAGES_CACHE_DIR'
+
+_session = None
+_session_is_default = False
+_session_lock = threading.Lock()
+_pool_maxsize = POOL_MAXSIZE
+
+_cache = None
+_cache_configured = False
+
+_host_semaphores = {
+    host: threading.BoundedSemaphore(limit)
+    for host, limit in HOST_LIMITS.items()}
+
+_host_timeouts = dict(HOST_TIMEOUTS)
+
+_schedulers = {}
+_breakers = {}
+_max_wait = ratelimit.DEFAULT_MAX_WAIT
+
+_recording = contextvars.ContextVar('recording', default=None)
+
+_checkers = {}
+
+
+def make_session(
+        pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE,
+        headers=None):
+    """Create a session with keep-alive connection pools for all hosts."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update(DEFAULT_HEADERS)
+    if headers is not None:
+        session.headers.update(headers)
+    return session
+
+
+def get_session():
+    """Get the session shared by all enrichers, creating it if needed."""
+    global _session, _session_is_default
+    with _session_lock:
+        if _session is None:
+            _session = make_session(pool_maxsize=_pool_maxsize)
+            _session_is_default = True
+        return _session
+
+
+def set_session(session):
+    """Replace the shared session, e.g. with a configured or fake one.
+
+    Returns the previous session. Pass :class:`None` to have a new default
+    session created on next use.
+    """
+    global _session, _session_is_default
+    with _session_lock:
+        previous, _session = _session, session
+        _session_is_default = False
+    return previous
+
+
+def reserve_connections(count):
+    """Keep at least ``count`` keep-alive connections per host.
+
+    This is the number of requests that may be in flight to a host at once,
+    e.g. the concurrency of an engine, so that no connection is discarded
+    for lack of room in the pool. A default session with smaller pools is
+    replaced on next use.
+    """
+    global _session, _pool_maxsize
+    with _session_lock:
+        if count <= _pool_maxsize:
+            return
+        _pool_maxsize = count
+        if _session_is_default:
+            _session = None
+
+
+class Recording(dict):
+    """Validators of the resources fetched in a context, by URL.
+
+    ``degraded`` is true if any of the responses was a stand-in for an
+    unavailable upstream, see :func:`degraded_response`.
+    """
+
+    degraded = False
+
+
+def get_scheduler(host):
+    """Get the rate limit scheduler of a host, creating it if needed."""
+    with _session_lock:
+        if host not in _schedulers:
+            _schedulers[host] = ratelimit.HostScheduler(
+                host, max_wait=_max_wait)
+        return _schedulers[host]
+
+
+def get_breaker(host):
+    """Get the circuit breaker of a host, creating it if needed."""
+    with _session_lock:
+        if host not in _breakers:
+            _breakers[host] = circuit.CircuitBreaker(host)
+        return _breakers[host]
+
+
+def set_host_timeout(host, timeout):
+    """Set the seconds to wait for a host to respond.
+
+    Pass :class:`None` to use the default timeout.
+    """
+    with _session_lock:
+        if timeout is None:
+            _host_timeouts.pop(host, None)
+        else:
+            _host_timeouts[host] = timeout
+
+
+def get_timeout(host):
+    """Get the seconds to wait for a host to respond."""
+    return _host_timeouts.get(host, DEFAULT_TIMEOUT)
+
+
+def set_max_wait(max_wait):
+    """Set the longest time to wait for the rate limit of a host to reset.
+
+    Requests that would have to wait longer raise
+    :exc:`~mopidy_packages.ratelimit.RateLimitExhausted` instead.
+    """
+    global _max_wait
+    with _session_lock:
+        _max_wait = max_wait
+        for scheduler in _schedulers.values():
+            scheduler.max_wait = max_wait
+
+
+def set_host_limit(host, limit):
+    """Limit the number of concurrent requests to a host.
+
+    Pass :class:`None` to remove the limit.
+    """
+    with _session_lock:
+        if limit is None:
+            _host_semaphores.pop(host, None)
+        else:
+            _host_semaphores[host] = threading.BoundedSemaphore(limit)
+
+
+def get_cache():
+    """Get the response cache, or :class:`None` if caching is disabled.
+
+    Unless :func:`set_cache` has been called, a cache is created in the
+    directory named by the ``MOPIDY_PACKAGES_CACHE_DIR`` environment variable,
+    if it is set.
+    """
+    global _cache, _cache_configured
+    with _session_lock:
+        if not _cache_configured:
+            cache_dir = os.environ.get(CACHE_DIR_ENV)
+            if cache_dir:
+                _cache = cache.ResponseCache(cache_dir)
+            _cache_configured = True
+        return _cache
+
+
+def set_cache(response_cache):
+    """Replace the response cache. Pass :class:`None` to disable caching.
+
+    Returns the previous cache.
+    """
+    global _cache, _cache_configured
+    with _session_lock:
+        previous, _cache = _cache, response_cache
+        _cache_configured = True
+    return previous
+
+
+def get(url, **kwargs):
+    response = _get(url, **kwargs)
+    fetched = _recording.get()
+    if fetched is not None:
+        fetched[url] = validators(response)
+        if is_degraded(response):
+            fetched.degraded = True
+    return response
+
+
+def _get(url, **kwargs):
+    response_cache = get_cache()
+    if response_cache is None or 'params' in kwargs:
+        return _send(url, **kwargs)
+
+    entry = response_cache.get(url)
+    if entry is not None:
+        if response_cache.is_fresh(entry):
+            return entry.to_response()
+        headers = entry.conditional_headers()
+        headers.update(kwargs.pop('headers', None) or {})
+        kwargs['headers'] = headers
+
+    response = _send(url, **kwargs)
+
+    if response.status_code == 304 and entry is not None:
+        return response_cache.revalidated(entry, response).to_response()
+    if response.status_code == 200:
+        response_cache.set(url, response)
+    return response
+
+
+def post(url, **kwargs):
+    """Send a POST request, e.g. a GraphQL query.
+
+    POST responses are neither cached nor recorded, as they can't be
+    revalidated. Use :func:`store` for the resources they contain instead.
+    """
+    return _send(url, method='post', **kwargs)
+
+
+def store(url, content):
+    """Record and cache a resource that was not fetched with a GET request.
+
+    The resource is recorded with the validators of its ``content``, and
+    stored in the response cache, if any, under the given URL, e.g. for
+    each repository in the response of a GraphQL query. Such resources
+    can't be revalidated, so their changes are detected by the checker
+    registered for the URL, see :func:`register_checker`.
+    """
+    response = requests.Response()
+    response.status_code = 200
+    response.reason = 'OK'
+    response.url = url
+    response._content = content
+    fetched = _recording.get()
+    if fetched is not None:
+        fetched[url] = validators(response)
+    response_cache = get_cache()
+    if response_cache is not None:
+        response_cache.set(url, response)
+
+
+def cached(url):
+    """Get a fresh resource stored with :func:`store`, or :class:`None`.
+
+    The resource is recorded like a fetched one.
+    """
+    response_cache = get_cache()
+    if response_cache is None:
+        return None
+    entry = response_cache.get(url)
+    if entry is None or not response_cache.is_fresh(entry):
+        return None
+    response = entry.to_response()
+    fetched = _recording.get()
+    if fetched is not None:
+        fetched[url] = validators(response)
+    return response
+
+
+def register_checker(prefix, checker):
+    """Register a function checking resources stored with :func:`store`.
+
+    The checker gets a list of the URLs starting with ``prefix``, fetches
+    the resources anew, and returns a dict mapping each URL to the current
+    validators of its resource. Resources left out are taken as changed.
+    """
+    with _session_lock:
+        _checkers[prefix] = checker
+
+
+def get_checker(url):
+    """Get the checker registered for a URL, or :class:`None`."""
+    for prefix, checker in _checkers.items():
+        if url.startswith(prefix):
+            return prefix, checker
+    return None, None
+
+
+def _send(url, method='get', **kwargs):
+    """Send a request, within the rate limit and concurrency of the host.
+
+    Rate limited and failed requests are retried with backoff, unless there
+    is a deadline, which the backoff would likely outlast. Raises
+    :exc:`~mopidy_packages.ratelimit.RateLimitExhausted` if the rate limit
+    of the host doesn't allow the request within the maximum wait, unless
+    there is a deadline, as the other upstreams may still be usable then.
+
+    Waiting for the rate limit and for a free slot of the host's concurrency
+    limit ends at the deadline, and the request then times out after the
+    host's timeout or at the deadline, whichever comes first. If the request
+    fails or times out, the deadline passes, or the host's circuit breaker is
+    open, or the rate limit is exhausted within a deadline, a stand-in
+    response is returned, see :func:`degraded_response`.
+    """
+    send = getattr(get_session(), method)
+    host = urllib.parse.urlsplit(url).hostname
+    scheduler = get_scheduler(host)
+    breaker = get_breaker(host)
+    max_retries = ratelimit.MAX_RETRIES
+    if deadline.remaining() is not None:
+        max_retries = 0
+
+    for attempt in range(max_retries + 1):
+        if not breaker.allow():
+            return degraded_response(
+                url, 'Skipping %s after repeated failures' % host)
+        try:
+            response = _send_once(send, url, host, scheduler, breaker, kwargs)
+        finally:
+            # A trial request that was not sent doesn't tell if the host
+            # works again
+            breaker.release()
+        if is_degraded(response) or not ratelimit.should_retry(response):
+            return response
+        if attempt < max_retries:
+            logger.info(
+                'Retrying %s after status %d', url, response.status_code)
+            scheduler.backoff(attempt)
+
+    if ratelimit.is_rate_limited(response):
+        return exhausted(url, scheduler.exhausted())
+    return response
+
+
+def exhausted(url, exc):
+    """Raise the error of an exhausted rate limit, unless within a deadline.
+
+    Within a deadline, a stand-in response is returned instead.
+    """
+    if deadline.remaining() is None:
+        raise exc
+    return degraded_response(url, str(exc))
+
+
+def _send_once(send, url, host, scheduler, breaker, kwargs):
+    try:
+        acquired = scheduler.acquire(timeout=deadline.remaining())
+    except ratelimit.RateLimitExhausted as exc:
+        return exhausted(url, exc)
+    if not acquired:
+        return degraded_response(
+            url, 'Deadline exceeded waiting for the rate limit of %s' % host)
+    semaphore = _host_semaphores.get(host)
+    if semaphore is not None and not semaphore.acquire(
+            timeout=deadline.remaining()):
+        return degraded_response(
+            url, 'Deadline exceeded waiting for a connection to %s' % host)
+
+    try:
+        host_timeout = get_timeout(host)
+        remaining = deadline.remaining()
+        timeout = host_timeout if remaining is None else min(
+            host_timeout, remaining)
+        if timeout <= 0:
+            return degraded_response(url, 'Deadline exceeded')
+        try:
+            response = send(url, timeout=timeout, **kwargs)
+        except requests.RequestException as exc:
+            logger.warning('Request to %s failed: %s', url, exc)
+            # Running out of our own deadline says nothing about the host
+            if not (isinstance(exc, requests.Timeout) and
+                    timeout < host_timeout):
+                breaker.failed()
+            return degraded_response(url, str(exc))
+    finally:
+        if semaphore is not None:
+            semaphore.release()
+
+    scheduler.update(response)
+    breaker.update(response)
+    return response
+
+
+def degraded_response(url, reason):
+    """Make a stand-in response for a request that failed or wasn't sent.
+
+    The response has status 503 and no content, so enrichers treat it like
+    any other failed request, and return their results without the data of
+    this upstream.
+    """
+    response = requests.Response()
+    response.status_code = 503
+    response.reason = reason
+    response.url = url
+    response._content = b''
+    response.degraded = True
+    return response
+
+
+def is_degraded(response):
+    return getattr(response, 'degraded', False)
+
+
+def validators(response):
+    """Get the values identifying the version of a fetched resource.
+
+    Returns :class:`None` if the resource was not fetched successfully.
+    """
+    if response.status_code != 200:
+        return None
+    return {
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'digest': hashlib.sha256(response.content).hexdigest(),
+    }
+
+
+@contextlib.contextmanager
+def recording():
+    """Record the validators of all resources fetched in this context.
+
+    Yields a :class:`Recording`, a dict that is filled with the validators of
+    each fetched URL.
+    The recording follows the context into threads started with
+    :func:`contextvars.copy_context`, like the ones used by
+    :meth:`~mopidy_packages.models.Model.enrich`.
+    """
+    fetched = Recording()
+    token = _recording.set(fetched)
+    try:
+        yield fetched
+    finally:
+        _recording.reset(token)
+
+
+def record(fetched):
+    """Add validators recorded earlier to the current recording, if any."""
+    current = _recording.get()
+    if current is not None:
+        current.update(fetched)
+        if getattr(fetched, 'degraded', False):
+            current.degraded = True
+
+
+def has_changed(url, previous):
+    """Check if a resource has changed since it had the given validators."""
+    if previous is None:
+        return True
+
+    _, checker = get_checker(url)
+    if checker is not None:
+        return checker([url]).get(url) != previous
+
+    headers = {}
+    if get_cache() is None:
+        if previous['etag'] is not None:
+            headers['If-None-Match'] = previous['etag']
+        if previous['last_modified'] is not None:
+            headers['If-Modified-Since'] = previous['last_modified']
+
+    response = _get(url, headers=headers)
+    if response.status_code == 304:
+        return False
+    return validators(response) != previous
+
+
+def find_changed(sources, jobs=1):
+    """Check which resources changed since they had the given validators.
+
+    ``sources`` is a list of ``(url, validators)`` pairs. Returns a list
+    telling for each of them if the resource has changed, see
+    :func:`has_changed`. Each distinct resource is only checked once. The
+    resources of each registered checker are checked together, in a single
+    call of the checker, and the others with ``jobs`` parallel requests.
+    """
+    unique = collections.OrderedDict()
+    for url, previous in sources:
+        unique[(url, json.dumps(previous, sort_keys=True))] = previous
+
+    by_prefix = collections.OrderedDict()
+    others = []
+    for url, key in unique:
+        prefix, checker = get_checker(url)
+        if unique[(url, key)] is not None and checker is not None:
+            by_prefix.setdefault(prefix, (checker, []))[1].append((url, key))
+        else:
+            others.append((url, key))
+
+    changed = {}
+    for checker, keys in by_prefix.values():
+        current = checker(sorted({url for url, _ in keys}))
+        for url, key in keys:
+            changed[(url, key)] = current.get(url) != unique[(url, key)]
+    with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+        results = executor.map(
+            lambda url_key: has_changed(url_key[0], unique[url_key]),
+            others)
+        changed.update(zip(others, results))
+
+    return [
+        changed[(url, json.dumps(previous, sort_keys=True))]
+        for url, previous in sources]
@@ -1,10 +1,32 @@
+import base64
+import bisect
+import datetime
+import gzip
+import itertools
+
 import flask
 
-from mopidy_packages import models
+from mopidy_packages import deadline, enrichment, models, ratelimit, search
 
 
 app = flask.Flask(__name__)
 
+# Smallest response body worth compressing, in bytes
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_LEVEL = 6
+
+# Seconds a request may spend enriching objects from upstream services.
+# Results from upstreams that don't respond in time are left out.
+ENRICH_DEADLINE = 10
+
+# Maximum number of objects per page of a list
+MAX_LIMIT = 1000
+
+# Number of objects enriched at a time when streaming a list
+STREAM_CHUNK_SIZE = 50
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
 api_endpoints = []
 
 
@@ -14,6 +36,77 @@ def api_endpoint(func):
     return func
 
 
+@app.errorhandler(ratelimit.RateLimitExhausted)
+def rate_limit_exhausted(exc):
+    response = flask.Response(str(exc), status=503, content_type='text/plain')
+    response.headers['Retry-After'] = str(int(exc.retry_after) + 1)
+    return response
+
+
+@app.after_request
+def add_validators(response):
+    """Make JSON responses conditional and compress them if worthwhile.
+
+    Responses get a weak ETag from a hash of their content, which stays the
+    same whether the body is compressed or not. Requests with a matching
+    ``If-None-Match``, or with an ``If-Modified-Since`` no older than the
+    ``Last-Modified`` set by the view, get a 304 response.
+    """
+    if (flask.request.method not in ('GET', 'HEAD') or
+            response.status_code != 200 or
+            response.mimetype != 'application/json' or
+            response.is_streamed):
+        return response
+
+    response.add_etag(weak=True)
+    response.make_conditional(flask.request)
+    if response.status_code == 200:
+        compress(response)
+    return response
+
+
+def compress(response):
+    response.vary.add('Accept-Encoding')
+    if (flask.request.accept_encodings.quality('gzip') <= 0 or
+            response.content_encoding is not None):
+        return
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return
+    response.set_data(gzip.compress(data, COMPRESS_LEVEL))
+    response.content_encoding = 'gzip'
+
+
+def last_modified(objs, registries=()):
+    """Get the time the data of the objects last changed.
+
+    That is the time the data files were modified, or the time the newest
+    enrichment result was fetched, if later. The ``updated_at`` field is not
+    used, as it is the time the oldest result was fetched. Responses that
+    also depend on other data files, like lists, which change when files
+    are removed, pass the ``registries`` of those files, and the time they
+    last saw a change counts too.
+    """
+    times = [registry.changed_at for registry in registries]
+    for obj in objs:
+        try:
+            times.append(obj.path.stat().st_mtime)
+        except OSError:
+            pass
+        if obj.fetched_at is not None:
+            times.append(obj.fetched_at)
+    if not times:
+        return None
+    return datetime.datetime.fromtimestamp(
+        int(max(times)), datetime.timezone.utc)
+
+
+def json_response(objs, *args, registries=(), **kwargs):
+    response = flask.jsonify(*args, **kwargs)
+    response.last_modified = last_modified(objs, registries)
+    return response
+
+
 @app.route('/')
 def index():
     return flask.redirect(flask.url_for('list_api_endpoints'))
@@ -37,15 +130,7 @@ def list_api_endpoints():
 def list_people():
     """Returns a list of people in the Mopidy community"""
 
-    try:
-        people = [p.data for p in models.Person.all()]
-    except models.ModelException as exc:
-        return flask.Response(str(exc), status=500, content_type='text/plain')
-
-    for person in people:
-        link_person(person)
-
-    return flask.jsonify(people=people)
+    return list_objects(models.Person, 'people', {'url': link_person})
 
 
 @api_endpoint
@@ -61,27 +146,47 @@ def get_person(id):
     if person.data is None:
         flask.abort(404)
 
+    sources = requested_sources(models.Person, 'sources')
+    with deadline.limit(ENRICH_DEADLINE):
+        enrichment.enrich(person, sources)
     link_person(person.data)
-    person.enrich()
+    try:
+        link_projects(person.data)
+    except models.ModelException as exc:
+        return flask.Response(str(exc), status=500, content_type='text/plain')
 
-    return flask.jsonify(person.data)
+    return json_response(
+        [person], person.data, registries=[models.Project.get_registry()])
 
 
 @api_endpoint
-@app.route('/api/projects/')
-def list_projects():
-    """Returns a list of projects in the Mopidy ecosystem"""
+@app.route('/api/people/<id>/projects/')
+def list_person_projects(id):
+    """Returns a list of the projects a specific person maintains"""
 
     try:
-        projects = [p.data for p in models.Project.all()]
+        person = models.Person(id=id)
     except models.ModelException as exc:
         return flask.Response(str(exc), status=500, content_type='text/plain')
 
-    for project in projects:
-        link_project(project)
-        link_maintainers(project)
+    if person.data is None:
+        flask.abort(404)
 
-    return flask.jsonify(projects=projects)
+    return list_objects(models.Project, 'projects', {
+        'url': link_project,
+        'maintainers': link_maintainers,
+    }, filters=[('maintainer', id)])
+
+
+@api_endpoint
+@app.route('/api/projects/')
+def list_projects():
+    """Returns a list of projects in the Mopidy ecosystem"""
+
+    return list_objects(models.Project, 'projects', {
+        'url': link_project,
+        'maintainers': link_maintainers,
+    })
 
 
 @api_endpoint
@@ -97,11 +202,246 @@ def get_project(id):
     if project.data is None:
         flask.abort(404)
 
-    project.enrich()
+    sources = requested_sources(models.Project, 'sources')
+    with deadline.limit(ENRICH_DEADLINE):
+        enrichment.enrich(project, sources)
     link_project(project.data)
     link_maintainers(project.data)
 
-    return flask.jsonify(project.data)
+    return json_response([project], project.data)
+
+
+def list_objects(model_class, key, linkers, filters=()):
+    """Respond with a list of objects, ordered by ID.
+
+    Filter query arguments, like ``q``, ``status`` or ``has``, select the
+    objects matching all of them using the search index. The ``limit`` and
+    ``cursor`` query arguments select a page of the list, and ``fields`` the
+    fields to include. ``linkers`` maps generated fields to the functions
+    adding them, which are only called if the field is included. The given
+    ``filters`` always apply, in addition to the requested ones.
+
+    With the ``stream=1`` query argument, or if the client prefers NDJSON,
+    the list is streamed, see :func:`stream_objects`.
+    """
+    fields = requested_fields()
+    limit = requested_limit()
+    after = decode_cursor(flask.request.args.get('cursor'))
+    stream_format = requested_stream_format()
+
+    try:
+        filters = list(filters) + requested_filters(model_class)
+        objs = filtered_objects(
+            model_class, filters, after=after,
+            limit=None if limit is None else limit + 1)
+        if stream_format is None or limit is not None:
+            objs = list(objs)
+        else:
+            # Read the first objects now, to fail before the stream starts
+            first = list(itertools.islice(objs, STREAM_CHUNK_SIZE))
+            objs = itertools.chain(first, objs)
+    except models.ModelException as exc:
+        return flask.Response(str(exc), status=500, content_type='text/plain')
+
+    next_url = None
+    if limit is not None and len(objs) > limit:
+        objs = objs[:limit]
+        args = flask.request.args.copy()
+        args['cursor'] = encode_cursor(objs[-1].data['id'])
+        next_url = flask.url_for(
+            flask.request.endpoint, _external=True,
+            **args.to_dict(flat=False))
+
+    sources = requested_sources(model_class, 'enrich')
+
+    if stream_format is not None:
+        response = stream_objects(
+            objs, key, fields, linkers, sources, stream_format, next_url,
+            paginated=limit is not None)
+    else:
+        if sources is not None:
+            with deadline.limit(ENRICH_DEADLINE):
+                enrichment.enrich_many(objs, sources)
+        data = [render_object(obj, fields, linkers) for obj in objs]
+        registries = [model_class.get_registry()]
+        if limit is None:
+            response = json_response(
+                objs, registries=registries, **{key: data})
+        else:
+            response = json_response(
+                objs, registries=registries, **{key: data, 'next': next_url})
+    response.vary.add('Accept')
+    return response
+
+
+def stream_objects(
+        objs, key, fields, linkers, sources, stream_format, next_url,
+        paginated):
+    """Respond with a list of objects serialized one at a time.
+
+    The objects are enriched a chunk at a time, each chunk within its own
+    deadline, so neither the objects nor the response body of the whole
+    list are held in memory, and the first objects are sent before the rest
+    are read. Streamed responses have no validators and are not compressed.
+
+    In the ``json`` format the body is the same document as an unstreamed
+    response. In the ``ndjson`` format each object is a line of its own, and
+    the next page, if any, is linked from the ``Link`` header.
+    """
+    def generate_items():
+        for chunk in chunked(objs, STREAM_CHUNK_SIZE):
+            if sources is not None:
+                with deadline.limit(ENRICH_DEADLINE):
+                    enrichment.enrich_many(chunk, sources)
+            for obj in chunk:
+                yield app.json.dumps(render_object(obj, fields, linkers))
+
+    def generate_ndjson():
+        for item in generate_items():
+            yield item + '\n'
+
+    def generate_json():
+        yield '{"%s": [' % key
+        for i, item in enumerate(generate_items()):
+            yield item if i == 0 else ', ' + item
+        yield ']'
+        if paginated:
+            yield ', "next": %s' % app.json.dumps(next_url)
+        yield '}\n'
+
+    if stream_format == 'ndjson':
+        response = flask.Response(
+            flask.stream_with_context(generate_ndjson()),
+            mimetype=NDJSON_MIMETYPE)
+        if next_url is not None:
+            response.headers['Link'] = '<%s>; rel="next"' % next_url
+    else:
+        response = flask.Response(
+            flask.stream_with_context(generate_json()),
+            mimetype='application/json')
+    return response
+
+
+def render_object(obj, fields, linkers):
+    for field, linker in linkers.items():
+        if fields is None or field in fields:
+            linker(obj.data)
+    if fields is None:
+        return obj.data
+    return {field: obj.data[field] for field in fields if field in obj.data}
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def requested_stream_format():
+    """Get the format to stream a list in, or :class:`None` to not stream.
+
+    NDJSON is streamed if the client prefers it to JSON, and JSON if the
+    ``stream`` query argument is ``1``.
+    """
+    best = flask.request.accept_mimetypes.best_match(
+        ['application/json', NDJSON_MIMETYPE])
+    if best == NDJSON_MIMETYPE:
+        return 'ndjson'
+    if flask.request.args.get('stream') == '1':
+        return 'json'
+    return None
+
+
+def requested_filters(model_class):
+    """Get the ``(name, value)`` filters requested by the query arguments.
+
+    Empty filters, like those of an empty search box, and ``q`` filters
+    without any words, are left out, as they would match nothing.
+    """
+    names = search.lookup(search.FILTERS, model_class)
+    return [
+        (name, value) for name, value in flask.request.args.items(multi=True)
+        if name in names and value and
+        (name != 'q' or search.tokenize(value))]
+
+
+def filtered_objects(model_class, filters, after=None, limit=None):
+    """Get the objects matching the filters, ordered by ID."""
+    if not filters:
+        return model_class.all(after=after, limit=limit)
+
+    ids = search.get_index(model_class).search(filters)
+    if after is not None:
+        ids = ids[bisect.bisect_right(ids, after):]
+    objs = (model_class(id=id) for id in ids[:limit])
+    return (obj for obj in objs if obj.data is not None)
+
+
+def requested_fields():
+    """Get the fields requested by the ``fields`` query argument, if any."""
+    value = flask.request.args.get('fields')
+    if not value:
+        return None
+    return [field for field in value.split(',') if field]
+
+
+def requested_limit():
+    value = flask.request.args.get('limit')
+    if value is None:
+        return None
+    try:
+        limit = int(value)
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= MAX_LIMIT:
+        flask.abort(flask.Response(
+            'The limit must be a number from 1 to %d' % MAX_LIMIT,
+            status=400, content_type='text/plain'))
+    return limit
+
+
+def encode_cursor(id):
+    return base64.urlsafe_b64encode(id.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        return base64.b64decode(
+            cursor.encode('ascii'), altchars=b'-_', validate=True).decode(
+                'utf-8')
+    except (ValueError, UnicodeError):
+        flask.abort(flask.Response(
+            'Invalid cursor', status=400, content_type='text/plain'))
+
+
+def requested_sources(model_class, arg):
+    """Get the sources to enrich from, as requested by a query argument.
+
+    The argument can be ``1`` for all sources or a comma separated list of
+    source names, e.g. ``github,pypi``. Returns :class:`None` if enrichment
+    was not requested.
+    """
+    value = flask.request.args.get(arg)
+    if not value or value == '0':
+        return None
+
+    known = set(model_class.get_sources())
+    if value == '1':
+        return known
+
+    sources = set(value.split(','))
+    unknown = sources - known
+    if unknown:
+        flask.abort(flask.Response(
+            'Unknown sources: %s. Known sources: %s' % (
+                ', '.join(sorted(unknown)), ', '.join(sorted(known))),
+            status=400, content_type='text/plain'))
+    return sources
 
 
 def link_person(person_data):
@@ -114,6 +454,13 @@ def link_project(project_data):
         'get_project', id=project_data['id'], _external=True)
 
 
+def link_projects(person_data):
+    person_data['projects'] = {
+        project_id: flask.url_for(
+            'get_project', id=project_id, _external=True)
+        for project_id in search.maintained_projects(person_data['id'])}
+
+
 def link_maintainers(project_data):
     project_data['maintainers'] = {
         person_id: flask.url_for('get_person', id=person_id, _external=True)
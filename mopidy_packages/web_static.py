@@ -1,23 +1,109 @@
+import json
+import os
 import pathlib
+import threading
 
 import flask
 
+import werkzeug.utils
+
 
 app = flask.Flask(__name__)
 
+# Seconds clients and proxies may cache pages without revalidating them
+app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 5 * 60
+
+MANIFEST_FILE = 'manifest.json'
+
+# Precompressed variants of the pages, in order of preference
+ENCODINGS = [
+    ('br', '.br'),
+    ('gzip', '.gz'),
+]
+
+_etags = {}
+_etags_lock = threading.Lock()
+
+
+def get_etags(site_dir):
+    """Get the ETags of the pages of a site, as computed when building it.
+
+    The ETags are read from the site's manifest, and read again when the
+    manifest changes, e.g. because the site was rebuilt.
+    """
+    manifest_path = pathlib.Path(site_dir) / MANIFEST_FILE
+    try:
+        stat = manifest_path.stat()
+    except OSError:
+        return {}
+
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    with _etags_lock:
+        cached = _etags.get(manifest_path)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+
+    with manifest_path.open() as fh:
+        manifest = json.load(fh)
+    etags = {
+        url: page['etag'] for url, page in manifest['pages'].items()
+        if page.get('etag') is not None}
+
+    with _etags_lock:
+        _etags[manifest_path] = (stamp, etags)
+    return etags
+
 
 @app.route('/')
 def index():
     return flask.redirect(flask.url_for('dir', path='api'))
 
 
+def choose_encoding(file_path):
+    """Choose the best precompressed variant of a file the client accepts.
+
+    Returns an ``(encoding, suffix)`` pair, or :class:`None` if the file
+    should be sent as is.
+    """
+    accepted = flask.request.accept_encodings
+    candidates = []
+    for preference, (encoding, suffix) in enumerate(ENCODINGS):
+        quality = accepted.quality(encoding)
+        if quality > 0 and os.path.isfile(file_path + suffix):
+            candidates.append((quality, -preference, encoding, suffix))
+    if not candidates:
+        return None
+    _, _, encoding, suffix = max(candidates)
+    return encoding, suffix
+
+
 @app.route('/<path:path>/')
 def dir(path):
-    file_path = pathlib.Path(app.config['SITE_DIR']) / path / 'index.html'
+    """Serve a prebuilt page.
 
-    if not file_path.exists():
+    The file is passed to the WSGI server to send, with sendfile if the
+    server supports it. Requests with matching ``If-None-Match`` or
+    ``If-Modified-Since`` headers get a 304 response. If the client accepts
+    it, a precompressed variant of the page is sent instead.
+    """
+    site_dir = app.config['SITE_DIR']
+    filename = '%s/index.html' % path
+    file_path = werkzeug.utils.safe_join(site_dir, filename)
+    if file_path is None:
         flask.abort(404)
 
-    with file_path.open('r') as fh:
-        return flask.Response(
-            response=fh.read(), status=200, mimetype='application/json')
+    etag = get_etags(site_dir).get('/%s/' % path, True)
+    chosen = choose_encoding(file_path)
+    if chosen is not None:
+        encoding, suffix = chosen
+        filename += suffix
+        if etag is not True:
+            etag = '%s-%s' % (etag, encoding)
+
+    response = flask.send_from_directory(
+        site_dir, filename, mimetype='application/json',
+        etag=etag, conditional=True)
+    if chosen is not None:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
@@ -33,10 +33,18 @@ setup(
         'rfc3987',
         'setuptools',
     ],
+    extras_require={
+        'brotli': ['brotli'],
+        'streaming': ['ijson'],
+    },
     entry_points={
         'console_scripts': [
             'mopidy-packages = mopidy_packages.cli:cli',
         ],
+        'mopidy_packages.enrichers': [
+            'person = mopidy_packages.person',
+            'project = mopidy_packages.project',
+        ],
     },
     classifiers=[
         'Environment :: Console',
@@ -1,8 +1,50 @@
+import json
+import pathlib
 from unittest import mock
 
 import pytest
 
-from mopidy_packages import models, web, web_static
+from mopidy_packages import (
+    enrichment, models, ratelimit, upstream, web, web_static)
+
+
+@pytest.yield_fixture(autouse=True)
+def no_response_cache():
+    previous = upstream.set_cache(None)
+    yield
+    upstream.set_cache(previous)
+
+
+@pytest.yield_fixture(autouse=True)
+def reset_rate_limits():
+    patcher = mock.patch.object(ratelimit, 'BACKOFF_BASE', 0)
+    patcher.start()
+    yield
+    patcher.stop()
+    upstream.set_max_wait(ratelimit.DEFAULT_MAX_WAIT)
+    upstream._schedulers.clear()
+    upstream._breakers.clear()
+
+
+@pytest.yield_fixture(autouse=True)
+def clear_registries():
+    yield
+    models.Person.get_registry().clear()
+    models.Project.get_registry().clear()
+
+
+@pytest.yield_fixture(autouse=True)
+def clear_enrichment_cache():
+    yield
+    enrichment.cache.clear()
+
+
+@pytest.yield_fixture
+def session_mock():
+    session = mock.Mock()
+    previous = upstream.set_session(session)
+    yield session
+    upstream.set_session(previous)
 
 
 @pytest.fixture
@@ -37,3 +79,29 @@ def project_enrich_mock():
     patcher = mock.patch.object(models.Project, 'enrich')
     yield patcher.start()
     patcher.stop()
+
+
+@pytest.yield_fixture
+def engine_run_mock():
+    patcher = mock.patch.object(
+        enrichment.Engine, 'run', autospec=True, return_value={})
+    yield patcher.start()
+    patcher.stop()
+
+
+@pytest.fixture
+def person_class(tmpdir):
+    class TmpPerson(models.Person):
+        DATA_DIR = pathlib.Path(str(tmpdir))
+        _registry = None
+
+    return TmpPerson
+
+
+def write_person(person_class, id, name, profiles=None):
+    path = person_class.DATA_DIR / ('%s.json' % id)
+    path.write_text(json.dumps({
+        'id': id, 'name': name, 'email': '%s@example.com' % id,
+        'profiles': profiles or {},
+    }))
+    return path
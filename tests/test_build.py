@@ -0,0 +1,129 @@
+import gzip
+import json
+import pathlib
+
+import responses
+
+from mopidy_packages import build, web
+
+
+def test_page_inputs_of_detail_page():
+    inputs = build.page_inputs(web.app, '/api/projects/mopidy-spotify/')
+
+    assert inputs['data'] == build.digest([
+        build.models.Project.DATA_DIR / 'mopidy-spotify' / 'project.json'])
+    assert inputs['schema'] == build.digest([
+        build.models.Project.SCHEMA_FILE])
+
+
+def test_page_inputs_of_list_page_covers_all_data_files():
+    inputs = build.page_inputs(web.app, '/api/people/')
+
+    assert inputs['data'] == build.digest(sorted(
+        build.models.Person.DATA_DIR.glob('*.json')))
+
+
+def test_page_inputs_of_unknown_page():
+    assert build.page_inputs(web.app, '/api/projects/foobar/') is None
+    assert build.page_inputs(web.app, '/no/such/page/') is None
+
+
+def test_has_same_inputs():
+    url = '/api/people/jodal/'
+    page = {'inputs': build.page_inputs(web.app, url), 'upstream': {}}
+
+    assert build.has_same_inputs(web.app, url, page)
+
+
+def test_has_same_inputs_with_changed_inputs():
+    url = '/api/people/jodal/'
+    page = {'inputs': {'data': 'foo', 'schema': 'bar'}, 'upstream': {}}
+
+    assert not build.has_same_inputs(web.app, url, page)
+
+
+@responses.activate
+def test_changed_sources_with_changed_upstream():
+    responses.add(
+        responses.GET, 'https://discuss.mopidy.com/users/jodal.json',
+        body='{}', status=200, headers={'ETag': '"new"'})
+    validators = {'etag': '"old"', 'last_modified': None, 'digest': 'foo'}
+    page = {
+        'upstream': {
+            'https://discuss.mopidy.com/users/jodal.json': validators,
+        },
+    }
+
+    assert build.changed_sources([page]) == {build.source_key(
+        'https://discuss.mopidy.com/users/jodal.json', validators)}
+
+
+def test_write_and_read_manifest(tmpdir):
+    site_path = pathlib.Path(str(tmpdir))
+    pages = {'/api/people/jodal/': {}, '/api/': {}}
+
+    build.write_manifest(web.app, site_path, pages)
+    manifest = build.read_manifest(site_path)
+
+    assert set(manifest['pages']) == set(pages)
+    assert manifest['pages']['/api/']['inputs'] == {}
+
+
+def test_write_manifest_includes_etags_of_pages(tmpdir):
+    site_path = pathlib.Path(str(tmpdir))
+    site_path.joinpath('api').mkdir()
+    site_path.joinpath('api', 'index.html').write_text('a')
+    pages = {'/api/people/jodal/': {}, '/api/': {}}
+
+    build.write_manifest(web.app, site_path, pages)
+    manifest = build.read_manifest(site_path)
+
+    assert manifest['pages']['/api/']['etag'] == (
+        'ca978112ca1bbdcafac231b39a23dc4da786eff8147c4e72b9807785afee48bb')
+    assert manifest['pages']['/api/people/jodal/']['etag'] is None
+
+
+def test_read_manifest_ignores_manifest_from_other_generator(tmpdir):
+    site_path = pathlib.Path(str(tmpdir))
+    site_path.joinpath(build.MANIFEST_FILE).write_text(
+        '{"generator": "foo", "pages": {}}')
+
+    assert build.read_manifest(site_path) is None
+
+
+def test_compress_pages_writes_smaller_variants(tmpdir):
+    site_path = pathlib.Path(str(tmpdir))
+    site_path.joinpath('api').mkdir()
+    content = json.dumps({'projects': ['mopidy-spotify'] * 100}).encode()
+    site_path.joinpath('api', 'index.html').write_bytes(content)
+    site_path.joinpath('index.html').write_bytes(b'{}')
+
+    build.compress_pages(site_path, ['/api/', '/', '/missing/'])
+
+    gz_path = site_path.joinpath('api', 'index.html.gz')
+    assert gzip.decompress(gz_path.read_bytes()) == content
+    if build.brotli is not None:
+        br_path = site_path.joinpath('api', 'index.html.br')
+        assert build.brotli.decompress(br_path.read_bytes()) == content
+    assert not site_path.joinpath('index.html.gz').exists()
+
+
+def test_compress_pages_is_reproducible(tmpdir):
+    site_path = pathlib.Path(str(tmpdir))
+    site_path.joinpath('api').mkdir()
+    site_path.joinpath('api', 'index.html').write_text('{"a": 1}' * 100)
+
+    build.compress_pages(site_path, ['/api/'])
+    first = site_path.joinpath('api', 'index.html.gz').read_bytes()
+    site_path.joinpath('api', 'index.html.gz').unlink()
+    build.compress_pages(site_path, ['/api/'])
+
+    assert site_path.joinpath('api', 'index.html.gz').read_bytes() == first
+
+
+def test_page_inputs_of_person_page_covers_all_project_files():
+    inputs = build.page_inputs(web.app, '/api/people/jodal/projects/')
+
+    assert inputs['data'] == build.digest(
+        [build.models.Person.DATA_DIR / 'jodal.json'] +
+        sorted(build.models.Project.DATA_DIR.glob('*/project.json')))
@@ -0,0 +1,110 @@
+import os
+import time
+
+import pytest
+
+import requests
+
+from mopidy_packages import cache
+
+
+def make_response(body=b'{"foo": "bar"}', headers=None):
+    response = requests.Response()
+    response.status_code = 200
+    response.headers.update(headers or {})
+    response._content = body
+    return response
+
+
+@pytest.fixture
+def response_cache(tmpdir):
+    return cache.ResponseCache(str(tmpdir))
+
+
+def test_get_without_entry(response_cache):
+    assert response_cache.get('https://example.com/') is None
+
+
+def test_set_and_get(response_cache):
+    response_cache.set('https://example.com/', make_response(headers={
+        'Content-Type': 'application/json',
+        'Content-Encoding': 'gzip',
+        'ETag': '"abc"',
+    }))
+
+    entry = response_cache.get('https://example.com/')
+    response = entry.to_response()
+
+    assert response.status_code == 200
+    assert response.json() == {'foo': 'bar'}
+    assert response.headers['Content-Type'] == 'application/json'
+    assert 'Content-Encoding' not in response.headers
+    assert response.from_cache is True
+
+
+def test_conditional_headers(response_cache):
+    entry = response_cache.set('https://example.com/', make_response(headers={
+        'ETag': '"abc"',
+        'Last-Modified': 'Sat, 01 Aug 2015 10:00:00 GMT',
+    }))
+
+    assert entry.validators == {
+        'etag': '"abc"',
+        'last_modified': 'Sat, 01 Aug 2015 10:00:00 GMT',
+    }
+    assert entry.conditional_headers() == {
+        'If-None-Match': '"abc"',
+        'If-Modified-Since': 'Sat, 01 Aug 2015 10:00:00 GMT',
+    }
+
+
+def test_freshness_depends_on_host_ttl(tmpdir):
+    response_cache = cache.ResponseCache(
+        str(tmpdir), ttls={'api.github.com': 0, 'pypi.python.org': 60})
+
+    github = response_cache.set(
+        'https://api.github.com/repos/foo/bar', make_response())
+    pypi = response_cache.set(
+        'https://pypi.python.org/pypi/foo/json', make_response())
+
+    assert not response_cache.is_fresh(github)
+    assert response_cache.is_fresh(pypi)
+
+
+def test_revalidated_entry_is_fresh_again(response_cache):
+    entry = response_cache.set(
+        'https://example.com/', make_response(headers={'ETag': '"abc"'}))
+    entry.stored_at -= 365 * 24 * 60 * 60
+    assert not response_cache.is_fresh(entry)
+
+    entry = response_cache.revalidated(
+        entry, make_response(body=b'', headers={'ETag': '"def"'}))
+
+    assert response_cache.is_fresh(entry)
+    assert entry.validators['etag'] == '"def"'
+    assert entry.to_response().json() == {'foo': 'bar'}
+
+
+def test_evicts_least_recently_used_entries(tmpdir):
+    response_cache = cache.ResponseCache(str(tmpdir), max_size=1500)
+    body = b'x' * 300
+
+    for i in range(3):
+        response_cache.set('https://example.com/%d' % i, make_response(body))
+        meta_path, _ = response_cache._paths('https://example.com/%d' % i)
+        os.utime(str(meta_path), (time.time() - 100 + i,) * 2)
+
+    response_cache.set('https://example.com/3', make_response(body))
+
+    assert response_cache.get('https://example.com/0') is None
+    assert response_cache.get('https://example.com/3') is not None
+
+
+def test_state_is_stored_outside_entries(tmpdir):
+    response_cache = cache.ResponseCache(str(tmpdir), max_size=1)
+
+    assert response_cache.get_state('foo') is None
+    response_cache.set_state('foo', {'serial': 1})
+
+    assert response_cache.get_state('foo') == {'serial': 1}
+    assert list(response_cache._entries()) == []
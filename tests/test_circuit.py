@@ -0,0 +1,109 @@
+import threading
+from unittest import mock
+
+import pytest
+
+from mopidy_packages import circuit
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def breaker(clock):
+    return circuit.CircuitBreaker(
+        'sources.debian.net', failure_threshold=3, cool_down=30,
+        clock=clock.time)
+
+
+def fail(breaker, times):
+    for _ in range(times):
+        breaker.failed()
+
+
+def test_breaker_opens_after_consecutive_failures(breaker):
+    fail(breaker, 2)
+    breaker.succeeded()
+    fail(breaker, 2)
+
+    assert breaker.allow()
+
+    breaker.failed()
+
+    assert breaker.is_open
+    assert not breaker.allow()
+
+
+def test_breaker_lets_one_trial_request_through_after_cool_down(
+        breaker, clock):
+    fail(breaker, 3)
+    clock.now += 30
+
+    assert breaker.allow()
+    assert not breaker.allow()
+
+    breaker.succeeded()
+
+    assert not breaker.is_open
+    assert breaker.allow()
+
+
+def test_breaker_stays_open_if_trial_request_fails(breaker, clock):
+    fail(breaker, 3)
+    clock.now += 30
+    assert breaker.allow()
+
+    breaker.failed()
+
+    assert not breaker.allow()
+    clock.now += 30
+    assert breaker.allow()
+
+
+def test_update_counts_server_errors_as_failures(breaker):
+    for status_code in (500, 503, 504):
+        breaker.update(mock.Mock(status_code=status_code))
+
+    assert breaker.is_open
+
+
+def test_update_counts_other_responses_as_successes(breaker):
+    fail(breaker, 2)
+    breaker.update(mock.Mock(status_code=404))
+    fail(breaker, 2)
+
+    assert not breaker.is_open
+
+
+def test_release_gives_up_unfinished_trial(breaker, clock):
+    fail(breaker, 3)
+    clock.now += 30
+    assert breaker.allow()
+
+    breaker.release()
+
+    assert breaker.is_open
+    assert breaker.allow()
+
+
+def test_release_keeps_trial_of_other_thread(breaker, clock):
+    fail(breaker, 3)
+    clock.now += 30
+    thread = threading.Thread(target=breaker.allow)
+    thread.start()
+    thread.join()
+
+    breaker.release()
+
+    assert not breaker.allow()
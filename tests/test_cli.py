@@ -1,11 +1,16 @@
 import pathlib
+import subprocess
+import sys
 from unittest import mock
 
 import click.testing
 
+import flask_frozen
+
 import pytest
 
-from mopidy_packages import cli
+from mopidy_packages import (
+    build, cli, pypi, ratelimit, upstream, web, web_static)
 
 
 @pytest.fixture
@@ -20,8 +25,41 @@ def test_help(cli_runner):
     assert result.output.startswith('Usage:')
 
 
+def imported_modules(code):
+    """Get the modules imported by running the code in a new interpreter."""
+    output = subprocess.check_output([
+        sys.executable, '-c',
+        '%s\nimport sys\nprint(" ".join(sys.modules))' % code])
+    return set(output.decode('utf-8').splitlines()[-1].split())
+
+
+# Modules only needed to build or serve the site from the data files
+HEAVY_MODULES = {
+    'flask', 'flask_frozen', 'jsonschema', 'natsort', 'requests',
+    'mopidy_packages.models', 'mopidy_packages.person',
+    'mopidy_packages.project',
+}
+
+
+def test_help_imports_no_heavy_modules():
+    modules = imported_modules(
+        'from mopidy_packages import cli\n'
+        'cli.cli.main(["--help"], standalone_mode=False)')
+
+    assert 'click' in modules
+    assert not HEAVY_MODULES & modules
+
+
+def test_serve_static_imports_no_enrichment_modules():
+    modules = imported_modules(
+        'from mopidy_packages import cli, web_static')
+
+    assert 'flask' in modules
+    assert not (HEAVY_MODULES - {'flask'}) & modules
+
+
 def test_serve_ondemand_starts_web_server_with_defaults(cli_runner):
-    with mock.patch.object(cli.web, 'app') as app_mock:
+    with mock.patch.object(web, 'app') as app_mock:
         result = cli_runner.invoke(cli.serve_ondemand, [])
 
         assert result.exit_code == 0
@@ -30,7 +68,7 @@ def test_serve_ondemand_starts_web_server_with_defaults(cli_runner):
 
 
 def test_serve_ondemand_starts_web_server_with_given_args(cli_runner):
-    with mock.patch.object(cli.web, 'app') as app_mock:
+    with mock.patch.object(web, 'app') as app_mock:
         result = cli_runner.invoke(cli.serve_ondemand, [
             '--host', '0.0.0.0',
             '--port', '8000',
@@ -42,8 +80,18 @@ def test_serve_ondemand_starts_web_server_with_given_args(cli_runner):
             port=8000, host='0.0.0.0', debug=True)
 
 
+def test_serve_ondemand_uses_given_cache_dir(cli_runner, tmpdir):
+    with mock.patch.object(web, 'app'):
+        result = cli_runner.invoke(cli.serve_ondemand, [
+            '--cache-dir', str(tmpdir),
+        ])
+
+    assert result.exit_code == 0
+    assert str(upstream.get_cache().path) == str(tmpdir)
+
+
 def test_serve_static_aborts_without_site_dir(cli_runner):
-    with mock.patch.object(cli.web_static, 'app') as app_mock:
+    with mock.patch.object(web_static, 'app') as app_mock:
         with cli_runner.isolated_filesystem() as fs:
             result = cli_runner.invoke(cli.serve_static, [])
 
@@ -54,7 +102,7 @@ def test_serve_static_aborts_without_site_dir(cli_runner):
 
 
 def test_serve_static_starts_web_server_with_defaults(cli_runner):
-    with mock.patch.object(cli.web_static, 'app') as app_mock:
+    with mock.patch.object(web_static, 'app') as app_mock:
         with cli_runner.isolated_filesystem() as fs:
             site_dir = pathlib.Path(fs) / '_site'
             site_dir.mkdir()
@@ -66,7 +114,7 @@ def test_serve_static_starts_web_server_with_defaults(cli_runner):
 
 
 def test_serve_static_starts_web_server_with_given_args(cli_runner):
-    with mock.patch.object(cli.web_static, 'app') as app_mock:
+    with mock.patch.object(web_static, 'app') as app_mock:
         with cli_runner.isolated_filesystem() as fs:
             site_dir = pathlib.Path(fs) / '_site'
             site_dir.mkdir()
@@ -74,26 +122,33 @@ def test_serve_static_starts_web_server_with_given_args(cli_runner):
                 '--host', '0.0.0.0',
                 '--port', '8000',
                 '--debug',
+                '--max-age', '60',
             ])
 
         assert result.exit_code == 0
         app_mock.run.assert_called_once_with(
             port=8000, host='0.0.0.0', debug=True)
+        assert app_mock.config.__setitem__.call_args_list[-1] == mock.call(
+            'SEND_FILE_MAX_AGE_DEFAULT', 60)
 
 
-def test_build_static_freezes_api_site_to_disk(cli_runner):
-    with mock.patch.object(cli.flask_frozen, 'Freezer') as freezer_class_mock:
+def test_build_static_freezes_api_site_to_disk(
+        cli_runner, person_enrich_mock, project_enrich_mock,
+        engine_run_mock):
+    with mock.patch.object(flask_frozen, 'Freezer') as freezer_class_mock:
         with cli_runner.isolated_filesystem():
             result = cli_runner.invoke(cli.build_static, [])
 
         assert result.exit_code == 0
-        freezer_class_mock.assert_called_once_with(cli.web.app)
+        freezer_class_mock.assert_called_once_with(web.app)
         freezer_obj_mock = freezer_class_mock.return_value
         freezer_obj_mock.freeze.assert_called_once_with()
 
 
-def test_build_static_cleans_dest_dir(cli_runner):
-    with mock.patch.object(cli.flask_frozen, 'Freezer'):
+def test_build_static_cleans_dest_dir(
+        cli_runner, person_enrich_mock, project_enrich_mock,
+        engine_run_mock):
+    with mock.patch.object(flask_frozen, 'Freezer'):
         with cli_runner.isolated_filesystem() as fs:
             dest_path = pathlib.Path(fs) / 'dest'
             dest_path.mkdir()
@@ -103,3 +158,140 @@ def test_build_static_cleans_dest_dir(cli_runner):
             cli_runner.invoke(cli.build_static, ['dest'])
 
             assert not old_path.exists()
+
+
+def site_files(site_path):
+    return {
+        path.relative_to(site_path): path.read_bytes()
+        for path in site_path.glob('**/*')
+        if path.is_file() and path.name != 'manifest.json'}
+
+
+def test_build_static_with_jobs_matches_serial_build(
+        cli_runner, tmpdir, person_enrich_mock, project_enrich_mock,
+        engine_run_mock):
+    serial_path = pathlib.Path(str(tmpdir.join('serial')))
+    parallel_path = pathlib.Path(str(tmpdir.join('parallel')))
+
+    result = cli_runner.invoke(cli.build_static, [str(serial_path)])
+    assert result.exit_code == 0
+
+    with mock.patch.object(
+            build, 'render_pages',
+            wraps=build.render_pages) as render_pages_mock:
+        result = cli_runner.invoke(
+            cli.build_static, ['--jobs', '4', str(parallel_path)])
+        assert result.exit_code == 0
+        assert render_pages_mock.call_args[0][3] == 4
+
+    assert pathlib.Path('api/projects/mopidy-spotify/index.html') in (
+        site_files(parallel_path))
+    assert pathlib.Path('api/people/jodal/projects/index.html') in (
+        site_files(parallel_path))
+    assert site_files(serial_path) == site_files(parallel_path)
+
+
+def test_build_static_reuses_unchanged_pages(
+        cli_runner, tmpdir, person_enrich_mock, project_enrich_mock,
+        engine_run_mock):
+    dest_path = pathlib.Path(str(tmpdir.join('dest')))
+    page_path = dest_path / 'api' / 'projects' / 'mopidy-spotify' / (
+        'index.html')
+
+    result = cli_runner.invoke(cli.build_static, [str(dest_path)])
+    assert result.exit_code == 0
+    first_build = site_files(dest_path)
+    inode = page_path.stat().st_ino
+    gz_path = page_path.with_name('index.html.gz')
+    gz_inode = gz_path.stat().st_ino
+    project_enrich_mock.reset_mock()
+
+    result = cli_runner.invoke(cli.build_static, [str(dest_path)])
+
+    assert result.exit_code == 0
+    assert 'Reusing' in result.output
+    assert project_enrich_mock.call_count == 0
+    assert page_path.stat().st_ino == inode
+    assert gz_path.stat().st_ino == gz_inode
+    assert site_files(dest_path) == first_build
+
+
+def test_build_static_full_renders_all_pages(
+        cli_runner, tmpdir, person_enrich_mock, project_enrich_mock,
+        engine_run_mock):
+    dest_path = pathlib.Path(str(tmpdir.join('dest')))
+
+    cli_runner.invoke(cli.build_static, [str(dest_path)])
+    project_enrich_mock.reset_mock()
+
+    result = cli_runner.invoke(cli.build_static, ['--full', str(dest_path)])
+
+    assert result.exit_code == 0
+    assert 'Reusing' not in result.output
+    assert project_enrich_mock.call_count == 2
+
+
+def test_build_static_enriches_pages_with_engine(
+        cli_runner, tmpdir, person_enrich_mock, project_enrich_mock,
+        engine_run_mock):
+    result = cli_runner.invoke(cli.build_static, [
+        '--concurrency', '7', str(tmpdir.join('dest'))])
+
+    assert result.exit_code == 0
+    engine, objs = engine_run_mock.call_args[0]
+    assert engine.concurrency == 7
+    assert sorted(obj.data['id'] for obj in objs) == [
+        'adamcik', 'jodal', 'mopidy-dirble', 'mopidy-spotify']
+
+
+def test_build_static_stops_when_rate_limit_is_exhausted(
+        cli_runner, tmpdir, engine_run_mock):
+    engine_run_mock.side_effect = ratelimit.RateLimitExhausted(
+        'api.github.com', 1800)
+    dest_path = tmpdir.join('dest')
+    dest_path.mkdir()
+    dest_path.join('old.txt').write('old')
+
+    result = cli_runner.invoke(cli.build_static, [
+        '--max-wait', '60', str(dest_path)])
+
+    assert result.exit_code == 1
+    assert 'Rate limit of api.github.com exhausted' in result.output
+    assert dest_path.join('old.txt').check()
+    assert upstream.get_scheduler('api.github.com').max_wait == 60
+
+
+def test_warm_aborts_without_cache_dir(cli_runner, engine_run_mock):
+    result = cli_runner.invoke(cli.warm, [])
+
+    assert result.exit_code == 1
+    assert engine_run_mock.call_count == 0
+
+
+def test_warm_enriches_all_objects(cli_runner, tmpdir, engine_run_mock):
+    result = cli_runner.invoke(cli.warm, ['--cache-dir', str(tmpdir)])
+
+    assert result.exit_code == 0
+    engine, objs = engine_run_mock.call_args[0]
+    assert len(objs) == 4
+
+
+def test_warm_refreshes_pypi_cache_from_changelog(
+        cli_runner, tmpdir, engine_run_mock):
+    with mock.patch.object(pypi, 'refresh_cache') as refresh_mock:
+        refresh_mock.return_value = set()
+        result = cli_runner.invoke(cli.warm, ['--cache-dir', str(tmpdir)])
+
+    assert result.exit_code == 0
+    assert '0 of 2 PyPI packages changed' in result.output
+    names, _ = refresh_mock.call_args[0]
+    assert sorted(names) == ['Mopidy-Dirble', 'Mopidy-Spotify']
+
+
+def test_warm_without_pypi_changelog(cli_runner, tmpdir, engine_run_mock):
+    with mock.patch.object(pypi, 'refresh_cache') as refresh_mock:
+        result = cli_runner.invoke(cli.warm, [
+            '--cache-dir', str(tmpdir), '--no-pypi-changelog'])
+
+    assert result.exit_code == 0
+    assert refresh_mock.call_count == 0
@@ -0,0 +1,48 @@
+import contextvars
+import threading
+
+from mopidy_packages import deadline
+
+
+def test_remaining_without_deadline():
+    assert deadline.remaining() is None
+
+
+def test_limit_sets_deadline():
+    with deadline.limit(10):
+        assert 9 < deadline.remaining() <= 10
+
+    assert deadline.remaining() is None
+
+
+def test_nested_limit_can_only_shorten_deadline():
+    with deadline.limit(10):
+        with deadline.limit(20):
+            assert deadline.remaining() <= 10
+        with deadline.limit(5):
+            assert deadline.remaining() <= 5
+
+
+def test_share_splits_time_left():
+    with deadline.limit(10):
+        with deadline.share(4):
+            assert 2 < deadline.remaining() <= 2.5
+
+
+def test_share_without_deadline():
+    with deadline.share(4):
+        assert deadline.remaining() is None
+
+
+def test_deadline_follows_context_into_threads():
+    remaining = []
+
+    with deadline.limit(10):
+        context = contextvars.copy_context()
+    thread = threading.Thread(
+        target=context.run,
+        args=(lambda: remaining.append(deadline.remaining()),))
+    thread.start()
+    thread.join()
+
+    assert remaining[0] is not None
@@ -0,0 +1,258 @@
+import asyncio
+import threading
+import time
+from unittest import mock
+
+import requests
+
+import responses
+
+from mopidy_packages import enrichment, models, upstream
+
+
+def make_people(enrichers, count=3):
+    people = []
+    for _ in range(count):
+        person = models.Person(id='jodal')
+        person._enrichers = enrichers
+        people.append(person)
+    return people
+
+
+def test_engine_enriches_all_objects_concurrently():
+    barrier = threading.Barrier(6, timeout=5)
+
+    def enricher(data):
+        barrier.wait()
+        return data['id']
+
+    people = make_people({'a': enricher, 'b': enricher})
+
+    enrichment.Engine(concurrency=6).run(people)
+
+    for person in people:
+        assert person.data['a'] == 'jodal'
+        assert person.data['b'] == 'jodal'
+        assert 'updated_at' in person.data
+
+
+def test_engine_caps_enrichers_in_flight():
+    lock = threading.Lock()
+    in_flight = []
+    max_in_flight = []
+
+    def enricher(data):
+        with lock:
+            in_flight.append(1)
+            max_in_flight.append(len(in_flight))
+        threading.Event().wait(0.01)
+        with lock:
+            in_flight.pop()
+
+    people = make_people({'a': enricher, 'b': enricher}, count=5)
+
+    enrichment.Engine(concurrency=2).run(people)
+
+    assert len(max_in_flight) == 10
+    assert max(max_in_flight) <= 2
+
+
+def test_engine_awaits_coroutine_enrichers():
+    async def enricher(data):
+        await asyncio.sleep(0)
+        return data['id'].upper()
+
+    people = make_people({'a': enricher}, count=1)
+
+    enrichment.Engine().run(people)
+
+    assert people[0].data['a'] == 'JODAL'
+
+
+def test_engine_sets_host_limits():
+    enrichment.Engine(host_limits={'example.com': 3})
+
+    try:
+        semaphore = upstream._host_semaphores['example.com']
+        assert semaphore._value == 3
+    finally:
+        upstream.set_host_limit('example.com', None)
+
+
+def test_engine_reserves_a_connection_per_call_in_flight(monkeypatch):
+    monkeypatch.setattr(upstream, '_pool_maxsize', upstream.POOL_MAXSIZE)
+
+    enrichment.Engine(concurrency=upstream.POOL_MAXSIZE * 2)
+
+    assert upstream._pool_maxsize == upstream.POOL_MAXSIZE * 2
+
+
+@responses.activate
+def test_engine_returns_upstream_validators_per_object():
+    responses.add(
+        responses.GET, 'https://discuss.mopidy.com/users/jodal.json',
+        json={'user': {}}, status=200)
+    people = make_people({'discuss': models.add_discuss_profile}, count=1)
+
+    fetched = enrichment.Engine().run(people)
+
+    assert list(fetched[people[0]]) == [
+        'https://discuss.mopidy.com/users/jodal.json']
+
+
+def test_enrich_caches_results(person_enrich_mock):
+    enrichment.enrich(models.Person(id='jodal'))
+    person_enrich_mock.assert_called_once_with()
+    person = models.Person(id='jodal')
+    person._enrichers = {'twitter': models.add_twitter_profile}
+
+    enrichment.cache.put(person, [('twitter', 'cached')], {
+        'https://example.com/': None})
+    with upstream.recording() as fetched:
+        enrichment.enrich(person)
+
+    assert person.data['twitter'] == 'cached'
+    assert fetched == {'https://example.com/': None}
+    assert person_enrich_mock.call_count == 1
+
+
+def test_cache_fetches_missing_results():
+    person = models.Person(id='jodal')
+    person._enrichers = {
+        'github': models.add_github_profile,
+        'twitter': models.add_twitter_profile,
+    }
+    enrichment.cache.put(person, [('github', 'cached')], {})
+
+    enrichment.enrich(person)
+
+    assert person.data['github'] == 'cached'
+    assert person.data['twitter']['username'] == 'jodal'
+
+
+def test_cache_serves_stale_results_while_refreshing():
+    refreshed = threading.Event()
+
+    def enricher(data):
+        refreshed.set()
+        return 'fresh'
+
+    person = models.Person(id='jodal')
+    person._enrichers = {'github': enricher}
+    enrichment.cache.put(person, [('github', 'stale')], {}, fetched_at=0)
+
+    enrichment.enrich(person)
+
+    assert person.data['github'] == 'stale'
+    assert person.data['updated_at'] == '1970-01-01T00:00:00Z'
+    assert refreshed.wait(5)
+    enrichment.cache._executor.shutdown(wait=True)
+    enrichment.cache._executor = None
+
+    person = models.Person(id='jodal')
+    person._enrichers = {'github': enricher}
+    enrichment.enrich(person)
+
+    assert person.data['github'] == 'fresh'
+
+
+def test_cache_reports_age_of_oldest_result():
+    person = models.Person(id='jodal')
+    person._enrichers = {
+        'github': models.add_github_profile,
+        'twitter': models.add_twitter_profile,
+    }
+    now = time.time()
+    enrichment.cache.put(person, [('github', 'a')], {}, fetched_at=now - 60)
+    enrichment.cache.put(person, [('twitter', 'b')], {}, fetched_at=now)
+
+    enrichment.enrich(person)
+
+    assert person.data['updated_at'] == time.strftime(
+        '%Y-%m-%dT%H:%M:%SZ', time.gmtime(now - 60))
+
+
+def test_cache_drops_entry_when_data_file_changes(person_enrich_mock):
+    person = models.Person(id='jodal')
+    enrichment.cache.put(person, [('github', 'cached')], {})
+
+    models.Person.get_registry().clear()
+
+    assert enrichment.cache.get(models.Person(id='jodal')) is None
+
+
+def test_cache_evicts_least_recently_used_entries():
+    cache = enrichment.EnrichedCache(max_size=300)
+    jodal = models.Person(id='jodal')
+    adamcik = models.Person(id='adamcik')
+
+    cache.put(jodal, [('github', 'x' * 100)], {})
+    cache.put(adamcik, [('github', 'y' * 100)], {})
+    cache.get(jodal)
+    cache.put(adamcik, [('twitter', 'z' * 100)], {})
+
+    assert cache.get(jodal) is None
+    assert cache.get(adamcik) is not None
+    assert cache.size <= 300
+
+
+def test_cache_does_not_keep_degraded_results(session_mock):
+    session_mock.get.side_effect = requests.Timeout('Read timed out')
+    person = models.Person(id='jodal')
+    person._enrichers = {
+        'discuss': models.add_discuss_profile,
+        'twitter': models.add_twitter_profile,
+    }
+
+    enrichment.enrich(person)
+
+    assert person.data['discuss']['sources'] == []
+    assert person.data['twitter']['username'] == 'jodal'
+    assert enrichment.cache.get(person) is None
+
+
+def test_enrich_many_batches_results_missing_from_cache():
+    batches = []
+
+    def batch_enricher(datas):
+        batches.append([data['id'] for data in datas])
+        return {data['id']: {'sources': []} for data in datas}
+
+    def enricher(data):
+        raise AssertionError('Enriched without batch')
+
+    people = [models.Person(id='jodal'), models.Person(id='adamcik')]
+    for person in people:
+        person._enrichers = {'github': enricher, 'twitter': enricher}
+        enrichment.cache.put(person, [('twitter', 'cached')], {})
+
+    models.load_enrichers()
+    with mock.patch.object(
+            models.Person, '_batch_enrichers', {'github': batch_enricher}):
+        enrichment.enrich_many(people)
+
+    assert batches == [['jodal', 'adamcik']]
+    for person in people:
+        assert person.data['github'] == {'sources': []}
+        assert person.data['twitter'] == 'cached'
+        assert set(enrichment.cache.get(person).values) == {
+            'github', 'twitter'}
+
+
+def test_enrich_many_fetches_only_missing_sources():
+    calls = []
+
+    def enricher(data):
+        calls.append(data['id'])
+        return 'fetched'
+
+    people = [models.Person(id='jodal'), models.Person(id='adamcik')]
+    for person in people:
+        person._enrichers = {'github': enricher, 'twitter': enricher}
+    enrichment.cache.put(people[0], [('twitter', 'cached')], {})
+
+    enrichment.enrich_many(people, sources={'github', 'twitter'})
+
+    assert sorted(calls) == ['adamcik', 'adamcik', 'jodal']
+    assert people[0].data['twitter'] == 'cached'
+    assert people[1].data['twitter'] == 'fetched'
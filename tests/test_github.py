@@ -0,0 +1,186 @@
+import json
+import re
+
+import pytest
+
+import responses
+
+from mopidy_packages import cache, enrichment, github, models, upstream
+
+
+REPOS = {
+    'mopidy/mopidy-spotify': {
+        'createdAt': '123',
+        'pushedAt': '456',
+        'updatedAt': '789',
+        'description': 'Describing text',
+        'homepageUrl': 'www.mopidy.com',
+        'primaryLanguage': {'name': 'Python'},
+        'watchers': {'totalCount': 21},
+        'stargazerCount': 72,
+        'forkCount': 22,
+        'issues': {'totalCount': 10},
+        'pullRequests': {'totalCount': 5},
+        'refs': {'nodes': [
+            {'name': 'v1.2.0'},
+            {'name': 'v1.1.3'},
+            {'name': 'debian/v1.2.0-1'},
+        ]},
+    },
+}
+
+ALIAS_RE = re.compile(
+    r'(\w+): repository\(owner: "([^"]+)", name: "([^"]+)"\)')
+
+
+def graphql_server(request):
+    """Stand-in for the GitHub GraphQL API, serving the repos in REPOS."""
+    if not request.headers.get('Authorization', '').startswith('bearer '):
+        return (401, {}, json.dumps({'message': 'Requires authentication'}))
+
+    query = json.loads(request.body.decode('utf-8'))['query']
+    data, errors = {}, []
+    for alias, owner, name in ALIAS_RE.findall(query):
+        data[alias] = REPOS.get('%s/%s' % (owner, name))
+        if data[alias] is None:
+            errors.append({'type': 'NOT_FOUND', 'path': [alias]})
+    return (200, {}, json.dumps({'data': data, 'errors': errors}))
+
+
+@pytest.yield_fixture
+def server():
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as rsps:
+        rsps.add_callback(
+            responses.POST, github.GRAPHQL_URL, callback=graphql_server,
+            content_type='application/json')
+        yield rsps
+
+
+def test_fetch_repos_uses_one_query_per_chunk(server):
+    ids = ['mopidy/mopidy-spotify', 'mopidy/mopidy-foo', 'mopidy/mopidy-bar']
+
+    repos = github.fetch_repos(ids, token='secret', chunk_size=2)
+
+    assert len(server.calls) == 2
+    assert repos['mopidy/mopidy-spotify']['subscribers_count'] == 21
+    assert repos['mopidy/mopidy-spotify']['open_issues_count'] == 15
+    assert repos['mopidy/mopidy-foo'] is None
+    assert repos['mopidy/mopidy-bar'] is None
+
+
+def test_fetch_repos_without_token_does_nothing(server, monkeypatch):
+    monkeypatch.delenv(github.TOKEN_ENV, raising=False)
+
+    assert github.fetch_repos(['mopidy/mopidy-spotify']) == {}
+    assert len(server.calls) == 0
+
+
+def test_fetch_repos_leaves_out_failed_chunks(server):
+    server.replace(responses.POST, github.GRAPHQL_URL, status=502)
+
+    assert github.fetch_repos(['mopidy/mopidy-spotify'], token='x') == {}
+
+
+def test_add_github_repos_matches_rest_fields(server, monkeypatch):
+    monkeypatch.setenv(github.TOKEN_ENV, 'secret')
+    datas = [
+        {'id': 'a', 'distribution': {'github': 'mopidy/mopidy-spotify'}},
+        {'id': 'b', 'distribution': {'github': 'mopidy/mopidy-foo'}},
+        {'id': 'c', 'distribution': {}},
+    ]
+
+    results = models.add_github_repos(datas)
+
+    assert len(server.calls) == 1
+    assert results['a'] == {
+        'id': 'mopidy/mopidy-spotify',
+        'owner': 'mopidy',
+        'repo': 'mopidy-spotify',
+        'url': 'https://github.com/mopidy/mopidy-spotify',
+        'sources': [github.repo_url('mopidy/mopidy-spotify')],
+        'created_at': '123',
+        'pushed_at': '456',
+        'updated_at': '789',
+        'description': 'Describing text',
+        'homepage': 'www.mopidy.com',
+        'language': 'Python',
+        'watchers_count': 21,
+        'stargazers_count': 72,
+        'forks_count': 22,
+        'open_issues_count': 15,
+        'tags': ['v1.2.0', 'v1.1.3'],
+        'latest_tag': 'v1.2.0',
+    }
+    assert results['b']['sources'] == []
+    assert results['c'] is None
+
+
+def test_engine_uses_batch_instead_of_rest_calls(server, monkeypatch):
+    monkeypatch.setenv(github.TOKEN_ENV, 'secret')
+    projects = [models.Project(id='mopidy-spotify') for _ in range(3)]
+    for project in projects:
+        project._enrichers = {
+            'distribution.github': models.add_github_repo}
+
+    fetched = enrichment.Engine().run(projects)
+
+    assert len(server.calls) == 1
+    for project in projects:
+        assert project.data['distribution']['github']['forks_count'] == 22
+        [url] = fetched[project]
+        assert url == github.repo_url('mopidy/mopidy-spotify')
+        assert fetched[project][url]['digest'] is not None
+
+
+def test_fetch_repos_records_each_repo(server):
+    ids = ['mopidy/mopidy-spotify', 'mopidy/mopidy-foo']
+
+    with upstream.recording() as fetched:
+        github.fetch_repos(ids, token='secret')
+
+    assert sorted(fetched) == sorted(github.repo_url(id) for id in ids)
+    assert (
+        fetched[github.repo_url(ids[0])] != fetched[github.repo_url(ids[1])])
+
+
+def test_changed_repos_are_checked_in_one_query(server, monkeypatch):
+    monkeypatch.setenv(github.TOKEN_ENV, 'secret')
+    ids = ['mopidy/mopidy-foo', 'mopidy/mopidy-spotify']
+    with upstream.recording() as fetched:
+        github.fetch_repos(ids)
+    monkeypatch.setitem(REPOS['mopidy/mopidy-spotify'], 'forkCount', 23)
+
+    changed = upstream.find_changed(sorted(fetched.items()))
+
+    assert len(server.calls) == 2
+    assert changed == [False, True]
+
+
+def test_repos_are_not_checked_without_token(server, monkeypatch):
+    monkeypatch.delenv(github.TOKEN_ENV, raising=False)
+    url = github.repo_url('mopidy/mopidy-spotify')
+
+    assert upstream.has_changed(url, {'digest': 'foo'})
+    assert len(server.calls) == 0
+
+
+@pytest.yield_fixture
+def response_cache(tmpdir):
+    response_cache = cache.ResponseCache(str(tmpdir))
+    previous = upstream.set_cache(response_cache)
+    yield response_cache
+    upstream.set_cache(previous)
+
+
+def test_rest_enricher_uses_repo_stored_by_batch(
+        server, response_cache, monkeypatch):
+    monkeypatch.setenv(github.TOKEN_ENV, 'secret')
+    data = {'id': 'a', 'distribution': {'github': 'mopidy/mopidy-spotify'}}
+    batched = models.add_github_repos([data])['a']
+
+    with upstream.recording() as fetched:
+        result = models.add_github_repo(data)
+
+    assert len(server.calls) == 1
+    assert result == batched
+    assert list(fetched) == [github.repo_url('mopidy/mopidy-spotify')]
@@ -1,8 +1,13 @@
+import os
 import pathlib
+import threading
+from unittest import mock
 
 import responses
 
-from mopidy_packages import models
+from mopidy_packages import deadline, models
+
+from tests.conftest import write_person
 
 
 TEST_DIR = pathlib.Path(__file__).parent
@@ -56,6 +61,51 @@ def test_person_enrich():
     assert 'updated_at' in person.data
 
 
+def test_enrich_runs_enrichers_concurrently():
+    person = models.Person(id='jodal')
+    barrier = threading.Barrier(2, timeout=5)
+
+    def enricher(data):
+        barrier.wait()
+        return data['id']
+
+    person._enrichers = {'a': enricher, 'b': enricher}
+
+    person.enrich()
+
+    assert person.data['a'] == 'jodal'
+    assert person.data['b'] == 'jodal'
+
+
+def test_enrich_applies_results_in_registration_order():
+    project = models.Project(id='mopidy-spotify')
+    project._enrichers = {
+        'distribution.github': lambda data: 'github',
+        'distribution.pypi': lambda data: 'pypi',
+        'distribution': lambda data: {'replaced': True},
+    }
+
+    assert [key for key, _ in project.enrichments()] == [
+        'distribution.github', 'distribution.pypi', 'distribution']
+
+    project.enrich()
+
+    assert project.data['distribution'] == {'replaced': True}
+
+
+def test_enrich_with_single_worker_runs_in_calling_thread():
+    person = models.Person(id='jodal')
+    person._enrichers = {
+        'a': lambda data: threading.current_thread().name,
+        'b': lambda data: threading.current_thread().name,
+    }
+
+    person.enrich(max_workers=1)
+
+    assert person.data['a'] == threading.current_thread().name
+    assert person.data['b'] == threading.current_thread().name
+
+
 def test_project_with_id():
     project = models.Project(id='foobar')
 
@@ -86,3 +136,162 @@ def test_project_with_invalid_data_file():
         models.Project(path=path)
     except models.ModelException as exc:
         assert 'Invalid JSON structure' in str(exc)
+
+
+def test_registry_loads_each_file_once(person_class):
+    write_person(person_class, 'alice', 'Alice')
+
+    with mock.patch.object(
+            person_class, 'load_data',
+            wraps=person_class.load_data) as load_data_mock:
+        list(person_class.all())
+        person_class(id='alice')
+
+    assert load_data_mock.call_count == 1
+
+
+def test_registry_reloads_changed_files(person_class):
+    path = write_person(person_class, 'alice', 'Alice')
+    assert person_class(id='alice').data['name'] == 'Alice'
+
+    mtime = path.stat().st_mtime
+    write_person(person_class, 'alice', 'Alice Cooper')
+    os.utime(str(path), (mtime + 10, mtime + 10))
+
+    assert person_class(id='alice').data['name'] == 'Alice Cooper'
+
+
+def test_registry_notices_added_and_removed_files(person_class):
+    path = write_person(person_class, 'alice', 'Alice')
+    assert [p.data['id'] for p in person_class.all()] == ['alice']
+
+    write_person(person_class, 'bob', 'Bob')
+    path.unlink()
+
+    assert [p.data['id'] for p in person_class.all()] == ['bob']
+    assert person_class(id='alice').data is None
+
+
+def test_registry_tracks_time_of_last_change(person_class):
+    registry = person_class.get_registry()
+    alice = write_person(person_class, 'alice', 'Alice')
+    write_person(person_class, 'bob', 'Bob')
+    list(person_class.all())
+
+    registry.changed_at = 0
+    list(person_class.all())
+
+    assert registry.changed_at == 0
+
+    alice.unlink()
+    list(person_class.all())
+
+    assert registry.changed_at > 0
+
+
+def test_frozen_registry_ignores_changes(person_class):
+    write_person(person_class, 'alice', 'Alice')
+    person_class.get_registry().freeze()
+
+    path = write_person(person_class, 'bob', 'Bob')
+
+    assert [p.data['id'] for p in person_class.all()] == ['alice']
+    assert person_class(path=path).data is None
+
+
+def test_model_data_is_a_copy(person_class):
+    write_person(person_class, 'alice', 'Alice')
+
+    person_class(id='alice').data['name'] = 'Mallory'
+
+    assert person_class(id='alice').data['name'] == 'Alice'
+
+
+def test_validator_is_built_once():
+    assert models.Person.get_validator() is models.Person.get_validator()
+    assert models.Person.get_validator() is not (
+        models.Project.get_validator())
+
+
+def test_unchanged_file_content_is_not_validated_again(person_class):
+    path = write_person(person_class, 'alice', 'Alice')
+    person_class(id='alice')
+
+    with mock.patch.object(
+            person_class, 'get_validator',
+            wraps=person_class.get_validator) as get_validator_mock:
+        person_class.load_data(path)
+        write_person(person_class, 'carol', 'Carol Unvalidated')
+        person_class(id='carol')
+
+    assert get_validator_mock.call_count == 1
+
+
+def test_get_enrichers_for_some_sources():
+    project = models.Project(id='mopidy-spotify')
+
+    keys = [key for key, _ in project.get_enrichers({'github', 'aur'})]
+
+    assert keys == ['github', 'aur']
+
+
+def test_enrich_from_some_sources_keeps_raw_values():
+    project = models.Project(id='mopidy-spotify')
+    project._enrichers = {
+        'distribution.github': lambda data: 'github',
+        'distribution.pypi': lambda data: 'pypi',
+    }
+
+    project.enrich(sources={'pypi'})
+
+    assert project.data['distribution']['github'] == 'mopidy/mopidy-spotify'
+    assert project.data['distribution']['pypi'] == 'pypi'
+
+
+def test_enrichers_are_loaded_from_entry_points():
+    entry_point = mock.Mock()
+    with mock.patch.object(models, '_enrichers_loaded', False), \
+            mock.patch.object(
+                models, 'enricher_entry_points',
+                return_value=[entry_point]):
+        models.Person.get_sources()
+        models.Person.get_sources()
+
+    entry_point.load.assert_called_once_with()
+
+
+def test_failing_enricher_entry_point_is_skipped():
+    entry_point = mock.Mock()
+    entry_point.load.side_effect = ImportError('foo')
+    with mock.patch.object(models, '_enrichers_loaded', False), \
+            mock.patch.object(
+                models, 'enricher_entry_points',
+                return_value=[entry_point]):
+        assert 'github' in models.Person.get_sources()
+
+
+def test_get_enrichers_by_full_key():
+    project = models.Project(id='mopidy-spotify')
+    project._enrichers = {
+        'distribution.aur': lambda data: 'aur',
+        'distribution.pypi': lambda data: 'pypi',
+    }
+
+    keys = [key for key, _ in project.get_enrichers({'distribution.aur'})]
+
+    assert keys == ['distribution.aur']
+
+
+def test_enrich_with_single_worker_splits_deadline():
+    budgets = []
+
+    def enricher(data):
+        budgets.append(deadline.remaining())
+
+    person = models.Person(id='alice')
+    person._enrichers = {'a': enricher, 'b': enricher}
+    with deadline.limit(10):
+        person.enrichments(max_workers=1)
+
+    assert 4 < budgets[0] <= 5
+    assert 9 < budgets[1] <= 10
@@ -2,7 +2,7 @@ import json
 
 import responses
 
-from mopidy_packages import models
+from mopidy_packages import enrichment, models, upstream
 
 
 @responses.activate
@@ -232,6 +232,101 @@ def test_add_aur_info_without_input():
     assert models.add_aur_info({'distribution': {}}) is None
 
 
+@responses.activate
+def test_add_aur_infos_fetches_all_packages_in_one_request():
+    api_url = (
+        'https://aur.archlinux.org/rpc/?v=5&type=info'
+        '&arg%5B%5D=mopidy-gmusic&arg%5B%5D=mopidy-spotify')
+    responses.add(
+        responses.GET, api_url, match_querystring=True,
+        body=json.dumps({
+            'results': [{
+                'Name': 'mopidy-spotify',
+                'Description': 'Some text',
+                'URL': 'http://www.mopidy.com',
+                'Version': '1.2.0-1',
+                'OutOfDate': None,
+                'NumVotes': 17,
+                'Maintainer': 'AlexandrePTJ',
+                'FirstSubmitted': 1382966658,
+                'LastModified': 1405946340,
+            }],
+        }),
+        status=200, content_type='application/json')
+
+    results = models.add_aur_infos([
+        {'id': 'a', 'distribution': {'aur': 'mopidy-spotify'}},
+        {'id': 'b', 'distribution': {'aur': 'mopidy-gmusic'}},
+        {'id': 'c', 'distribution': {}},
+    ])
+
+    assert len(responses.calls) == 1
+    assert results['a']['version'] == '1.2.0-1'
+    assert results['a']['outdated'] is False
+    assert results['a']['created_at'] == '2013-10-28T13:24:18Z'
+    assert results['a']['sources'] == [
+        'https://aur.archlinux.org/rpc/?v=5&type=info#mopidy-spotify']
+    assert 'b' not in results
+    assert results['c'] is None
+
+
+@responses.activate
+def test_engine_enriches_aur_in_batch():
+    responses.add(
+        responses.GET, 'https://aur.archlinux.org/rpc/',
+        body=json.dumps({'results': [{
+            'Name': 'mopidy-spotify', 'Description': 'Some text',
+            'URL': None, 'Version': '1.2.0-1', 'OutOfDate': None,
+            'NumVotes': 17, 'Maintainer': None,
+            'FirstSubmitted': 1382966658, 'LastModified': 1405946340,
+        }]}),
+        status=200, content_type='application/json',
+        headers={'ETag': '"abc"'})
+    projects = [models.Project(id='mopidy-spotify') for _ in range(3)]
+    for project in projects:
+        project.data['distribution']['aur'] = 'mopidy-spotify'
+        project._enrichers = {'distribution.aur': models.add_aur_info}
+
+    fetched = enrichment.Engine().run(projects)
+
+    assert len(responses.calls) == 1
+    for project in projects:
+        assert project.data['distribution']['aur']['vote_count'] == 17
+        assert list(fetched[project]) == [
+            models.aur_package_url('mopidy-spotify')]
+
+
+def aur_info(name, votes):
+    return {
+        'Name': name, 'Description': 'Some text', 'URL': None,
+        'Version': '1.2.0-1', 'OutOfDate': None, 'NumVotes': votes,
+        'Maintainer': None, 'FirstSubmitted': 1382966658,
+        'LastModified': 1405946340,
+    }
+
+
+@responses.activate
+def test_changed_aur_packages_are_checked_in_one_request():
+    ids = ['mopidy-gmusic', 'mopidy-spotify']
+    responses.add(
+        responses.GET, 'https://aur.archlinux.org/rpc/',
+        json={'results': [aur_info(id, 17) for id in ids]}, status=200)
+    with upstream.recording() as fetched:
+        models.fetch_aur_packages(ids)
+    responses.replace(
+        responses.GET, 'https://aur.archlinux.org/rpc/',
+        json={'results': [
+            aur_info('mopidy-gmusic', 17), aur_info('mopidy-spotify', 18)]},
+        status=200)
+
+    changed = upstream.find_changed([
+        (models.aur_package_url(id), fetched[models.aur_package_url(id)])
+        for id in ids])
+
+    assert len(responses.calls) == 2
+    assert changed == [False, True]
+
+
 @responses.activate
 def test_add_apt_info_with_failing_service():
     responses.add(
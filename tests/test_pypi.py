@@ -0,0 +1,241 @@
+import json
+import xmlrpc.client
+from unittest import mock
+
+import pytest
+
+import responses
+
+from mopidy_packages import cache, pypi, upstream
+
+
+DOCUMENT = {
+    'info': {
+        'author': 'Stein Magnus Jodal',
+        'author_email': 'stein.magnus@jodal.no',
+        'description': 'A very long description',
+        'downloads': {'last_day': 1, 'last_month': 2, 'last_week': 3},
+        'requires_dist': ['Mopidy>=1.0', 'pyspotify>=2.0'],
+        'version': '1.2.0',
+    },
+    'releases': {
+        '1.1.3': [{'filename': 'a.tar.gz', 'packagetype': 'sdist'}],
+        '1.2.0': [
+            {'filename': 'b.tar.gz', 'packagetype': 'sdist'},
+            {'filename': 'b.whl', 'packagetype': 'bdist_wheel'},
+        ],
+    },
+    'urls': [
+        {
+            'filename': 'b.tar.gz',
+            'packagetype': 'sdist',
+            'size': 1234.5,
+            'upload_time': '2014-07-21T12:39:00',
+        },
+        {
+            'filename': 'b.whl',
+            'packagetype': 'bdist_wheel',
+            'upload_time': '2014-07-21T12:40:00',
+        },
+    ],
+}
+
+STREAMING = [
+    pytest.param(True, marks=pytest.mark.skipif(
+        pypi.ijson is None, reason='ijson is not installed')),
+    False,
+]
+
+EXPECTED = {
+    'info': {
+        'author': 'Stein Magnus Jodal',
+        'author_email': 'stein.magnus@jodal.no',
+        'downloads': {'last_day': 1, 'last_month': 2, 'last_week': 3},
+        'requires_dist': ['Mopidy>=1.0', 'pyspotify>=2.0'],
+        'version': '1.2.0',
+    },
+    'releases': ['1.1.3', '1.2.0'],
+    'urls': [
+        {'packagetype': 'sdist', 'upload_time': '2014-07-21T12:39:00'},
+        {'packagetype': 'bdist_wheel', 'upload_time': '2014-07-21T12:40:00'},
+    ],
+}
+
+
+@pytest.mark.parametrize('streaming', STREAMING)
+def test_parse_extracts_used_fields(streaming):
+    content = json.dumps(DOCUMENT).encode('utf-8')
+
+    assert pypi.parse(content, streaming=streaming) == EXPECTED
+
+
+@pytest.mark.parametrize('streaming', STREAMING)
+def test_parse_release_document(streaming):
+    document = dict(DOCUMENT, releases={})
+    document['info'] = dict(DOCUMENT['info'], requires_dist=None)
+    content = json.dumps(document).encode('utf-8')
+
+    result = pypi.parse(content, streaming=streaming)
+
+    assert result['releases'] == []
+    assert result['info']['requires_dist'] is None
+    assert result['urls'] == EXPECTED['urls']
+
+
+CHANGELOG = [
+    ('Mopidy-Spotify', '1.2.0', 1405946340, 'new release', 1200),
+    ('mopidy_spotify', '1.2.0', 1405946341, 'add py2.py3 file', 1201),
+    ('Mopidy-GMusic', '0.3.0', 1405946342, 'new release', 900),
+    ('requests', '2.3.0', 1405946343, 'new release', 1300),
+]
+
+
+class ChangelogServer:
+    """Stand-in for the PyPI XML-RPC API, replaying a changelog.
+
+    Like PyPI, it returns at most ``page_size`` changes per call.
+    """
+
+    def __init__(self, changelog, page_size=50000):
+        self.changelog = sorted(changelog, key=lambda change: change[-1])
+        self.page_size = page_size
+
+    def __call__(self, request):
+        params, method = xmlrpc.client.loads(request.body)
+        if method == 'changelog_last_serial':
+            result = self.changelog[-1][-1]
+        else:
+            assert method == 'changelog_since_serial'
+            (since,) = params
+            result = [
+                change for change in self.changelog
+                if change[-1] > since][:self.page_size]
+        return (200, {}, xmlrpc.client.dumps((result,), methodresponse=True))
+
+
+@pytest.yield_fixture
+def response_cache(tmpdir):
+    response_cache = cache.ResponseCache(str(tmpdir), ttls={
+        'pypi.python.org': 0})
+    previous = upstream.set_cache(response_cache)
+    yield response_cache
+    upstream.set_cache(previous)
+
+
+def cache_package(response_cache, name):
+    with responses.RequestsMock() as rsps:
+        rsps.add(responses.GET, pypi.package_url(name), json=DOCUMENT)
+        upstream.get(pypi.package_url(name))
+
+
+def refresh(response_cache, names, server):
+    with responses.RequestsMock() as rsps:
+        rsps.add_callback(responses.POST, pypi.XMLRPC_URL, callback=server)
+        return pypi.refresh_cache(names, response_cache), len(rsps.calls)
+
+
+def test_first_refresh_stores_serial(response_cache):
+    cache_package(response_cache, 'Mopidy-Spotify')
+
+    changed, _ = refresh(
+        response_cache, ['Mopidy-Spotify'], ChangelogServer(CHANGELOG))
+
+    assert changed is None
+    assert response_cache.get_state(pypi.STATE_NAME)['serial'] == 1300
+    assert response_cache.get(pypi.package_url('Mopidy-Spotify'))
+
+
+def test_refresh_cache_drops_changed_packages(response_cache):
+    refresh(response_cache, [], ChangelogServer(CHANGELOG[2:3]))
+    cache_package(response_cache, 'Mopidy-Spotify')
+    cache_package(response_cache, 'Mopidy-GMusic')
+    names = ['Mopidy-Spotify', 'Mopidy-GMusic', 'Mopidy-New']
+
+    changed, calls = refresh(
+        response_cache, names, ChangelogServer(CHANGELOG))
+
+    assert changed == {'Mopidy-Spotify'}
+    assert calls == 2
+    assert response_cache.get(pypi.package_url('Mopidy-Spotify')) is None
+    gmusic = response_cache.get(pypi.package_url('Mopidy-GMusic'))
+    assert response_cache.is_fresh(gmusic) is False  # The TTL is 0
+    assert response_cache.get_state(pypi.STATE_NAME)['serial'] == 1300
+
+
+def test_refresh_cache_marks_unchanged_packages_fresh(response_cache):
+    response_cache.ttls['pypi.python.org'] = 60
+    with mock.patch.object(pypi.time, 'time', return_value=0):
+        refresh(response_cache, [], ChangelogServer(CHANGELOG[2:3]))
+    with mock.patch.object(cache.time, 'time', return_value=10):
+        cache_package(response_cache, 'Mopidy-Spotify')
+        cache_package(response_cache, 'Mopidy-GMusic')
+    entry = response_cache.get(pypi.package_url('Mopidy-GMusic'))
+    assert not response_cache.is_fresh(entry)
+
+    changed, _ = refresh(
+        response_cache, ['Mopidy-GMusic'], ChangelogServer(CHANGELOG[2:]))
+
+    assert changed == set()
+    entry = response_cache.get(pypi.package_url('Mopidy-GMusic'))
+    assert response_cache.is_fresh(entry)
+
+
+def test_refresh_cache_does_not_mark_older_packages_fresh(response_cache):
+    response_cache.ttls['pypi.python.org'] = 60
+    with mock.patch.object(cache.time, 'time', return_value=0):
+        cache_package(response_cache, 'Mopidy-GMusic')
+    with mock.patch.object(pypi.time, 'time', return_value=10):
+        refresh(response_cache, [], ChangelogServer(CHANGELOG[2:3]))
+
+    changed, _ = refresh(
+        response_cache, ['Mopidy-GMusic'], ChangelogServer(CHANGELOG[2:]))
+
+    assert changed == set()
+    entry = response_cache.get(pypi.package_url('Mopidy-GMusic'))
+    assert not response_cache.is_fresh(entry)
+
+
+def test_refresh_cache_pages_through_truncated_changelog(response_cache):
+    refresh(response_cache, [], ChangelogServer(CHANGELOG[2:3]))
+    cache_package(response_cache, 'Mopidy-Spotify')
+    changelog = CHANGELOG + [
+        ('Mopidy-Spotify', '1.3.0', 1405946344, 'new release', 1400)]
+    changelog[0] = ('Mopidy-Other', '1.0', 1405946340, 'new release', 1200)
+    changelog[1] = ('Mopidy-Other', '1.0', 1405946341, 'new release', 1201)
+
+    changed, calls = refresh(
+        response_cache, ['Mopidy-Spotify'],
+        ChangelogServer(changelog, page_size=1))
+
+    assert changed == {'Mopidy-Spotify'}
+    assert calls == 5
+
+
+def test_refresh_cache_gives_up_on_too_long_changelog(response_cache):
+    refresh(response_cache, [], ChangelogServer(CHANGELOG[2:3]))
+    cache_package(response_cache, 'Mopidy-GMusic')
+
+    with mock.patch.object(pypi, 'MAX_CHANGELOG_PAGES', 1):
+        changed, _ = refresh(
+            response_cache, ['Mopidy-GMusic'],
+            ChangelogServer(CHANGELOG, page_size=1))
+
+    assert changed is None
+    entry = response_cache.get(pypi.package_url('Mopidy-GMusic'))
+    assert response_cache.is_fresh(entry) is False
+    assert response_cache.get_state(pypi.STATE_NAME)['serial'] == 1300
+
+
+def test_refresh_cache_without_changelog(response_cache):
+    cache_package(response_cache, 'Mopidy-Spotify')
+
+    with responses.RequestsMock() as rsps:
+        rsps.add(responses.POST, pypi.XMLRPC_URL, status=404)
+        assert pypi.refresh_cache(['Mopidy-Spotify'], response_cache) is None
+
+    assert response_cache.get(pypi.package_url('Mopidy-Spotify'))
+    assert response_cache.get_state(pypi.STATE_NAME) is None
+
+
+def test_normalize():
+    assert pypi.normalize('Mopidy_Spotify.Web') == 'mopidy-spotify-web'
@@ -0,0 +1,115 @@
+from unittest import mock
+
+import pytest
+
+from mopidy_packages import ratelimit
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def scheduler(clock):
+    return ratelimit.HostScheduler(
+        'api.github.com', max_wait=60, clock=clock.time, sleep=clock.sleep)
+
+
+def make_response(status_code=200, headers=None):
+    response = mock.Mock()
+    response.status_code = status_code
+    response.headers = headers or {}
+    return response
+
+
+def test_acquire_does_not_wait_with_plenty_of_budget(scheduler, clock):
+    scheduler.update(make_response(headers={
+        'X-RateLimit-Remaining': '4000', 'X-RateLimit-Reset': '4600'}))
+
+    for _ in range(10):
+        scheduler.acquire()
+
+    assert clock.now == 1000
+
+
+def test_acquire_spreads_low_budget_until_reset(scheduler, clock):
+    scheduler.update(make_response(headers={
+        'X-RateLimit-Remaining': '10', 'X-RateLimit-Reset': '1100'}))
+
+    times = []
+    for _ in range(3):
+        scheduler.acquire()
+        times.append(clock.now)
+
+    assert times == [1000, 1010, 1020]
+
+
+def test_acquire_waits_for_retry_after(scheduler, clock):
+    scheduler.update(make_response(429, {'Retry-After': '30'}))
+
+    scheduler.acquire()
+
+    assert clock.now == 1030
+
+
+def test_acquire_raises_if_reset_is_beyond_max_wait(scheduler, clock):
+    scheduler.update(make_response(403, {
+        'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': '4600'}))
+
+    with pytest.raises(ratelimit.RateLimitExhausted) as exc_info:
+        scheduler.acquire()
+
+    assert exc_info.value.host == 'api.github.com'
+    assert exc_info.value.retry_after == 3600
+    assert clock.now == 1000
+
+
+@mock.patch.object(ratelimit, 'BACKOFF_BASE', 1)
+def test_backoff_grows_exponentially_with_jitter(scheduler, clock):
+    with mock.patch.object(ratelimit.random, 'uniform') as uniform_mock:
+        uniform_mock.side_effect = lambda low, high: high
+        scheduler.backoff(0)
+        scheduler.backoff(2)
+        scheduler.backoff(10)
+
+    assert uniform_mock.call_args_list == [
+        mock.call(0, 1), mock.call(0, 4), mock.call(0, 30)]
+    assert clock.now == 1035
+
+
+def test_parse_retry_after_with_http_date():
+    assert ratelimit.parse_retry_after(
+        'Thu, 01 Jan 1970 00:20:00 GMT', 1000) == 200
+
+
+def test_should_retry():
+    assert ratelimit.should_retry(make_response(503))
+    assert ratelimit.should_retry(make_response(429))
+    assert ratelimit.should_retry(
+        make_response(403, {'X-RateLimit-Remaining': '0'}))
+    assert not ratelimit.should_retry(make_response(403))
+    assert not ratelimit.should_retry(make_response(404))
+
+
+def test_acquire_gives_up_instead_of_waiting_beyond_timeout(
+        scheduler, clock):
+    scheduler.update(make_response(429, {'Retry-After': '30'}))
+
+    assert scheduler.acquire(timeout=10) is False
+    assert clock.now == 1000
+
+    assert scheduler.acquire(timeout=30) is True
+    assert clock.now == 1030
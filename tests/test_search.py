@@ -0,0 +1,72 @@
+import os
+
+from mopidy_packages import models, search
+
+from tests.conftest import write_person
+
+
+def test_tokenize():
+    assert search.tokenize('Mopidy-Spotify, by jodal_') == {
+        'mopidy', 'spotify', 'by', 'jodal'}
+
+
+def test_project_terms():
+    data = models.Project(id='mopidy-spotify').data
+
+    terms = set(search.project_terms(data))
+
+    assert ('status', 'active') in terms
+    assert ('license', 'Apache-2.0') in terms
+    assert ('is_extension', 'true') in terms
+    assert ('maintainer', 'jodal') in terms
+    assert ('has', 'aur') in terms
+    assert ('q', 'spotify') in terms
+
+
+def test_search_matches_all_filters(person_class):
+    write_person(person_class, 'alice', 'Alice Cooper', {'github': 'alice'})
+    write_person(person_class, 'bob', 'Bob Cooper')
+    write_person(person_class, 'carol', 'Carol', {'github': 'carol'})
+    index = search.Index(person_class)
+
+    assert index.search([('q', 'cooper')]) == ['alice', 'bob']
+    assert index.search([('has', 'github')]) == ['alice', 'carol']
+    assert index.search([('q', 'Cooper'), ('has', 'github')]) == ['alice']
+    assert index.search([('q', 'alice cooper')]) == ['alice']
+    assert index.search([('has', 'twitter')]) == []
+    assert index.search([('q', '')]) == []
+
+
+def test_index_follows_changed_and_removed_files(person_class):
+    alice = write_person(person_class, 'alice', 'Alice')
+    bob = write_person(person_class, 'bob', 'Bob')
+    index = search.Index(person_class, refresh_interval=0)
+    assert index.search([('q', 'bob')]) == ['bob']
+
+    mtime = alice.stat().st_mtime
+    write_person(person_class, 'alice', 'Alice Bob')
+    os.utime(str(alice), (mtime + 10, mtime + 10))
+    bob.unlink()
+
+    assert index.search([('q', 'bob')]) == ['alice']
+    assert index.search([('q', 'alice')]) == ['alice']
+
+
+def test_frozen_index_is_not_refreshed(person_class):
+    write_person(person_class, 'alice', 'Alice')
+    person_class.get_registry().freeze()
+    index = search.Index(person_class, refresh_interval=0)
+
+    write_person(person_class, 'bob', 'Bob')
+
+    assert index.search([('q', 'bob')]) == []
+
+
+def test_index_is_rebuilt_after_registry_is_cleared(person_class):
+    write_person(person_class, 'alice', 'Alice')
+    index = search.Index(person_class)
+
+    person_class.get_registry().clear()
+    write_person(person_class, 'bob', 'Bob')
+
+    assert index.search([('q', 'bob')]) == ['bob']
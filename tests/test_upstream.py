@@ -0,0 +1,412 @@
+import threading
+import time
+
+import pytest
+
+import requests
+
+import responses
+
+from mopidy_packages import (
+    cache, circuit, deadline, models, ratelimit, upstream)
+
+
+@pytest.yield_fixture
+def response_cache(tmpdir):
+    response_cache = cache.ResponseCache(str(tmpdir))
+    previous = upstream.set_cache(response_cache)
+    yield response_cache
+    upstream.set_cache(previous)
+
+
+def test_make_session_uses_pooled_adapter():
+    session = upstream.make_session(pool_connections=3, pool_maxsize=7)
+
+    adapter = session.get_adapter('https://api.github.com/')
+
+    assert adapter is session.get_adapter('http://sources.debian.net/')
+    assert adapter._pool_connections == 3
+    assert adapter._pool_maxsize == 7
+
+
+def test_make_session_sets_default_headers():
+    session = upstream.make_session(headers={'X-Foo': 'bar'})
+
+    assert session.headers['User-Agent'].startswith('Mopidy-Packages/')
+    assert session.headers['Accept'] == 'application/json'
+    assert session.headers['X-Foo'] == 'bar'
+
+
+def test_get_session_is_shared():
+    assert upstream.get_session() is upstream.get_session()
+
+
+def test_reserve_connections_grows_pools_of_default_session(monkeypatch):
+    monkeypatch.setattr(upstream, '_pool_maxsize', upstream.POOL_MAXSIZE)
+    previous = upstream.set_session(None)
+    try:
+        upstream.get_session()
+        upstream.reserve_connections(32)
+
+        adapter = upstream.get_session().get_adapter('https://example.com/')
+
+        assert adapter._pool_maxsize == 32
+    finally:
+        upstream.set_session(previous)
+
+
+def test_reserve_connections_keeps_configured_session(
+        session_mock, monkeypatch):
+    monkeypatch.setattr(upstream, '_pool_maxsize', upstream.POOL_MAXSIZE)
+
+    upstream.reserve_connections(32)
+
+    assert upstream.get_session() is session_mock
+
+
+def test_set_session_is_used_by_get(session_mock):
+    upstream.get('https://example.com/')
+
+    session_mock.get.assert_called_once_with(
+        'https://example.com/', timeout=upstream.DEFAULT_TIMEOUT)
+
+
+def test_set_session_is_used_by_enrichers(session_mock):
+    session_mock.get.return_value.status_code = 404
+
+    models.add_discuss_profile({'profiles': {'discuss': 'alice'}})
+
+    session_mock.get.assert_called_once_with(
+        'https://discuss.mopidy.com/users/alice.json', timeout=5)
+
+
+@responses.activate
+def test_post_is_not_cached(response_cache):
+    responses.add(responses.POST, 'https://example.com/', json={})
+
+    upstream.post('https://example.com/', json={'query': 'foo'})
+    upstream.post('https://example.com/', json={'query': 'foo'})
+
+    assert len(responses.calls) == 2
+    assert response_cache.get('https://example.com/') is None
+
+
+@responses.activate
+def test_get_serves_fresh_response_from_cache(response_cache):
+    responses.add(
+        responses.GET, 'https://example.com/', json={'foo': 'bar'},
+        status=200, headers={'ETag': '"abc"'})
+
+    upstream.get('https://example.com/')
+    response = upstream.get('https://example.com/')
+
+    assert response.json() == {'foo': 'bar'}
+    assert len(responses.calls) == 1
+
+
+@responses.activate
+def test_get_revalidates_stale_response(response_cache):
+    response_cache.ttls['example.com'] = 0
+    responses.add(
+        responses.GET, 'https://example.com/', json={'foo': 'bar'},
+        status=200, headers={'ETag': '"abc"'})
+    responses.add(responses.GET, 'https://example.com/', status=304)
+
+    upstream.get('https://example.com/')
+    response = upstream.get('https://example.com/')
+
+    assert response.status_code == 200
+    assert response.json() == {'foo': 'bar'}
+    assert len(responses.calls) == 2
+    assert responses.calls[1].request.headers['If-None-Match'] == '"abc"'
+
+
+@responses.activate
+def test_get_does_not_cache_failed_responses(response_cache):
+    responses.add(responses.GET, 'https://example.com/', status=500)
+
+    upstream.get('https://example.com/')
+
+    assert response_cache.get('https://example.com/') is None
+
+
+@responses.activate
+def test_get_retries_failed_requests():
+    responses.add(responses.GET, 'https://example.com/', status=502)
+    responses.add(responses.GET, 'https://example.com/', json={})
+
+    response = upstream.get('https://example.com/')
+
+    assert response.status_code == 200
+    assert len(responses.calls) == 2
+
+
+@responses.activate
+def test_get_gives_up_after_max_retries():
+    responses.add(responses.GET, 'https://example.com/', status=500)
+
+    response = upstream.get('https://example.com/')
+
+    assert response.status_code == 500
+    assert len(responses.calls) == ratelimit.MAX_RETRIES + 1
+
+
+@responses.activate
+def test_get_returns_degraded_response_on_connection_errors():
+    responses.add(
+        responses.GET, 'https://example.com/',
+        body=requests.ConnectionError('Connection refused'))
+
+    with upstream.recording() as fetched:
+        response = upstream.get('https://example.com/')
+
+    assert response.status_code == 503
+    assert upstream.is_degraded(response)
+    assert fetched == {'https://example.com/': None}
+    assert fetched.degraded
+
+
+@responses.activate
+def test_get_skips_host_with_open_circuit():
+    responses.add(responses.GET, 'https://example.com/', status=500)
+
+    for _ in range(circuit.FAILURE_THRESHOLD):
+        with deadline.limit(10):
+            upstream.get('https://example.com/')
+    response = upstream.get('https://example.com/foo')
+
+    assert upstream.is_degraded(response)
+    assert len(responses.calls) == circuit.FAILURE_THRESHOLD
+
+
+@responses.activate
+def test_get_is_not_retried_within_a_deadline():
+    responses.add(responses.GET, 'https://example.com/', status=500)
+
+    with deadline.limit(10):
+        response = upstream.get('https://example.com/')
+
+    assert response.status_code == 500
+    assert len(responses.calls) == 1
+
+
+def test_get_is_not_sent_after_the_deadline(session_mock):
+    with deadline.limit(0):
+        response = upstream.get('https://example.com/')
+
+    assert upstream.is_degraded(response)
+    assert session_mock.get.call_count == 0
+
+
+def test_get_times_out_at_the_deadline(session_mock):
+    session_mock.get.return_value.status_code = 200
+    upstream.set_host_timeout('example.com', 20)
+
+    with deadline.limit(2):
+        upstream.get('https://example.com/')
+    upstream.set_host_timeout('example.com', None)
+
+    timeout = session_mock.get.call_args[1]['timeout']
+    assert 1 < timeout <= 2
+
+
+def test_get_does_not_wait_for_rate_limit_beyond_the_deadline(session_mock):
+    scheduler = upstream.get_scheduler('example.com')
+    scheduler.blocked_until = time.time() + 3
+
+    start = time.monotonic()
+    with deadline.limit(1):
+        response = upstream.get('https://example.com/')
+
+    assert time.monotonic() - start < 1
+    assert upstream.is_degraded(response)
+    assert session_mock.get.call_count == 0
+
+
+def test_get_does_not_wait_for_host_limit_beyond_the_deadline(session_mock):
+    upstream.set_host_limit('example.com', 1)
+    upstream._host_semaphores['example.com'].acquire()
+    try:
+        with deadline.limit(0.1):
+            response = upstream.get('https://example.com/')
+    finally:
+        upstream.set_host_limit('example.com', None)
+
+    assert upstream.is_degraded(response)
+    assert session_mock.get.call_count == 0
+
+
+def test_trial_request_is_released_if_not_sent(session_mock):
+    breaker = upstream.get_breaker('example.com')
+    breaker.opened_at = time.monotonic() - circuit.COOL_DOWN
+    scheduler = upstream.get_scheduler('example.com')
+    scheduler.blocked_until = time.time() + 3600
+
+    with pytest.raises(ratelimit.RateLimitExhausted):
+        upstream.get('https://example.com/')
+
+    assert breaker.allow()
+
+
+def test_timeout_at_own_deadline_is_not_a_host_failure(session_mock):
+    session_mock.get.side_effect = requests.Timeout('Read timed out')
+    breaker = upstream.get_breaker('example.com')
+
+    with deadline.limit(1):
+        upstream.get('https://example.com/')
+
+    assert breaker.failures == 0
+
+    upstream.get('https://example.com/')
+
+    assert breaker.failures == 1
+
+
+def test_degraded_response_gives_enrichers_empty_sources(session_mock):
+    session_mock.get.side_effect = requests.Timeout('Read timed out')
+
+    result = models.add_discuss_profile({'profiles': {'discuss': 'alice'}})
+
+    assert result['sources'] == []
+    assert result['username'] == 'alice'
+
+
+@responses.activate
+def test_get_stops_when_rate_limit_is_exhausted():
+    responses.add(
+        responses.GET, 'https://api.github.com/repos/foo', status=403,
+        headers={
+            'X-RateLimit-Remaining': '0',
+            'X-RateLimit-Reset': '99999999999',
+        })
+
+    with pytest.raises(ratelimit.RateLimitExhausted):
+        upstream.get('https://api.github.com/repos/foo')
+    with pytest.raises(ratelimit.RateLimitExhausted):
+        upstream.get('https://api.github.com/repos/bar')
+
+    assert len(responses.calls) == 1
+
+
+@responses.activate
+def test_get_is_degraded_when_rate_limit_is_exhausted_within_deadline():
+    responses.add(
+        responses.GET, 'https://api.github.com/repos/foo', status=403,
+        headers={
+            'X-RateLimit-Remaining': '0',
+            'X-RateLimit-Reset': '99999999999',
+        })
+
+    with deadline.limit(5):
+        first = upstream.get('https://api.github.com/repos/foo')
+        second = upstream.get('https://api.github.com/repos/bar')
+
+    assert upstream.is_degraded(first)
+    assert upstream.is_degraded(second)
+    assert len(responses.calls) == 1
+
+
+def test_set_max_wait_updates_schedulers():
+    scheduler = upstream.get_scheduler('example.com')
+
+    upstream.set_max_wait(123)
+    try:
+        assert scheduler.max_wait == 123
+        assert upstream.get_scheduler('example.org').max_wait == 123
+    finally:
+        upstream.set_max_wait(ratelimit.DEFAULT_MAX_WAIT)
+
+
+@responses.activate
+def test_recording_collects_validators_of_fetched_resources():
+    responses.add(
+        responses.GET, 'https://example.com/a', body='a',
+        status=200, headers={'ETag': '"abc"'})
+    responses.add(responses.GET, 'https://example.com/b', status=404)
+
+    with upstream.recording() as fetched:
+        upstream.get('https://example.com/a')
+        upstream.get('https://example.com/b')
+    upstream.get('https://example.com/a')
+
+    assert fetched == {
+        'https://example.com/a': {
+            'etag': '"abc"',
+            'last_modified': None,
+            'digest': (
+                'ca978112ca1bbdcafac231b39a23dc4d'
+                'a786eff8147c4e72b9807785afee48bb'),
+        },
+        'https://example.com/b': None,
+    }
+
+
+def test_recording_follows_context_into_enricher_threads():
+    project = models.Project(id='mopidy-spotify')
+    project._enrichers = {
+        'distribution.github': models.add_github_repo,
+        'distribution.pypi': models.add_pypi_info,
+    }
+
+    with responses.RequestsMock() as rsps:
+        rsps.add(
+            responses.GET,
+            'https://api.github.com/repos/mopidy/mopidy-spotify',
+            status=404)
+        rsps.add(
+            responses.GET,
+            'https://pypi.python.org/pypi/Mopidy-Spotify/json',
+            status=404)
+        with upstream.recording() as fetched:
+            project.enrich()
+
+    assert set(fetched) == {
+        'https://api.github.com/repos/mopidy/mopidy-spotify',
+        'https://pypi.python.org/pypi/Mopidy-Spotify/json',
+    }
+
+
+@responses.activate
+def test_has_changed_with_not_modified_response():
+    responses.add(responses.GET, 'https://example.com/', status=304)
+
+    assert not upstream.has_changed('https://example.com/', {
+        'etag': '"abc"', 'last_modified': None, 'digest': 'foo'})
+    assert responses.calls[0].request.headers['If-None-Match'] == '"abc"'
+
+
+@responses.activate
+def test_has_changed_with_modified_response():
+    responses.add(
+        responses.GET, 'https://example.com/', body='new',
+        status=200, headers={'ETag': '"def"'})
+
+    assert upstream.has_changed('https://example.com/', {
+        'etag': '"abc"', 'last_modified': None, 'digest': 'foo'})
+
+
+def test_has_changed_without_previous_validators():
+    assert upstream.has_changed('https://example.com/', None)
+
+
+def test_find_changed_checks_each_resource_once_in_parallel(session_mock):
+    barrier = threading.Barrier(2, timeout=5)
+
+    def get(url, **kwargs):
+        barrier.wait()
+        response = requests.Response()
+        response.status_code = 304
+        return response
+
+    session_mock.get.side_effect = get
+    validators = {'etag': '"abc"', 'last_modified': None, 'digest': 'foo'}
+
+    changed = upstream.find_changed([
+        ('https://example.com/a', validators),
+        ('https://example.com/b', validators),
+        ('https://example.com/a', validators),
+        ('https://example.com/c', None),
+    ], jobs=2)
+
+    assert changed == [False, False, False, True]
+    assert session_mock.get.call_count == 2
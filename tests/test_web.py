@@ -1,6 +1,13 @@
+import gzip
 import json
+import re
+import time
+import urllib.parse
+from unittest import mock
 
-from mopidy_packages import models
+import responses
+
+from mopidy_packages import enrichment, models, ratelimit, web
 
 
 def test_index_redirects_to_api(app):
@@ -144,3 +151,427 @@ def test_get_project_fails(app, models_mock):
     response = app.get('/api/projects/mopidy-spotify/')
 
     assert response.status_code == 500
+
+
+def test_list_projects_is_not_enriched_by_default(app, engine_run_mock):
+    response = app.get('/api/projects/')
+
+    assert response.status_code == 200
+    assert engine_run_mock.call_count == 0
+
+
+def test_list_projects_enriched_from_all_sources(app, engine_run_mock):
+    response = app.get('/api/projects/?enrich=1')
+
+    assert response.status_code == 200
+    engine, objs, sources = engine_run_mock.call_args[0]
+    assert sorted(obj.data['id'] for obj in objs) == [
+        'mopidy-dirble', 'mopidy-spotify']
+    for obj in objs:
+        assert sources[obj] == {'github', 'pypi', 'aur', 'apt'}
+
+
+def test_list_projects_enriched_from_some_sources(app, engine_run_mock):
+    response = app.get('/api/projects/?enrich=github,pypi')
+
+    assert response.status_code == 200
+    engine, objs, sources = engine_run_mock.call_args[0]
+    for obj in objs:
+        assert sources[obj] == {'github', 'pypi'}
+
+
+def test_list_projects_enriched_from_unknown_source(app, engine_run_mock):
+    response = app.get('/api/projects/?enrich=github,foo')
+
+    assert response.status_code == 400
+    assert b'Unknown sources: foo' in response.data
+    assert engine_run_mock.call_count == 0
+
+
+def test_list_people_enriched(app):
+    response = app.get('/api/people/?enrich=twitter')
+
+    assert response.status_code == 200
+
+    data = json.loads(response.data.decode('utf-8'))
+    person = [p for p in data['people'] if p['id'] == 'jodal'][0]
+    assert person['twitter']['url'] == 'https://twitter.com/jodal'
+    assert 'updated_at' in person
+    assert 'github' not in person
+
+
+def test_get_project_when_rate_limit_is_exhausted(app, project_enrich_mock):
+    project_enrich_mock.side_effect = ratelimit.RateLimitExhausted(
+        'api.github.com', 120.5)
+
+    response = app.get('/api/projects/mopidy-spotify/')
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '121'
+    assert b'api.github.com' in response.data
+
+
+@responses.activate
+def test_get_project_is_degraded_when_rate_limit_is_exhausted(app):
+    responses.add(
+        responses.GET, re.compile(r'https://api\.github\.com/.*'),
+        status=403, headers={
+            'X-RateLimit-Remaining': '0',
+            'X-RateLimit-Reset': '99999999999',
+        })
+
+    for id in ['mopidy-spotify', 'mopidy-dirble']:
+        response = app.get('/api/projects/%s/' % id)
+
+        assert response.status_code == 200
+        assert response.json['github']['sources'] == []
+
+
+def test_list_projects_has_validators(app):
+    response = app.get('/api/projects/')
+
+    assert response.status_code == 200
+    assert response.headers['ETag'].startswith('W/"')
+    assert response.last_modified is not None
+    assert response.headers['Vary'] == 'Accept, Accept-Encoding'
+
+
+def test_list_projects_with_matching_etag_is_not_modified(app):
+    etag = app.get('/api/projects/').headers['ETag']
+
+    response = app.get('/api/projects/', headers={'If-None-Match': etag})
+
+    assert response.status_code == 304
+    assert response.data == b''
+
+
+def test_list_projects_with_other_etag_is_sent(app):
+    response = app.get('/api/projects/', headers={'If-None-Match': 'W/"foo"'})
+
+    assert response.status_code == 200
+
+
+@mock.patch.object(web.enrichment, 'enrich')
+def test_get_project_not_modified_since_last_update(enrich_mock, app):
+    last_modified = app.get('/api/projects/mopidy-spotify/').headers[
+        'Last-Modified']
+
+    response = app.get(
+        '/api/projects/mopidy-spotify/',
+        headers={'If-Modified-Since': last_modified})
+
+    assert response.status_code == 304
+
+
+def test_last_modified_uses_enrichment_time_if_later():
+    project = models.Project(id='mopidy-spotify')
+    project.fetched_at = 4102444800  # 2100-01-01
+
+    assert web.last_modified([project]).year == 2100
+
+
+@mock.patch.object(web.enrichment, 'enrich')
+def test_get_person_last_modified_follows_project_files(enrich_mock, app):
+    registry = models.Project.get_registry()
+    list(registry.all())
+    registry.changed_at = 4102444800  # 2100-01-01
+
+    response = app.get('/api/people/jodal/')
+
+    assert response.last_modified.year == 2100
+
+
+def test_list_last_modified_follows_removed_files(app):
+    registry = models.Person.get_registry()
+    list(registry.all())
+    registry.changed_at = 4102444800  # 2100-01-01
+
+    response = app.get('/api/people/?q=nobody')
+
+    assert response.json['people'] == []
+    assert response.last_modified.year == 2100
+
+
+def test_last_modified_advances_when_any_source_is_refreshed(app):
+    now = time.time()
+    project = models.Project(id='mopidy-spotify')
+    enrichment.cache.put(project, [('apt', 'apt')], {}, fetched_at=now)
+    enrichment.cache.put(project, [('github', 'old')], {}, fetched_at=now)
+    with mock.patch.object(models.Project, 'get_enrichers') as get_mock:
+        get_mock.return_value = [('apt', None), ('github', None)]
+        first = app.get('/api/projects/mopidy-spotify/')
+        enrichment.cache.put(
+            project, [('github', 'new')], {}, fetched_at=now + 10)
+
+        response = app.get(
+            '/api/projects/mopidy-spotify/',
+            headers={'If-Modified-Since': first.headers['Last-Modified']})
+
+    assert response.status_code == 200
+    assert response.json['github'] == 'new'
+    assert response.json['updated_at'] == first.json['updated_at']
+
+
+@mock.patch.object(web, 'COMPRESS_MIN_SIZE', 100)
+def test_list_projects_is_compressed_if_accepted(app):
+    plain = app.get('/api/projects/')
+
+    response = app.get(
+        '/api/projects/', headers={'Accept-Encoding': 'gzip, br'})
+
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['ETag'] == plain.headers['ETag']
+    assert gzip.decompress(response.data) == plain.data
+    assert int(response.headers['Content-Length']) == len(response.data)
+
+
+def test_small_responses_are_not_compressed(app):
+    response = app.get('/api/', headers={'Accept-Encoding': 'gzip'})
+
+    assert 'Content-Encoding' not in response.headers
+
+
+def get_json(app, url):
+    response = app.get(url)
+    assert response.status_code == 200
+    return json.loads(response.data.decode('utf-8'))
+
+
+def test_list_projects_is_ordered_by_id(app):
+    data = get_json(app, '/api/projects/')
+
+    assert [p['id'] for p in data['projects']] == [
+        'mopidy-dirble', 'mopidy-spotify']
+    assert 'next' not in data
+
+
+def test_list_projects_paginated(app):
+    first = get_json(app, '/api/projects/?limit=1&fields=id')
+
+    assert first['projects'] == [{'id': 'mopidy-dirble'}]
+    assert 'limit=1' in first['next']
+    assert 'fields=id' in first['next']
+
+    second = get_json(app, first['next'])
+
+    assert second['projects'] == [{'id': 'mopidy-spotify'}]
+    assert second['next'] is None
+
+
+def test_list_projects_with_invalid_limit(app):
+    assert app.get('/api/projects/?limit=0').status_code == 400
+    assert app.get('/api/projects/?limit=foo').status_code == 400
+    assert app.get('/api/projects/?limit=100000').status_code == 400
+
+
+def test_list_projects_with_invalid_cursor(app):
+    response = app.get('/api/projects/?cursor=%%%')
+
+    assert response.status_code == 400
+
+
+def test_list_projects_with_fields(app):
+    data = get_json(app, '/api/projects/?fields=id,name,status')
+
+    for project in data['projects']:
+        assert set(project) == {'id', 'name', 'status'}
+
+
+def test_list_projects_with_fields_only_links_requested_fields(app):
+    data = get_json(app, '/api/projects/?fields=id,maintainers,url')
+
+    project = data['projects'][1]
+    assert project['url'].endswith('/api/projects/mopidy-spotify/')
+    assert project['maintainers']['jodal'].endswith('/api/people/jodal/')
+
+
+def test_list_people_with_fields(app):
+    data = get_json(app, '/api/people/?fields=name')
+
+    assert data['people'] == [
+        {'name': 'Thomas Adamcik'}, {'name': 'Stein Magnus Jodal'}]
+
+
+def test_list_projects_filtered(app):
+    data = get_json(
+        app, '/api/projects/?status=active&has=aur&maintainer=jodal')
+
+    assert [p['id'] for p in data['projects']] == ['mopidy-spotify']
+
+
+def test_list_projects_searched(app):
+    data = get_json(app, '/api/projects/?q=dirble&fields=id')
+
+    assert data['projects'] == [{'id': 'mopidy-dirble'}]
+
+
+def test_list_projects_filtered_without_matches(app):
+    data = get_json(app, '/api/projects/?has=aur&has=nix')
+
+    assert data['projects'] == []
+
+
+def test_list_projects_filtered_and_paginated(app):
+    first = get_json(app, '/api/projects/?q=mopidy&limit=1&fields=id')
+
+    assert first['projects'] == [{'id': 'mopidy-dirble'}]
+    assert 'q=mopidy' in first['next']
+
+    second = get_json(app, first['next'])
+
+    assert second['projects'] == [{'id': 'mopidy-spotify'}]
+    assert second['next'] is None
+
+
+def test_list_projects_paginated_keeps_repeated_filters(app):
+    first = get_json(app, '/api/projects/?has=pypi&has=github&limit=1')
+    query = urllib.parse.parse_qs(urllib.parse.urlsplit(first['next']).query)
+
+    assert query['has'] == ['pypi', 'github']
+    assert query['limit'] == ['1']
+    assert len(query['cursor']) == 1
+
+    second = get_json(app, first['next'])
+
+    assert second['projects'][0]['id'] == 'mopidy-spotify'
+    assert second['next'] is None
+
+
+def test_list_projects_ignores_empty_filters(app):
+    for query in ['q=', 'q=+-', 'status=', 'has=']:
+        data = get_json(app, '/api/projects/?fields=id&' + query)
+
+        assert data['projects'] == [
+            {'id': 'mopidy-dirble'}, {'id': 'mopidy-spotify'}]
+
+
+def test_list_people_ignores_empty_search(app):
+    data = get_json(app, '/api/people/?q=&fields=id')
+
+    assert data['people'] == [{'id': 'adamcik'}, {'id': 'jodal'}]
+
+
+def test_list_people_filtered(app):
+    data = get_json(app, '/api/people/?q=stein&has=github&fields=id')
+
+    assert data['people'] == [{'id': 'jodal'}]
+
+
+def test_get_person_lists_maintained_projects(app, person_enrich_mock):
+    person = get_json(app, '/api/people/jodal/')
+
+    assert list(person['projects']) == ['mopidy-spotify']
+    assert person['projects']['mopidy-spotify'].endswith(
+        '/api/projects/mopidy-spotify/')
+
+
+def test_get_person_fails_if_projects_are_invalid(app, person_enrich_mock):
+    with mock.patch('mopidy_packages.search.maintained_projects') as mp_mock:
+        mp_mock.side_effect = models.ModelException('foo')
+
+        response = app.get('/api/people/jodal/')
+
+    assert response.status_code == 500
+    assert response.content_type.startswith('text/plain')
+    assert response.data == b'foo'
+
+
+def test_list_person_projects(app):
+    data = get_json(app, '/api/people/adamcik/projects/?fields=id,url')
+
+    assert data['projects'] == [{
+        'id': 'mopidy-dirble',
+        'url': 'http://localhost/api/projects/mopidy-dirble/',
+    }]
+
+
+def test_list_person_projects_of_unknown_person(app):
+    assert app.get('/api/people/nobody/projects/').status_code == 404
+
+
+def test_list_projects_streamed(app):
+    response = app.get('/api/projects/?stream=1')
+
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.mimetype == 'application/json'
+    assert 'ETag' not in response.headers
+    data = json.loads(response.data.decode('utf-8'))
+    assert data == get_json(app, '/api/projects/')
+
+
+def test_list_projects_streamed_and_paginated(app):
+    data = get_json(app, '/api/projects/?stream=1&limit=1&fields=id')
+
+    assert data['projects'] == [{'id': 'mopidy-dirble'}]
+    assert 'stream=1' in data['next']
+    assert get_json(app, data['next'])['next'] is None
+
+
+def test_list_projects_as_ndjson(app):
+    response = app.get(
+        '/api/projects/?fields=id&limit=1',
+        headers={'Accept': 'application/x-ndjson'})
+
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.mimetype == 'application/x-ndjson'
+    assert response.data == b'{"id": "mopidy-dirble"}\n'
+    assert response.headers['Link'].startswith('<http://localhost/api/')
+    assert response.headers['Link'].endswith('>; rel="next"')
+
+
+def test_list_people_as_ndjson(app):
+    response = app.get(
+        '/api/people/?fields=id', headers={'Accept': 'application/x-ndjson'})
+
+    lines = response.data.decode('utf-8').splitlines()
+    assert [json.loads(line) for line in lines] == [
+        {'id': 'adamcik'}, {'id': 'jodal'}]
+    assert 'Link' not in response.headers
+
+
+def test_streamed_list_is_enriched_a_chunk_at_a_time(app):
+    with mock.patch.object(web, 'STREAM_CHUNK_SIZE', 1), \
+            mock.patch.object(web.enrichment, 'enrich_many') as enrich_mock:
+        response = app.get('/api/projects/?stream=1&enrich=1')
+        assert enrich_mock.call_count == 0
+
+        response.get_data()
+
+    assert enrich_mock.call_count == 2
+    assert [len(call[0][0]) for call in enrich_mock.call_args_list] == [1, 1]
+
+
+def test_streamed_list_fails_before_streaming(app, models_mock):
+    models_mock.Project.all.side_effect = models.ModelException('foo')
+
+    response = app.get('/api/projects/?stream=1')
+
+    assert response.status_code == 500
+
+
+def test_get_person_enriched_from_some_sources(app):
+    person = get_json(app, '/api/people/jodal/?sources=twitter')
+
+    assert person['twitter']['url'] == 'https://twitter.com/jodal'
+    assert 'github' not in person
+    assert 'discuss' not in person
+
+
+def test_get_project_enriched_from_some_sources(app):
+    with mock.patch.object(web.enrichment, 'enrich') as enrich_mock:
+        response = app.get('/api/projects/mopidy-spotify/?sources=pypi,apt')
+
+    assert response.status_code == 200
+    project, sources = enrich_mock.call_args[0]
+    assert sources == {'pypi', 'apt'}
+    assert project.data['distribution']['pypi'] == 'Mopidy-Spotify'
+
+
+def test_get_project_enriched_from_unknown_source(app):
+    with mock.patch.object(web.enrichment, 'enrich') as enrich_mock:
+        response = app.get('/api/projects/mopidy-spotify/?sources=foo')
+
+    assert response.status_code == 400
+    assert enrich_mock.call_count == 0
@@ -1,3 +1,4 @@
+import gzip
 import json
 
 
@@ -25,3 +26,137 @@ def test_path_returns_correct_file_as_json(static_app, tmpdir):
 
     data = json.loads(response.data.decode('utf-8'))
     assert data == {'foo': 'bar'}
+
+
+def write_site(tmpdir, etag='abc'):
+    tmpdir.mkdir('foo').join('index.html').write(json.dumps({'foo': 'bar'}))
+    tmpdir.join('manifest.json').write(json.dumps({'pages': {
+        '/foo/': {'etag': etag},
+    }}))
+
+
+def test_path_has_etag_from_manifest_and_cache_headers(static_app, tmpdir):
+    write_site(tmpdir)
+
+    response = static_app.get('/foo/')
+
+    assert response.status_code == 200
+    assert response.headers['ETag'] == '"abc"'
+    assert 'Last-Modified' in response.headers
+    assert response.cache_control.public
+    assert response.cache_control.max_age == 300
+
+
+def test_path_without_manifest_has_etag(static_app, tmpdir):
+    tmpdir.mkdir('foo').join('index.html').write('{}')
+
+    response = static_app.get('/foo/')
+
+    assert response.status_code == 200
+    assert response.headers['ETag']
+
+
+def test_path_with_matching_etag_is_not_modified(static_app, tmpdir):
+    write_site(tmpdir)
+
+    response = static_app.get('/foo/', headers={'If-None-Match': '"abc"'})
+
+    assert response.status_code == 304
+    assert response.data == b''
+
+
+def test_path_with_other_etag_is_sent(static_app, tmpdir):
+    write_site(tmpdir)
+
+    response = static_app.get('/foo/', headers={'If-None-Match': '"def"'})
+
+    assert response.status_code == 200
+
+
+def test_path_not_modified_since(static_app, tmpdir):
+    write_site(tmpdir)
+    last_modified = static_app.get('/foo/').headers['Last-Modified']
+
+    response = static_app.get(
+        '/foo/', headers={'If-Modified-Since': last_modified})
+
+    assert response.status_code == 304
+
+
+def test_path_reloads_etags_when_manifest_changes(static_app, tmpdir):
+    write_site(tmpdir)
+    static_app.get('/foo/')
+    tmpdir.join('manifest.json').write(json.dumps({'pages': {
+        '/foo/': {'etag': 'defgh'},
+    }}))
+
+    response = static_app.get('/foo/')
+
+    assert response.headers['ETag'] == '"defgh"'
+
+
+def test_path_outside_site_dir(static_app, tmpdir):
+    response = static_app.get('/../../etc/')
+
+    assert response.status_code == 404
+
+
+def write_compressed_site(tmpdir):
+    write_site(tmpdir)
+    content = tmpdir.join('foo', 'index.html').read_binary()
+    tmpdir.join('foo', 'index.html.gz').write_binary(gzip.compress(content))
+    tmpdir.join('foo', 'index.html.br').write_binary(b'brotli')
+
+
+def test_path_sends_best_accepted_encoding(static_app, tmpdir):
+    write_compressed_site(tmpdir)
+
+    response = static_app.get(
+        '/foo/', headers={'Accept-Encoding': 'gzip, deflate, br'})
+
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'br'
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert response.headers['ETag'] == '"abc-br"'
+    assert response.mimetype == 'application/json'
+    assert response.data == b'brotli'
+
+
+def test_path_sends_gzip_variant(static_app, tmpdir):
+    write_compressed_site(tmpdir)
+
+    response = static_app.get(
+        '/foo/', headers={'Accept-Encoding': 'gzip;q=1.0, br;q=0.5'})
+
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['ETag'] == '"abc-gzip"'
+    assert json.loads(gzip.decompress(response.data).decode('utf-8')) == {
+        'foo': 'bar'}
+
+
+def test_path_sends_identity_if_no_encoding_is_accepted(static_app, tmpdir):
+    write_compressed_site(tmpdir)
+
+    response = static_app.get('/foo/', headers={'Accept-Encoding': 'br;q=0'})
+
+    assert 'Content-Encoding' not in response.headers
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert response.headers['ETag'] == '"abc"'
+
+
+def test_path_with_missing_variant(static_app, tmpdir):
+    write_site(tmpdir)
+
+    response = static_app.get('/foo/', headers={'Accept-Encoding': 'br'})
+
+    assert 'Content-Encoding' not in response.headers
+    assert json.loads(response.data.decode('utf-8')) == {'foo': 'bar'}
+
+
+def test_path_with_matching_variant_etag_is_not_modified(static_app, tmpdir):
+    write_compressed_site(tmpdir)
+
+    response = static_app.get('/foo/', headers={
+        'Accept-Encoding': 'gzip', 'If-None-Match': '"abc-gzip"'})
+
+    assert response.status_code == 304